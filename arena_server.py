@@ -0,0 +1,331 @@
+"""Asyncio server hosting many pyRL fights in one process.
+
+Each arena is a player ``Entity`` against an NPC ``Entity`` driven by its
+own ``CombatEngine`` and ``CombatLog``. One scheduler task advances every
+arena together, once per ``TICK_INTERVAL``, stepping each fight event by
+event up to the current time exactly like the interactive loop does.
+Arenas hold no per-tick history: the log is a fixed-size ring and the
+last HUD state sent, so memory per fight stays bounded however long it
+runs.
+
+Clients connect over TCP or a Unix socket and speak newline-delimited
+JSON. A client sends ``{"op": "join", "toon": "Athena", "npc": 1}`` once,
+then ``{"op": "key", "key": "z"}`` for each keypress (the keys of the
+interactive game, ``q`` forfeits). Every ``HUD_FRAME_INTERVAL`` the server
+sends the HUD fields that changed since the last message (``hp``,
+``bars``, ``queued``, ``effects``, ...) plus any new log lines as plain
+text, and a final message with ``"over": true`` when the fight ends. A
+client that stops reading has its updates skipped, not queued; the next
+update it gets carries everything that changed meanwhile.
+
+``python arena_server.py --port 7077`` serves TCP, ``--unix PATH`` a Unix
+socket. ``python arena_server.py --bots 5000 --duration 10`` fills the
+server with scripted fights and reports the tick cost and the memory per
+arena instead.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import matchups
+import pyRL_uta0628c as rl
+
+TICK_INTERVAL = rl.REFRESH_RATE  # seconds between scheduler ticks
+HUD_EVERY = max(1, round(rl.HUD_FRAME_INTERVAL / TICK_INTERVAL))  # ticks between HUD updates
+MAX_ARENAS = 20000
+MAX_LINE = 1024  # longest client message, in bytes
+WRITE_HIGH_WATER = 64 * 1024  # unsent bytes at which a client's updates are skipped
+DEFAULT_PORT = 7077
+REPORT_INTERVAL = 1.0  # seconds between --bots reports
+
+
+def _encode(message: Dict) -> bytes:
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class Arena:
+    """One fight and what its client was last sent."""
+    __slots__ = ("arena_id", "engine", "log", "last_step", "writer", "sent", "last_entry")
+
+    def __init__(self, arena_id: int, player, opponent, now: float, policy=None,
+                 writer: Optional[asyncio.StreamWriter] = None):
+        self.arena_id = arena_id
+        self.engine = rl.CombatEngine(player, opponent, policy=policy or rl._no_input)
+        self.log = rl.CombatLog(rl.MAX_COMBAT_LOG_ENTRIES)
+        self.last_step = now
+        self.writer = writer
+        self.sent: Dict[str, object] = {}
+        self.last_entry = None
+        previous = rl.use_combat_log(self.log)
+        try:
+            self.engine.start(time.time())
+        finally:
+            rl.use_combat_log(previous)
+
+    def advance(self, now: float) -> bool:
+        """Step the fight up to ``now``, one event at a time; True once it is over."""
+        engine = self.engine
+        remaining = now - self.last_step
+        self.last_step = now
+        previous = rl.use_combat_log(self.log)
+        try:
+            while remaining > 0 and not engine.game_over:
+                delta = min(remaining, engine.time_to_next_event())
+                engine.step(delta)
+                remaining -= delta
+        finally:
+            rl.use_combat_log(previous)
+        return engine.game_over
+
+    def press(self, key: str, now: float) -> bool:
+        """Bring the fight up to ``now``, then handle ``key``; True once it is over."""
+        if self.advance(now):
+            return True
+        previous = rl.use_combat_log(self.log)
+        try:
+            return self.engine.handle_key(key)
+        finally:
+            rl.use_combat_log(previous)
+
+    def state(self) -> Dict[str, object]:
+        engine = self.engine
+        player, opponent = engine.player, engine.opponent
+        return {
+            "elapsed": round(engine.elapsed, 1),
+            "hp": [round(player.current_hp), round(opponent.current_hp)],
+            "max_hp": [round(player.max_hp), round(opponent.max_hp)],
+            "bars": [int(player.attack_bar_progress), int(opponent.attack_bar_progress)],
+            "queued": player.queued_action_key,
+            "effects": [
+                [[e.name, round(entity.effect_time_left(e)), e.is_buff] for e in entity.active_effects]
+                for entity in (player, opponent)
+            ],
+        }
+
+    def delta(self) -> Dict[str, object]:
+        """The HUD fields and log lines that changed since the last delta."""
+        state = self.state()
+        sent = self.sent
+        changed = {key: value for key, value in state.items() if sent.get(key) != value}
+        self.sent = state
+        new_entries: List[Tuple] = []
+        for entry in reversed(self.log.entries):
+            if entry is self.last_entry:
+                break
+            new_entries.append(entry)
+        if new_entries:
+            self.last_entry = new_entries[0]
+            changed["log"] = [rl.format_log_entry(entry, colored=False) for entry in reversed(new_entries)]
+        return changed
+
+    def send_delta(self) -> None:
+        writer = self.writer
+        if writer is None or writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() >= WRITE_HIGH_WATER:
+            return
+        changed = self.delta()
+        if changed:
+            writer.write(_encode(changed))
+
+    def result(self) -> Dict[str, object]:
+        engine = self.engine
+        return {"over": True, "won": engine.player_won, "forfeited": engine.forfeited,
+                "duration": round(engine.elapsed, 1)}
+
+
+class ArenaServer:
+    """Every open arena, advanced together by ``tick``."""
+
+    def __init__(self, max_arenas: int = MAX_ARENAS):
+        matchups._load_tables()
+        self.max_arenas = max_arenas
+        self.arenas: Dict[int, Arena] = {}
+        self.ids = itertools.count(1)
+        self.tick_times = rl.RollingSamples()
+        self.ticks = 0
+        self.finished = 0
+        self._players: Dict[str, object] = {}
+        self._npcs: Dict[int, object] = {}
+
+    def _player(self, toon: str):
+        template = self._players.get(toon)
+        if template is None:
+            if toon not in rl.TOONS_DATA:
+                raise ValueError(f"unknown toon {toon!r}")
+            template = self._players[toon] = rl.Entity(toon, is_player=True)
+            template.load_char_data(rl.TOONS_DATA[toon])
+        return template.clone()
+
+    def _npc(self, npc_id: int):
+        template = self._npcs.get(npc_id)
+        if template is None:
+            if npc_id not in rl.NPCS_DATA:
+                raise ValueError(f"unknown npc {npc_id!r}")
+            template = self._npcs[npc_id] = rl.Entity("npc")
+            template.load_npc_data(rl.NPCS_DATA[npc_id])
+        return template.clone()
+
+    def open_arena(self, toon: str, npc_id: int, policy=None,
+                   writer: Optional[asyncio.StreamWriter] = None) -> Arena:
+        if len(self.arenas) >= self.max_arenas:
+            raise ValueError("server full")
+        if not isinstance(toon, str):
+            raise ValueError(f"unknown toon {toon!r}")
+        try:
+            npc_id = int(npc_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"unknown npc {npc_id!r}") from None
+        player, opponent = self._player(toon), self._npc(npc_id)
+        arena = Arena(next(self.ids), player, opponent, time.monotonic(), policy, writer)
+        self.arenas[arena.arena_id] = arena
+        return arena
+
+    def close_arena(self, arena: Arena) -> None:
+        if self.arenas.pop(arena.arena_id, None) is None:
+            return
+        if arena.engine.game_over:
+            self.finished += 1
+        writer = arena.writer
+        if writer is not None and not writer.is_closing():
+            arena.sent = {}
+            writer.write(_encode({**arena.delta(), **arena.result()}))
+            writer.close()
+
+    def tick(self, now: float) -> None:
+        started = time.perf_counter()
+        send = self.ticks % HUD_EVERY == 0
+        for arena in list(self.arenas.values()):
+            if arena.advance(now):
+                self.close_arena(arena)
+            elif send:
+                arena.send_delta()
+        self.ticks += 1
+        self.tick_times.record(time.perf_counter() - started)
+
+    async def run_ticks(self, after_tick: Optional[Callable[[], None]] = None) -> None:
+        next_tick = time.monotonic()
+        while True:
+            self.tick(time.monotonic())
+            if after_tick is not None:
+                after_tick()
+            # Fixed rate rather than fixed sleep; a late tick is not made up,
+            # the next one simply steps further.
+            next_tick = max(next_tick + TICK_INTERVAL, time.monotonic())
+            await asyncio.sleep(next_tick - time.monotonic())
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        arena: Optional[Arena] = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    op = message.get("op")
+                except (ValueError, AttributeError):
+                    writer.write(_encode({"error": "expected a JSON object"}))
+                    continue
+                if op == "join" and arena is None:
+                    try:
+                        arena = self.open_arena(message.get("toon"), message.get("npc"), writer=writer)
+                    except ValueError as e:
+                        writer.write(_encode({"error": str(e)}))
+                        continue
+                    writer.write(_encode({"arena": arena.arena_id, **arena.delta()}))
+                elif op == "key" and arena is not None:
+                    if arena.arena_id not in self.arenas:
+                        break
+                    if arena.press(str(message.get("key", ""))[:1].lower(), time.monotonic()):
+                        self.close_arena(arena)
+                        break
+                else:
+                    writer.write(_encode({"error": f"unexpected op {op!r}"}))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: a line longer than MAX_LINE.
+            pass
+        finally:
+            if arena is not None:
+                self.arenas.pop(arena.arena_id, None)
+            writer.close()
+
+    def summary(self) -> str:
+        ordered = sorted(self.tick_times.samples)
+        p50 = self.tick_times.percentile(50, ordered) * 1000
+        p99 = self.tick_times.percentile(99, ordered) * 1000
+        per_arena = p50 * 1000 / len(self.arenas) if self.arenas else 0.0
+        return (f"{len(self.arenas)} arenas, {self.finished} fights finished, "
+                f"tick p50 {p50:.2f} ms p99 {p99:.2f} ms ({per_arena:.1f} us per arena), "
+                f"budget {TICK_INTERVAL * 1000:.0f} ms")
+
+
+async def serve(server: ArenaServer, host: str, port: int, unix: Optional[str] = None) -> None:
+    if unix:
+        listener = await asyncio.start_unix_server(server.handle_client, unix, limit=MAX_LINE)
+        where = unix
+    else:
+        listener = await asyncio.start_server(server.handle_client, host, port, limit=MAX_LINE)
+        where = f"{host}:{port}"
+    print(f"serving pyRL arenas on {where}")
+    async with listener:
+        await server.run_ticks()
+
+
+async def run_bots(server: ArenaServer, count: int, duration: float, toon: str, npc_id: int,
+                   keys: Tuple[str, ...]) -> None:
+    """Keep ``count`` scripted fights running for ``duration`` seconds, reporting as they go."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(count):
+        server.open_arena(toon, npc_id, rl.ScriptedPolicy(keys))
+    per_arena = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    print(f"{count} arenas opened, {per_arena / 1024:.1f} KiB each")
+
+    def refill() -> None:
+        for _ in range(count - len(server.arenas)):
+            server.open_arena(toon, npc_id, rl.ScriptedPolicy(keys))
+
+    ticker = asyncio.ensure_future(server.run_ticks(refill))
+    try:
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(REPORT_INTERVAL, max(0.0, deadline - time.monotonic())))
+            print(server.summary())
+    finally:
+        ticker.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", default=None, help="serve on this Unix socket path instead")
+    parser.add_argument("--max-arenas", type=int, default=MAX_ARENAS)
+    parser.add_argument("--bots", type=int, default=0, help="run this many scripted fights, no clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run --bots for")
+    parser.add_argument("--toon", default="Athena", help="--bots player")
+    parser.add_argument("--npc", type=int, default=1, help="--bots opponent")
+    parser.add_argument("--policy", default="rotation", choices=list(matchups.POLICIES),
+                        help="--bots key policy")
+    args = parser.parse_args()
+
+    server = ArenaServer(max(args.max_arenas, args.bots))
+    try:
+        if args.bots:
+            asyncio.run(run_bots(server, args.bots, args.duration, args.toon, args.npc,
+                                 matchups.POLICIES[args.policy]))
+        else:
+            asyncio.run(serve(server, args.host, args.port, args.unix))
+    except ValueError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        print(server.summary())
@@ -0,0 +1,395 @@
+"""Performance benchmarks for the pyRL combat code.
+
+Times startup (``load_csv_data`` on every table and a warm
+``initialize_game_data``), batch stat derivation through
+``derive_player_stats``, ``resolve_attack``,
+``Entity.update_stats_and_effects``, ``Entity.update_active_effects``, whole
+headless fights through ``simulate_fight`` and ``display_hud`` frames. Each
+benchmark is timed like ``timeit``: the batch size grows until a batch takes
+``min_time``, then the fastest of ``repeat`` batches is kept.
+
+Each benchmark batch is preceded by a batch of a fixed pure-Python loop,
+and each result's ``relative`` field is the median, over its batches, of
+its time per operation divided by that loop's in the batch just before.
+Noise such as clock scaling or other load then hits both sides of every
+ratio, and a baseline taken on one machine still means something on
+another. ``compare`` flags every
+benchmark whose relative time grew by more than ``threshold`` over the
+baseline (or whose absolute time did, with ``absolute=True``).
+
+``python benchmarks.py --json bench.json`` runs everything.
+``--baseline benchmarks_baseline.json`` compares against the stored
+baseline and exits with status 1 on regressions. ``--save-baseline`` writes
+a new one.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pyRL_uta0628c as rl
+
+BASELINE_FILE = os.path.join(rl.BASE_DIR, "benchmarks_baseline.json")
+FORMAT_VERSION = 2
+DEFAULT_THRESHOLD = 0.3  # fractional slowdown that counts as a regression
+MIN_TIME = 0.2  # seconds per timed batch
+REPEAT = 7
+BENCH_TOON = "Athena"
+BENCH_NPC = 1
+EFFECT_TICKS = 10  # update_active_effects ticks per fresh copy of the toon
+
+# A benchmark's factory takes a batch size n, does any setup and returns a
+# callable that performs n operations. Only that callable is timed.
+Factory = Callable[[int], Callable[[], None]]
+
+
+@dataclass
+class BenchResult:
+    """Timing of one benchmark."""
+    name: str
+    unit: str  # what one operation is
+    per_op: float  # seconds, fastest batch
+    ops_per_s: float
+    relative: float  # median of batch time over the calibration batch run before it
+    batch: int
+    calibration: float  # seconds per op of the calibration loop, timed alongside
+
+    def format(self) -> str:
+        return (f"{self.name:<22}{self.ops_per_s:>14,.1f}/s{self.per_op * 1e6:>13,.2f} us"
+                f"{self.relative:>12.2f}  {self.unit}")
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        return self.current / self.baseline - 1 if self.baseline else 0.0
+
+
+def _autorange(factory: Factory, min_time: float = MIN_TIME) -> int:
+    """Smallest batch size, growing like ``timeit``, whose batch takes ``min_time``."""
+    n = 1
+    while True:
+        elapsed = _time_batch(factory, n)
+        if elapsed >= min_time or n >= 1 << 24:
+            return n
+        n *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2) + 1))
+
+
+def _time_batch(factory: Factory, n: int) -> float:
+    run = factory(n)
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def time_calibrated(factory: Factory, min_time: float = MIN_TIME, repeat: int = REPEAT):
+    """Time ``factory`` interleaved with the calibration loop.
+
+    Returns ``(seconds per operation, batch size, calibration seconds per
+    operation, relative)``. The two times are the fastest of ``repeat``
+    batches each; ``relative`` is the median ratio of each batch to the
+    calibration batch run right before it, so both sides of every ratio saw
+    the same clock speed and background load.
+    """
+    n = _autorange(factory, min_time)
+    calibration_n = _autorange(_calibration, min_time)
+    times, calibration_times = [], []
+    for _ in range(repeat):
+        calibration_times.append(_time_batch(_calibration, calibration_n) / calibration_n)
+        times.append(_time_batch(factory, n) / n)
+    relative = statistics.median(t / c for t, c in zip(times, calibration_times))
+    return min(times), n, min(calibration_times), relative
+
+
+# --- benchmarks ---
+
+def _calibration(n: int):
+    def run():
+        counts: Dict[int, float] = {}
+        for i in range(n * 100):
+            key = i & 255
+            counts[key] = counts.get(key, 0.0) + i * 0.5
+    return run
+
+
+def _load_tables():
+    if not rl.TOONS_DATA:
+        rl.initialize_game_data()
+
+
+def _toon():
+    toon = rl.Entity(BENCH_TOON, is_player=True)
+    toon.load_char_data(rl.TOONS_DATA[BENCH_TOON])
+    return toon
+
+
+def _npc():
+    npc = rl.Entity("npc")
+    npc.load_npc_data(rl.NPCS_DATA[BENCH_NPC])
+    return npc
+
+
+def _with_effects(entity):
+    # Fills its effect slots with timed effects, HP-changing ones first, applied
+    # as their user for self buffs and debuffs or as their target otherwise.
+    actions = sorted(rl.ALL_ACTIONS.values(), key=lambda a: "HP" not in (
+        a.self_buff_target_stat, a.self_debuff_target_stat, a.enemy_debuff_target_stat))
+    for action in actions:
+        if len(entity.active_effects) >= rl.MAX_ACTIVE_EFFECTS:
+            break
+        if action.duration > 0:
+            as_self = bool(action.self_buff_target_stat or action.self_debuff_target_stat)
+            entity.apply_effect(action, source_entity_is_self=as_self)
+    return entity
+
+
+def bench_load_csv_data(n: int):
+    def run():
+        for _ in range(n):
+            for name in rl.TABLE_KEYS:
+                rl.load_csv_data(rl.CSV_FILES[name], rl.TABLE_KEYS[name], rl.CSV_SCHEMAS[name])
+    return run
+
+
+def bench_initialize_game_data(n: int):
+    rl.initialize_game_data()  # makes sure the table cache is warm
+
+    def run():
+        for _ in range(n):
+            rl.initialize_game_data()
+    return run
+
+
+def bench_derive_player_stats(n: int):
+    templates = []
+    for data in rl.TOONS_DATA.values():
+        toon = rl.Entity(data["Name"], is_player=True)
+        toon.load_char_data(data)
+        templates.append([toon.current_attributes[attr] for attr in rl.ATTRIBUTES])
+    rows = [templates[i % len(templates)] for i in range(n)]
+
+    def run():
+        rl.derive_player_stats(rows)
+    return run
+
+
+def bench_resolve_attack(n: int):
+    random.seed(0)
+    player, npc = _toon(), _npc()
+    player_action = rl.DEFAULT_MELEE_ACTION_ID
+    npc_action = npc.npc_data_source.get("act1")
+
+    def run():
+        for i in range(n):
+            if i & 1:
+                rl.resolve_attack(npc, player, npc_action)
+            else:
+                rl.resolve_attack(player, npc, player_action)
+            player.current_hp = player.max_hp
+            npc.current_hp = npc.max_hp
+    return run
+
+
+def bench_update_stats(n: int):
+    toon = _with_effects(_toon())
+
+    def run():
+        for _ in range(n):
+            toon.update_stats_and_effects()
+    return run
+
+
+def bench_update_active_effects(n: int):
+    template = _with_effects(_toon())
+    copies = [template.clone() for _ in range(n // EFFECT_TICKS + 1)]
+
+    def run():
+        left = n
+        for toon in copies:
+            for _ in range(min(EFFECT_TICKS, left)):
+                toon.update_active_effects(rl.REFRESH_RATE)
+            left -= EFFECT_TICKS
+            if left <= 0:
+                break
+    return run
+
+
+def bench_simulate_fight(n: int):
+    random.seed(0)
+    player, npc = _toon(), _npc()
+    pairs = [(player.clone(), npc.clone()) for _ in range(n)]
+    policy = rl.ScriptedPolicy(("a",))
+
+    def run():
+        for p, o in pairs:
+            rl.simulate_fight(p, o, policy)
+    return run
+
+
+class _NullStream(io.TextIOBase):
+    def write(self, data):
+        return len(data)
+
+
+def bench_display_hud(n: int):
+    random.seed(0)
+    player, npc = _toon(), _npc()
+    engine = rl.CombatEngine(player, npc)
+    engine.start()
+    for _ in range(20):  # fill the combat log
+        engine.step(engine.time_to_next_event())
+    renderer = rl.ScreenRenderer(_NullStream())
+
+    def run():
+        for i in range(n):
+            player.attack_bar_progress = i % 100
+            rl.display_hud(player, npc, renderer)
+    return run
+
+
+BENCHMARKS: Dict[str, tuple] = {
+    "load_csv_data": (bench_load_csv_data, "parse of all four content CSVs"),
+    "initialize_game_data": (bench_initialize_game_data, "startup with a warm table cache"),
+    "derive_player_stats": (bench_derive_player_stats, "one toon's stats in a batch derivation"),
+    "resolve_attack": (bench_resolve_attack, "attack, alternating toon and NPC"),
+    "update_stats": (bench_update_stats, f"update_stats_and_effects, {rl.MAX_ACTIVE_EFFECTS} effects"),
+    "update_active_effects": (bench_update_active_effects, f"effect tick, {rl.MAX_ACTIVE_EFFECTS} effects"),
+    "simulate_fight": (bench_simulate_fight, f"headless fight, {BENCH_TOON} vs npc {BENCH_NPC}"),
+    "display_hud": (bench_display_hud, "HUD frame, composed and rendered"),
+}
+
+
+def run_benchmarks(
+    names: Optional[Sequence[str]] = None, min_time: float = MIN_TIME, repeat: int = REPEAT,
+) -> Dict:
+    """Run the named benchmarks (all by default) and return the JSON document."""
+    names = list(names or BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"unknown benchmark {name!r}; choose from {', '.join(BENCHMARKS)}")
+    _load_tables()
+    results: Dict[str, BenchResult] = {}
+    for name in names:
+        factory, unit = BENCHMARKS[name]
+        per_op, batch, calibration, relative = time_calibrated(factory, min_time, repeat)
+        results[name] = BenchResult(name, unit, per_op, 1 / per_op, relative, batch, calibration)
+    calibration = min(result.calibration for result in results.values())
+    rl.COMBAT_LOG.clear()
+    return {
+        "version": FORMAT_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calibration": calibration,
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+
+
+def compare(
+    current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD, absolute: bool = False,
+) -> List[Regression]:
+    """Benchmarks in both documents that got slower than ``threshold`` allows."""
+    field = "per_op" if absolute else "relative"
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        if result[field] > before[field] * (1 + threshold):
+            regressions.append(Regression(name, before[field], result[field]))
+    return regressions
+
+
+def format_report(current: Dict, baseline: Optional[Dict] = None, absolute: bool = False) -> str:
+    field = "per_op" if absolute else "relative"
+    lines = [f"{'benchmark':<22}{'ops':>16}{'per op':>16}{'relative':>12}"]
+    for name, result in current["results"].items():
+        line = BenchResult(**result).format()
+        before = (baseline or {}).get("results", {}).get(name)
+        if before:
+            line += f"  ({result[field] / before[field] - 1:+.1%} vs baseline)"
+        lines.append(line)
+    lines.append(f"calibration loop: {current['calibration'] * 1e6:.2f} us per op (fastest)")
+    return "\n".join(lines)
+
+
+def load_document(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        document = json.load(f)
+    if document.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported benchmark format {document.get('version')!r}")
+    return document
+
+
+def write_document(document: Dict, path: str) -> None:
+    text = json.dumps(document, indent=2) + "\n"
+    if path == "-":
+        sys.stdout.write(text)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _parse_list(text: str) -> Optional[List[str]]:
+    return [part.strip() for part in text.split(",") if part.strip()] or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default="", help=f"comma separated, from: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--json", default=None, help="write the results here ('-' for stdout)")
+    parser.add_argument("--baseline", default=None,
+                        help=f"compare against this file, e.g. {os.path.basename(BASELINE_FILE)}")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to --baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown as a fraction (default %(default)s)")
+    parser.add_argument("--absolute", action="store_true",
+                        help="compare seconds per op instead of calibrated times")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    try:
+        baseline = None
+        if args.baseline and not args.save_baseline:
+            baseline = load_document(args.baseline)
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull  # the game prints while loading
+            try:
+                document = run_benchmarks(_parse_list(args.only), args.min_time, args.repeat)
+            finally:
+                sys.stdout = stdout
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    if args.json:
+        write_document(document, args.json)
+    if args.json != "-":
+        print(format_report(document, baseline, args.absolute))
+    if args.save_baseline:
+        if not args.baseline:
+            sys.exit("--save-baseline needs --baseline PATH")
+        write_document(document, args.baseline)
+        print(f"wrote baseline to {os.path.abspath(args.baseline)}")
+    elif baseline is not None:
+        regressions = compare(document, baseline, args.threshold, args.absolute)
+        for r in regressions:
+            print(f"REGRESSION {r.name}: {r.baseline:.4g} -> {r.current:.4g} ({r.change:+.1%})",
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions over {args.threshold:.0%}")
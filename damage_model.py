@@ -0,0 +1,235 @@
+"""Exact per-hit damage distribution for pyRL attacks.
+
+``roll_attack`` draws a dodge, a crit and a uniform mitigation roll for
+every hit. All three are simple enough to integrate exactly: mitigation is
+a uniform block (or magic-resist) roll plus the fixed armor factor, capped
+at 95%, so the chance of each rounded damage value is the length of the
+mitigation interval that rounds to it. ``damage_distribution`` returns that
+distribution for an attacker, target and action, and ``expected_dps``
+divides its mean by ``attack_fill_time``.
+
+``sample_damage`` draws hits for cross-checking the closed form. It is
+vectorized with NumPy when NumPy is installed and falls back to calling
+``roll_attack`` in a loop otherwise.
+"""
+
+import argparse
+import math
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pyRL_uta0628c as rl
+
+try:
+    import numpy as np
+except ImportError:  # optional, only used by sample_damage
+    np = None
+
+MAX_MITIGATION = 0.95
+
+
+@dataclass
+class DamageDistribution:
+    """Probability of each final damage value for one use of an action."""
+    action: str
+    probabilities: Dict[int, float]  # damage -> probability, dodges count as 0
+    dodge_chance: float
+    crit_chance: float
+    fill_time: float  # attacker's seconds per attack
+
+    @property
+    def mean(self) -> float:
+        return sum(k * p for k, p in self.probabilities.items())
+
+    @property
+    def variance(self) -> float:
+        mean = self.mean
+        return sum(p * (k - mean) ** 2 for k, p in self.probabilities.items())
+
+    @property
+    def dps(self) -> float:
+        """Expected damage per second from using this action every swing."""
+        return self.mean / self.fill_time if self.fill_time > 0 else 0.0
+
+    def quantile(self, q: float) -> int:
+        total = 0.0
+        for damage in sorted(self.probabilities):
+            total += self.probabilities[damage]
+            if total >= q - 1e-12:
+                return damage
+        return max(self.probabilities, default=0)
+
+    def hits_to_kill(self, hp: float) -> float:
+        """Rough number of swings to deal ``hp`` damage at the mean rate."""
+        return math.inf if self.mean <= 0 else math.ceil(hp / self.mean)
+
+    def format(self, width: int = 40) -> str:
+        lines = [
+            f"{self.action}: mean {self.mean:.2f}, sd {math.sqrt(self.variance):.2f}, "
+            f"dps {self.dps:.2f} (dodge {self.dodge_chance:.1%}, crit {self.crit_chance:.1%})",
+        ]
+        top = max(self.probabilities.values(), default=0)
+        for damage in sorted(self.probabilities):
+            p = self.probabilities[damage]
+            bar = "#" * int(round(width * p / top)) if top else ""
+            lines.append(f"  {damage:>5} {p:>8.4f} {bar}")
+        return "\n".join(lines)
+
+
+def _mitigation_terms(target, is_magic: bool) -> Tuple[float, float, float]:
+    """Return ``(low, high, offset)``: mitigation is offset + uniform(low, high).
+
+    ``low == high`` means the roll is a constant, as when the target's block
+    or resist stat is 1 or below and ``roll_attack`` skips it.
+    """
+    if is_magic:
+        roll = target.mgc_rs_val
+        offset = 0.0
+    else:
+        roll = target.block_val
+        armor = target.armor_val
+        offset = armor / (armor + 200.0) if armor > 0 else 0.0
+    if roll > 1:
+        low, high = sorted((0.01, roll / 100.0))
+        return low, high, offset
+    return 0.0, 0.0, offset
+
+
+def _rounded(damage: float) -> int:
+    return max(0, int(round(damage)))
+
+
+def _mitigated(
+    damage: float, low: float, high: float, offset: float,
+) -> Dict[int, float]:
+    """Distribution of ``round(damage * (1 - m))`` with m = offset + U(low, high), capped."""
+    lo = min(MAX_MITIGATION, max(0.0, offset + low))
+    hi = min(MAX_MITIGATION, max(0.0, offset + high))
+    if hi - lo <= 0 or offset + high == offset + low:
+        return {_rounded(damage * (1 - lo)): 1.0}
+    span = (offset + high) - (offset + low)
+    result: Dict[int, float] = {}
+    # Mass of the roll pushed past the cap lands on the capped value.
+    capped = max(0.0, (offset + high) - MAX_MITIGATION) / span
+    if capped > 0:
+        result[_rounded(damage * (1 - MAX_MITIGATION))] = capped
+    # Damage falls as mitigation rises; walk the integers it can round to.
+    # Every k covers mitigation in [1 - (k + 0.5)/damage, 1 - (k - 0.5)/damage].
+    for k in range(_rounded(damage * (1 - hi)), _rounded(damage * (1 - lo)) + 1):
+        m_low = max(lo, 1 - (k + 0.5) / damage)
+        m_high = min(hi, 1 - (k - 0.5) / damage)
+        if m_high > m_low:
+            result[k] = result.get(k, 0.0) + (m_high - m_low) / span
+    return result
+
+
+def damage_distribution(attacker, target, action) -> DamageDistribution:
+    """Exact distribution of the damage ``roll_attack`` can return.
+
+    ``action`` is an ``Action`` or an id from ``ALL_ACTIONS``. Effects the
+    action applies (damage over time, stat changes) are not included.
+    """
+    if not isinstance(action, rl.Action):
+        action = rl.ALL_ACTIONS[action]
+    dodge = min(1.0, max(0.0, target.dodge_val / 1000.0))
+    crit = min(1.0, max(0.0, attacker.crits_val / 300.0))
+
+    base = 0.0
+    is_magic = False
+    if action.dmg_stat_source == "AtkPw":
+        base = action.base_val + attacker.atk_pw * 0.2
+    elif action.dmg_stat_source == "MgcPw":
+        base = action.base_val + attacker.mgc_pw * 0.2
+        is_magic = True
+
+    probabilities: Dict[int, float] = {0: dodge}
+    if base > 0:
+        low, high, offset = _mitigation_terms(target, is_magic)
+        for multiplier, weight in ((1.0, 1 - crit), (2.0, crit)):
+            if weight <= 0:
+                continue
+            for damage, p in _mitigated(base * multiplier, low, high, offset).items():
+                probabilities[damage] = probabilities.get(damage, 0.0) + (1 - dodge) * weight * p
+    else:
+        probabilities[_rounded(base)] = probabilities.get(_rounded(base), 0.0) + 1 - dodge
+        crit = 0.0
+    return DamageDistribution(
+        action=action.name,
+        probabilities={k: p for k, p in sorted(probabilities.items()) if p > 0},
+        dodge_chance=dodge,
+        crit_chance=crit,
+        fill_time=attacker.attack_fill_time,
+    )
+
+
+def expected_dps(attacker, target, action) -> float:
+    return damage_distribution(attacker, target, action).dps
+
+
+def sample_damage(
+    attacker, target, action, hits: int = 1_000_000, seed: Optional[int] = None,
+) -> List[int]:
+    """Draw ``hits`` final damage values with the ``roll_attack`` rules."""
+    if not isinstance(action, rl.Action):
+        action = rl.ALL_ACTIONS[action]
+    if np is None:
+        rng = random.Random(seed)
+        return [rl.roll_attack(attacker, target, action, rng)[4] for _ in range(hits)]
+
+    gen = np.random.default_rng(seed)
+    is_magic = action.dmg_stat_source == "MgcPw"
+    if action.dmg_stat_source == "AtkPw":
+        base = action.base_val + attacker.atk_pw * 0.2
+    elif is_magic:
+        base = action.base_val + attacker.mgc_pw * 0.2
+    else:
+        base = 0.0
+    dodged = gen.random(hits) * 100 < target.dodge_val / 10.0
+    damage = np.full(hits, float(base))
+    if base > 0:
+        crits = gen.random(hits) * 100 < attacker.crits_val / 3.0
+        damage[crits] *= 2.0
+        low, high, offset = _mitigation_terms(target, is_magic)
+        mitigation = gen.uniform(low, high, hits) + offset if high > low else np.full(hits, low + offset)
+        damage *= 1 - np.clip(mitigation, 0.0, MAX_MITIGATION)
+    # np.rint rounds half to even, like round().
+    final = np.maximum(0, np.rint(damage)).astype(np.int64)
+    final[dodged] = 0
+    return final.tolist()
+
+
+def _entity_for(name: str) -> "rl.Entity":
+    """Load a toon by name or an NPC by id/name from the CSV tables."""
+    if name in rl.TOONS_DATA:
+        entity = rl.Entity(name, is_player=True)
+        entity.load_char_data(rl.TOONS_DATA[name])
+        return entity
+    for npc_id, data in rl.NPCS_DATA.items():
+        if name in (str(npc_id), data.get("Name")):
+            entity = rl.Entity(name)
+            entity.load_npc_data(data)
+            return entity
+    raise SystemExit(f"no toon or NPC named {name!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("attacker", help="toon name or NPC id/name")
+    parser.add_argument("target", help="toon name or NPC id/name")
+    parser.add_argument("--action", type=int, default=rl.DEFAULT_MELEE_ACTION_ID)
+    parser.add_argument("--sample", type=int, default=0,
+                        help="also draw this many hits and compare the means")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rl.load_item_and_action_tables()
+    rl.TOONS_DATA = rl.load_table("toons")
+    rl.NPCS_DATA = rl.load_table("npcs")
+    attacker = _entity_for(args.attacker)
+    target = _entity_for(args.target)
+    dist = damage_distribution(attacker, target, args.action)
+    print(dist.format())
+    if args.sample:
+        drawn = sample_damage(attacker, target, args.action, args.sample, args.seed)
+        print(f"sampled mean over {len(drawn)} hits: {sum(drawn) / len(drawn):.2f}")
@@ -0,0 +1,185 @@
+"""Headless duel resolution for main.py characters.
+
+Duels use the pyRL combat rules: main.py attributes are mapped onto pyRL
+attributes, derived stats come from ``Entity._calculate_derived_stats_player``
+and every hit is rolled by ``pyRL_uta0628c.roll_attack`` (dodge, crit and
+block/armor or magic-resist mitigation). Attack timing follows
+``attack_fill_time`` on a virtual clock, so a duel costs a few dozen rolls
+instead of a real-time ``combat_loop``.
+"""
+
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pyRL_uta0628c as rl
+
+# pyRL attribute -> main.py attribute it is read from.
+ATTRIBUTE_MAP = {
+    "STA": "stamina",
+    "STR": "strength",
+    "AGI": "speed",
+    "DEX": "technique",
+    "HIT": "precision",
+    "BAL": "harmony",
+    "INT": "intelligence",
+    "WIL": "dedication",
+    "FOR": "conscientiousness",
+    "FOC": "perception",
+    "PSY": "vision",
+    "ARC": "creativity",
+    "BLS": "alignment",
+    "MAN": "logic",
+    "ALC": "metabolism",
+    "CUR": "hacking",
+    "COR": "neuroticism",
+    "SUM": "extraversion",
+    "HEX": "openness",
+}
+
+# A duel that runs this long on the virtual clock is called a draw.
+MAX_DUEL_SECONDS = 300.0
+
+_STATS_CACHE_LIMIT = 1024
+
+
+class Duelist:
+    """Combat stats of one character, shaped like the pyRL ``Entity``."""
+
+    __slots__ = (
+        "name", "max_hp", "atk_pw", "mgc_pw", "block_val", "dodge_val",
+        "armor_val", "mgc_rs_val", "crits_val", "attack_fill_time", "action",
+    )
+
+    def __init__(self, name: str, stats: Tuple):
+        self.name = name
+        (self.max_hp, self.atk_pw, self.mgc_pw, self.block_val,
+         self.dodge_val, self.armor_val, self.mgc_rs_val, self.crits_val,
+         self.attack_fill_time) = stats
+        # Duelists swing with whichever basic attack their stats favour.
+        if self.mgc_pw > self.atk_pw:
+            self.action = rl.ALL_ACTIONS[rl.DEFAULT_MAGIC_ACTION_ID]
+        else:
+            self.action = rl.ALL_ACTIONS[rl.DEFAULT_MELEE_ACTION_ID]
+
+
+@dataclass
+class DuelResult:
+    """Outcome of one duel; ``winner`` is None for a draw."""
+    challenger: str
+    defender: str
+    winner: Optional[str]
+    duration: float  # seconds on the virtual combat clock
+    hits: int
+    damage: Dict[str, int]  # damage dealt by each duellist
+
+    @property
+    def loser(self) -> Optional[str]:
+        if self.winner is None:
+            return None
+        return self.defender if self.winner == self.challenger else self.challenger
+
+
+# Derived stats by mapped attribute values, in ``Duelist`` field order.
+_stats_cache: Dict[Tuple[int, ...], Tuple] = {}
+
+
+def _ensure_tables() -> None:
+    if not rl.ALL_ACTIONS:
+        rl.load_item_and_action_tables()
+
+
+def _stats_for(values: Tuple[int, ...]) -> Tuple:
+    """Derive pyRL player stats for mapped attribute ``values``."""
+    stats = _stats_cache.get(values)
+    if stats is None:
+        if len(_stats_cache) >= _STATS_CACHE_LIMIT:
+            _stats_cache.clear()
+        entity = rl.Entity("duelist", is_player=True)
+        for attr, value in zip(ATTRIBUTE_MAP, values):
+            entity.base_attributes[attr] = value
+        entity.update_stats_and_effects()
+        stats = (
+            entity.max_hp, entity.atk_pw, entity.mgc_pw, entity.block_val,
+            entity.dodge_val, entity.armor_val, entity.mgc_rs_val,
+            entity.crits_val, entity.attack_fill_time,
+        )
+        _stats_cache[values] = stats
+    return stats
+
+
+def duelist_from_character(character) -> Duelist:
+    """Build a ``Duelist`` from a main.py ``Character``."""
+    _ensure_tables()
+    attrs = character.attributes
+    values = tuple(attrs.get(name, 10) for name in ATTRIBUTE_MAP.values())
+    return Duelist(character.name, _stats_for(values))
+
+
+def fight(a: Duelist, b: Duelist, rng=random) -> DuelResult:
+    """Fight ``a`` against ``b`` until one drops or time runs out."""
+    roll = rl.roll_attack
+    hp_a, hp_b = a.max_hp, b.max_hp
+    dealt_a = dealt_b = 0
+    next_a = a.attack_fill_time
+    next_b = b.attack_fill_time
+    now = 0.0
+    hits = 0
+    winner = None
+    while True:
+        # Ties go to the challenger, like the player in combat_loop.
+        a_swings = next_a <= next_b
+        now = next_a if a_swings else next_b
+        if now > MAX_DUEL_SECONDS:
+            now = MAX_DUEL_SECONDS
+            break
+        hits += 1
+        if a_swings:
+            next_a += a.attack_fill_time
+            damage = roll(a, b, a.action, rng)[4]
+            if damage > 0:
+                damage = min(damage, hp_b)
+                hp_b -= damage
+                dealt_a += damage
+                if hp_b <= 0:
+                    winner = a.name
+                    break
+        else:
+            next_b += b.attack_fill_time
+            damage = roll(b, a, b.action, rng)[4]
+            if damage > 0:
+                damage = min(damage, hp_a)
+                hp_a -= damage
+                dealt_b += damage
+                if hp_a <= 0:
+                    winner = b.name
+                    break
+    return DuelResult(
+        challenger=a.name,
+        defender=b.name,
+        winner=winner,
+        duration=now,
+        hits=hits,
+        damage={a.name: dealt_a, b.name: dealt_b},
+    )
+
+
+def resolve_duels(
+    pairs: Sequence[Tuple[object, object]],
+    rng=random,
+) -> List[DuelResult]:
+    """Resolve a batch of ``(challenger, defender)`` character duels.
+
+    Stats are derived once per distinct attribute set, so a cycle with
+    thousands of duels mostly pays for the attack rolls themselves.
+    ``rng`` is anything with ``random()`` and ``uniform()``; the shared
+    ``random`` module is used by default.
+    """
+    results = []
+    for challenger, defender in pairs:
+        results.append(fight(
+            duelist_from_character(challenger),
+            duelist_from_character(defender),
+            rng,
+        ))
+    return results
@@ -0,0 +1,522 @@
+"""Best gear loadouts for a pyRL toon by branch-and-bound.
+
+Every item adds at most two attribute bonuses, and every player derived
+stat is a weighted sum of attributes (``DERIVED_STAT_COEFFS``). So once an
+objective is linear in the derived stats, each item reduces to one score and
+a loadout's score is the sum over its slots. ``GearOptimizer`` linearizes
+the objective around a reference loadout: it takes the gradient of each
+metric with respect to the derived stats it reads, by central differences
+on a copy of the toon, and pushes it through the stat formulas onto the
+attributes. The metrics are expected DPS against the chosen NPCs (the
+better of melee and magic, from ``damage_model``) and effective HP, the
+seconds the toon lasts against those NPCs' attack sequences. An objective
+is a weighted mix of the two, each divided by its value for the toon with
+nothing equipped.
+
+The search walks the slots with each slot's items in descending score and
+bounds a partial loadout by its score plus the best score left in every
+remaining slot. Skill checks tighten the bound: a check that the items so
+far still fall short of caps the rest of the loadout at the best score of
+the remaining slots that also supplies the missing points, a memoized
+table per (slot, attribute, shortfall). Items with identical bonuses and
+skill check share one search node, and checks that hold for every loadout
+are dropped before the search. A loadout passes a check when the
+attribute, with the bonuses of the other items in the loadout, reaches the
+amount ``can_equip_item`` asks for.
+
+The kept loadouts are then scored exactly on a copy of the toon, with exact
+metric values memoized by the stats they read, and the objective is
+linearized again around the best loadout until that stops changing. Item
+actions and cooldowns are not part of the objective.
+
+``python gear_optimizer.py Athena --objective mix --top 5`` prints the best
+five loadouts; ``--scale 100`` times the search on a table 100 times larger.
+"""
+
+import argparse
+import heapq
+import itertools
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import damage_model
+import pyRL_uta0628c as rl
+
+SLOTS = tuple(range(1, 9))
+# Derived stats each metric reads from the toon.
+METRIC_STATS = {
+    "dps": ("atk_pw", "mgc_pw", "atk_sp", "crits_val"),
+    "ehp": ("max_hp", "block_val", "dodge_val", "armor_val", "mgc_rs_val"),
+}
+# Stats the cached part of each metric reads.
+CACHE_STATS = {
+    "dps": METRIC_STATS["dps"],
+    "toughness": ("block_val", "dodge_val", "armor_val", "mgc_rs_val"),
+}
+OBJECTIVES: Dict[str, Dict[str, float]] = {
+    "dps": {"dps": 1.0},
+    "ehp": {"ehp": 1.0},
+    "mix": {"dps": 1.0, "ehp": 1.0},
+}
+PLAYER_ACTIONS = (rl.DEFAULT_MELEE_ACTION_ID, rl.DEFAULT_MAGIC_ACTION_ID)
+STAT_STEP = 2.0  # derived-stat step of the central differences
+MIN_INCOMING_DPS = 1e-3  # keeps effective HP finite against harmless NPCs
+MAX_ROUNDS = 4
+METRIC_CACHE_SIZE = 65536
+
+Bonuses = Tuple[Tuple[str, int], ...]
+Requirement = Tuple[str, int]
+
+
+@dataclass(frozen=True)
+class GearOption:
+    """One choice in a slot: the items sharing these bonuses and skill check.
+
+    ``items`` is empty for leaving the slot empty.
+    """
+    items: Tuple["rl.Item", ...]
+    bonuses: Bonuses
+    requirement: Optional[Requirement]
+
+
+@dataclass
+class Loadout:
+    """One item (or nothing) per slot and what it is worth."""
+    items: Dict[int, Optional["rl.Item"]]
+    value: float  # exact objective
+    metrics: Dict[str, float]
+    score: float = 0.0  # linear gain over no gear in the round that found it
+
+    @property
+    def key(self) -> Tuple:
+        return tuple(item.id if item else None for item in self.items.values())
+
+    def format(self) -> str:
+        metrics = ", ".join(f"{name} {value:.2f}" for name, value in self.metrics.items())
+        lines = [f"value {self.value:.4f}: {metrics}"]
+        for slot, item in self.items.items():
+            lines.append(f"  {slot}: {item.name if item else '-'}")
+        return "\n".join(lines)
+
+
+def item_bonuses(item) -> Bonuses:
+    return tuple(sorted((a, d) for a, d in rl._item_attribute_deltas(item, 1).items() if d))
+
+
+def item_requirement(item) -> Optional[Requirement]:
+    """``(attribute, amount)`` for ``can_equip_item``'s check, None if there is none.
+
+    Raises ValueError for operators ``can_equip_item`` always refuses.
+    """
+    if not item.skill_check_attr:
+        return None
+    if item.skill_check_opr != "min":
+        raise ValueError(f"{item.name} can never be equipped ({item.skill_check_opr!r})")
+    return item.skill_check_attr, item.skill_check_amount
+
+
+def _floored(attr: str, value: float) -> float:
+    return rl._floor_attribute(attr, value) if attr in rl.ATTRIBUTES else value
+
+
+def _npc_actions(npc) -> Dict[int, int]:
+    """Action id -> how often it appears in the NPC's act1..act9 sequence."""
+    counts: Dict[int, int] = {}
+    for i in range(1, 10):
+        action_id = npc.npc_data_source.get(f"act{i}")
+        if action_id in rl.ALL_ACTIONS:
+            counts[action_id] = counts.get(action_id, 0) + 1
+    return counts or {rl.DEFAULT_MELEE_ACTION_ID: 1}
+
+
+class GearOptimizer:
+    """Top-k loadouts over an item table for toons against chosen NPCs."""
+
+    def __init__(self, items: Optional[Iterable["rl.Item"]] = None, opponents: Optional[Sequence] = None):
+        if items is None:
+            items = rl.ALL_ITEMS.values()
+        if opponents is None:
+            opponents = [_npc_entity(npc_id) for npc_id in rl.NPCS_DATA]
+        self.opponents = list(opponents)
+        self._opponent_actions = [_npc_actions(npc) for npc in self.opponents]
+        self.options: Dict[int, List[GearOption]] = {}
+        groups: Dict[Tuple, List] = {}
+        for item in items:
+            if item.slot not in SLOTS:
+                continue
+            try:
+                requirement = item_requirement(item)
+            except ValueError:
+                continue
+            groups.setdefault((item.slot, item_bonuses(item), requirement), []).append(item)
+        for slot in SLOTS:
+            self.options[slot] = [GearOption((), (), None)]
+        for (slot, bonuses, requirement), members in groups.items():
+            self.options[slot].append(GearOption(tuple(members), bonuses, requirement))
+        self._metric_cache: Dict[Tuple, float] = {}
+
+    # --- metrics ---
+
+    def metric(self, name: str, toon) -> float:
+        """Exact value of ``name`` for ``toon``, averaged over the opponents."""
+        if name == "ehp":
+            # Linear in max_hp, so only the rest of the stats key the cache.
+            return toon.max_hp * self._cached("toughness", toon, self._toughness)
+        return self._cached(name, toon, self._dps)
+
+    def _cached(self, name: str, toon, compute) -> float:
+        key = (name,) + tuple(getattr(toon, stat) for stat in CACHE_STATS[name])
+        value = self._metric_cache.get(key)
+        if value is None:
+            if len(self._metric_cache) >= METRIC_CACHE_SIZE:
+                self._metric_cache.clear()
+            value = self._metric_cache[key] = compute(toon)
+        return value
+
+    def _dps(self, toon) -> float:
+        total = 0.0
+        for npc in self.opponents:
+            total += max(damage_model.expected_dps(toon, npc, a) for a in PLAYER_ACTIONS)
+        return total / len(self.opponents)
+
+    def _toughness(self, toon) -> float:
+        # Seconds each point of HP lasts against the opponents' sequences.
+        total = 0.0
+        for npc, actions in zip(self.opponents, self._opponent_actions):
+            uses = sum(actions.values())
+            incoming = sum(n * damage_model.expected_dps(npc, toon, a) for a, n in actions.items()) / uses
+            total += 1.0 / max(MIN_INCOMING_DPS, incoming)
+        return total / len(self.opponents)
+
+    def attribute_weights(self, toon, weights: Dict[str, float]) -> Dict[str, float]:
+        """Gradient of ``sum(weight * metric)`` with respect to each attribute at ``toon``."""
+        stat_grad: Dict[str, float] = {}
+        for name, weight in weights.items():
+            for stat in METRIC_STATS[name]:
+                values = []
+                for step in (STAT_STEP, -STAT_STEP):
+                    probe = toon.clone()
+                    probe._raw_derived[stat] += step
+                    probe._publish_derived_stats([stat])
+                    values.append(self.metric(name, probe))
+                grad = (values[0] - values[1]) / (2 * STAT_STEP)
+                stat_grad[stat] = stat_grad.get(stat, 0.0) + weight * grad
+        attr_weights: Dict[str, float] = {}
+        for stat, grad in stat_grad.items():
+            for attr, coeff in rl.DERIVED_STAT_COEFFS[stat].items():
+                attr_weights[attr] = attr_weights.get(attr, 0.0) + grad * coeff
+        return attr_weights
+
+    # --- search ---
+
+    def search(
+        self, base: Dict[str, float], attr_weights: Dict[str, float], k: int,
+    ) -> List[Tuple[float, Tuple[GearOption, ...]]]:
+        """The ``k`` best option tuples (one per slot) by linear score, best first.
+
+        ``base`` holds the toon's attributes with nothing equipped.
+        """
+        scored = []
+        for slot in SLOTS:
+            ranked = [
+                (sum(attr_weights.get(a, 0.0) * d for a, d in opt.bonuses), opt)
+                for opt in self.options[slot]
+            ]
+            ranked.sort(key=lambda pair: -pair[0])
+            scored.append(ranked)
+        n = len(scored)
+        suffix_best = [0.0] * (n + 1)
+        for j in range(n - 1, -1, -1):
+            suffix_best[j] = suffix_best[j + 1] + scored[j][0][0]
+
+        # Checks some loadout can fail; the rest are dropped.
+        lowest = dict(base)
+        for ranked in scored:
+            for attr in {a for _, opt in ranked for a, _ in opt.bonuses}:
+                lowest[attr] = lowest.get(attr, 0) + min(0, min(
+                    dict(opt.bonuses).get(attr, 0) for _, opt in ranked
+                ))
+        live = sorted({
+            opt.requirement[0]
+            for ranked in scored for _, opt in ranked
+            if opt.requirement and _floored(opt.requirement[0], lowest.get(opt.requirement[0], 0)) < opt.requirement[1]
+        })
+        index = {attr: i for i, attr in enumerate(live)}
+        # Per slot, each option as (score, option, live attribute deltas, live check).
+        # A check (i, threshold) passes when live[i] reaches threshold with the
+        # option's own bonus still counted.
+        nodes = []
+        for ranked in scored:
+            row = []
+            for score, opt in ranked:
+                deltas: Dict[int, int] = {}
+                for a, d in opt.bonuses:
+                    if a in index:
+                        deltas[index[a]] = deltas.get(index[a], 0) + d
+                req = opt.requirement
+                check = None
+                if req and req[0] in index:
+                    check = (index[req[0]], req[1] + deltas.get(index[req[0]], 0))
+                row.append((score, opt, tuple(deltas.items()), check))
+            nodes.append(row)
+        # Most each live attribute can still gain from slots j onward, and per
+        # slot the best score that buys each gain.
+        width = len(live)
+        suffix_gain = [[0] * width for _ in range(n + 1)]
+        gain_best: List[List[Dict[int, float]]] = []
+        for row in nodes:
+            best: List[Dict[int, float]] = [{} for _ in range(width)]
+            for score, _, deltas, _ in row:
+                gains = dict(deltas)
+                for i in range(width):
+                    gain = gains.get(i, 0)
+                    if score > best[i].get(gain, -math.inf):
+                        best[i][gain] = score
+            gain_best.append(best)
+        slot_gain = [[max(best[i]) for i in range(width)] for best in gain_best]
+        for j in range(n - 1, -1, -1):
+            for i in range(width):
+                suffix_gain[j][i] = suffix_gain[j + 1][i] + slot_gain[j][i]
+        memo: Dict[Tuple[int, int, int], float] = {}
+
+        def bound_with(j: int, i: int, need: int) -> float:
+            # Best score from slot j onward that adds at least ``need`` to live[i];
+            # every other check is relaxed, so this bounds the true best.
+            if need <= 0:
+                return suffix_best[j]
+            if need > suffix_gain[j][i]:
+                return -math.inf
+            key = (j, i, need)
+            value = memo.get(key)
+            if value is None:
+                value = memo[key] = max(
+                    score + bound_with(j + 1, i, need - gain)
+                    for gain, score in gain_best[j][i].items()
+                )
+            return value
+
+        heap: List[Tuple[float, int, Tuple[GearOption, ...]]] = []
+        counter = itertools.count()
+        chosen: List[GearOption] = [None] * n
+        totals = [base.get(attr, 0) for attr in live]
+        thresholds: Dict[int, int] = {}  # highest check on each live attribute so far
+        cutoff = -math.inf  # loadouts scoring at or below this are skipped
+
+        def visit(j: int, score: float) -> None:
+            if j == n:
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, next(counter), tuple(chosen)))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, next(counter), tuple(chosen)))
+                return
+            rest = suffix_best[j + 1]
+            # No option here adds more than its slot's best gain, so checks
+            # still short after that cap every option's bound.
+            cap = rest
+            for i, threshold in thresholds.items():
+                need = threshold - totals[i] - slot_gain[j][i]
+                if need > 0:
+                    cap = min(cap, bound_with(j + 1, i, need))
+            for option_score, opt, deltas, check in nodes[j]:
+                floor = heap[0][0] if len(heap) == k else cutoff
+                if score + option_score + cap <= floor:
+                    break  # options are in descending score
+                for i, d in deltas:
+                    totals[i] += d
+                if check is not None:
+                    checked, threshold = check
+                    previous = thresholds.get(checked)
+                    if previous is None or threshold > previous:
+                        thresholds[checked] = threshold
+                bound = rest
+                for i, threshold in thresholds.items():
+                    if threshold > totals[i]:
+                        bound = min(bound, bound_with(j + 1, i, threshold - totals[i]))
+                if score + option_score + bound > floor:
+                    chosen[j] = opt
+                    visit(j + 1, score + option_score)
+                if check is not None:
+                    if previous is None:
+                        del thresholds[checked]
+                    else:
+                        thresholds[checked] = previous
+                for i, d in deltas:
+                    totals[i] -= d
+
+        # Until the heap holds k loadouts nothing bounds the search, and it can
+        # spend long stretches proving deep corners infeasible. So search above
+        # a cutoff that drops by a doubling step until k loadouts clear it.
+        worst = sum(row[-1][0] for row in nodes)
+        step = 1e-3 * max(1.0, abs(suffix_best[0]))
+        while True:
+            cutoff = suffix_best[0] - step
+            if cutoff < worst:
+                cutoff = -math.inf
+            heap.clear()
+            visit(0, 0.0)
+            if len(heap) == k or cutoff == -math.inf:
+                break
+            step *= 2
+        return [(score, options) for score, _, options in sorted(heap, reverse=True)]
+
+    # --- driver ---
+
+    def optimize(
+        self, toon, k: int = 5, objective: Dict[str, float] = OBJECTIVES["dps"],
+        candidates: Optional[int] = None, max_rounds: int = MAX_ROUNDS,
+    ) -> List[Loadout]:
+        """The ``k`` best loadouts for ``toon``, a player ``Entity``, by exact value."""
+        naked = _naked(toon)
+        weights = self.normalized(naked, objective)
+        candidates = max(k, candidates or 2 * k)
+
+        found: Dict[Tuple, Loadout] = {}
+        at = toon
+        best_key = None
+        for _ in range(max_rounds):
+            attr_weights = self.attribute_weights(at, weights)
+            for score, options in self.search(naked.base_attributes, attr_weights, candidates):
+                for loadout in self._expand(options, candidates):
+                    if loadout.key not in found:
+                        self._evaluate(naked, loadout, weights)
+                        loadout.score = score
+                        found[loadout.key] = loadout
+            best = max(found.values(), key=lambda lo: lo.value)
+            if best.key == best_key:
+                break
+            best_key = best.key
+            at = self.equipped(naked, best.items)
+        return sorted(found.values(), key=lambda lo: -lo.value)[:k]
+
+    def normalized(self, naked, objective: Dict[str, float]) -> Dict[str, float]:
+        """Objective weights divided by each metric's value for the ungeared toon."""
+        return {name: w / max(self.metric(name, naked), 1e-9) for name, w in objective.items()}
+
+    def current(self, toon, objective: Dict[str, float] = OBJECTIVES["dps"]) -> Loadout:
+        """``toon``'s own gear, scored like ``optimize`` scores loadouts."""
+        naked = _naked(toon)
+        loadout = Loadout({
+            slot: item.template if item else None for slot, item in toon.equipped_items.items()
+        }, 0.0, {})
+        self._evaluate(naked, loadout, self.normalized(naked, objective))
+        return loadout
+
+    def _expand(self, options: Sequence[GearOption], limit: int) -> List[Loadout]:
+        choices = [opt.items or (None,) for opt in options]
+        return [
+            Loadout(dict(zip(SLOTS, combo)), 0.0, {})
+            for combo in itertools.islice(itertools.product(*choices), limit)
+        ]
+
+    @staticmethod
+    def equipped(naked, items: Dict[int, Optional["rl.Item"]]):
+        toon = naked.clone()
+        for slot, item in items.items():
+            if item is not None:
+                toon.equip_item(item.instance(), slot)
+        return toon
+
+    def _evaluate(self, naked, loadout: Loadout, weights: Dict[str, float]) -> None:
+        toon = self.equipped(naked, loadout.items)
+        loadout.metrics = {name: self.metric(name, toon) for name in weights}
+        loadout.value = sum(w * loadout.metrics[name] for name, w in weights.items())
+
+
+def _naked(toon):
+    naked = toon.clone()
+    for slot in SLOTS:
+        if naked.equipped_items.get(slot) is not None:
+            naked.equip_item(None, slot)
+    return naked
+
+
+def _npc_entity(npc_id: int):
+    npc = rl.Entity("npc")
+    npc.load_npc_data(rl.NPCS_DATA[npc_id])
+    return npc
+
+
+def toon_entity(name: str):
+    toon = rl.Entity(name, is_player=True)
+    toon.load_char_data(rl.TOONS_DATA[name])
+    return toon
+
+
+def scaled_items(factor: int, seed: Optional[int] = None) -> List["rl.Item"]:
+    """``ALL_ITEMS`` repeated ``factor`` times with random bonuses and skill checks.
+
+    For timing the search on larger tables.
+    """
+    rng = random.Random(seed)
+    attrs = [a for a in rl.ATTRIBUTES if a not in rl.UNCLAMPED_ATTRIBUTES]
+    items = []
+    for copy in range(factor):
+        for item in rl.ALL_ITEMS.values():
+            items.append(rl.Item({
+                "ItemID": copy * 10000 + item.id,
+                "Slot": item.slot,
+                "Name": f"{item.name} #{copy}",
+                "Bonus1id": rng.choice(attrs), "Bonus1add": rng.randint(-1, 4),
+                "Bonus2id": rng.choice(attrs), "Bonus2add": rng.randint(0, 3),
+                "SkillCheck": rng.choice(attrs), "SklChkAmount": rng.randint(1, 20),
+                "SklChkOpr": "min",
+            }))
+    return items
+
+
+def _parse_list(text: str, convert=str) -> Optional[List]:
+    return [convert(part) for part in text.split(",") if part.strip()] or None
+
+
+def _parse_objective(text: str) -> Dict[str, float]:
+    """``dps``, ``ehp``, ``mix`` or explicit weights such as ``dps=2,ehp=1``."""
+    if text in OBJECTIVES:
+        return OBJECTIVES[text]
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in METRIC_STATS:
+            raise ValueError(f"unknown metric {name!r}; choose from {', '.join(METRIC_STATS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("toon", help="toon name")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--objective", default="dps",
+                        help=f"{', '.join(OBJECTIVES)} or weights like dps=2,ehp=1")
+    parser.add_argument("--npcs", default="", help="comma separated npcIDs, default all")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="search a synthetic table this many times larger")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rl.load_item_and_action_tables()
+    rl.TOONS_DATA = rl.load_table("toons")
+    rl.NPCS_DATA = rl.load_table("npcs")
+    if args.toon not in rl.TOONS_DATA:
+        sys.exit(f"no toon named {args.toon!r}")
+    try:
+        objective = _parse_objective(args.objective)
+    except ValueError as e:
+        sys.exit(str(e))
+    npc_ids = _parse_list(args.npcs, int) or list(rl.NPCS_DATA)
+    items = scaled_items(args.scale, args.seed) if args.scale > 1 else None
+
+    optimizer = GearOptimizer(items, [_npc_entity(npc_id) for npc_id in npc_ids])
+    toon = toon_entity(args.toon)
+    started = time.perf_counter()
+    results = optimizer.optimize(toon, args.top, objective)
+    elapsed = time.perf_counter() - started
+    current = optimizer.current(toon, objective)
+    for rank, loadout in enumerate(results, 1):
+        print(f"#{rank} {loadout.format()}")
+    print(f"current gear: {current.format()}")
+    options = sum(len(opts) - 1 for opts in optimizer.options.values())
+    print(f"{options} item groups, {len(results)} loadouts in {elapsed * 1000:.0f} ms")
@@ -10,9 +10,15 @@ This program implements a minimal subset of the ideas provided:
 No external dependencies are required.
 """
 
+import heapq
 import random
+import time
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Deque, Dict, Generator, List, Optional, Tuple
+
+import duels
+from social_graph import SocialGraph
 
 # List of professions (simplified from the description)
 PROFESSIONS = [
@@ -50,6 +56,7 @@ class Interaction:
     name: str
     initiator_check: Callable[["Character"], bool]
     outcomes: List[Outcome]
+    duel: bool = False  # settled by combat instead of a weighted outcome
 
 # Basic interaction library with "greet" and "compliment".
 INTERACTIONS: List[Interaction] = [
@@ -127,6 +134,10 @@ NEGATIVE_INTERACTIONS = {
     "CriticizeCharacter", "ChallengeDuel",
 }
 
+# Interactions that are fought out with the pyRL combat rules (see duels.py).
+DUEL_INTERACTIONS = {"ChallengeDuel", "AcceptDuel"}
+DUEL_MOOD = 3  # mood gained by the winner and lost by the loser
+
 
 def make_generic_interaction(name: str) -> Interaction:
     """Return a simple interaction with generic outcomes."""
@@ -155,7 +166,8 @@ def make_generic_interaction(name: str) -> Interaction:
                     target_mood=-1),
         ]
 
-    return Interaction(name=name, initiator_check=check, outcomes=outcomes)
+    return Interaction(name=name, initiator_check=check, outcomes=outcomes,
+                       duel=name in DUEL_INTERACTIONS)
 
 
 for _name in ADDITIONAL_INTERACTIONS:
@@ -163,6 +175,49 @@ for _name in ADDITIONAL_INTERACTIONS:
         continue
     INTERACTIONS.append(make_generic_interaction(_name))
 
+@dataclass(frozen=True)
+class Recipe:
+    """One way a profession can turn an optional input into output."""
+    consumes: Optional[str]
+    produces: Optional[str]
+    message: str
+    credits: int = 0
+
+
+# Professional work, tried in order. A profession whose recipes all lack
+# their input records the first recipe's input as its needed resource.
+PROFESSION_RECIPES: Dict[str, List[Recipe]] = {
+    "Miner": [Recipe(None, "substrate", "mined substrate")],
+    "Craftsman": [Recipe("substrate", "tool", "crafted a tool")],
+    "Constructor": [
+        Recipe("tool", "buildingbits", "built buildingbits"),
+        Recipe("plankbits", "buildingbits", "built buildingbits"),
+    ],
+    "Digital Landscaper": [
+        Recipe("buildingbits", None, "landscaped a new home"),
+    ],
+    "Farmer": [Recipe(None, "mealbits", "harvested mealbits")],
+    "Cook": [Recipe("mealbits", "bead", "cooked a bead")],
+    "Gatherer": [Recipe(None, "joules", "gathered joules")],
+    "Refiner": [
+        Recipe("substrate", None, "refined substrate into a credit", credits=1),
+        Recipe("woodbits", "plankbits", "refined plankbits"),
+    ],
+    "Lumberjack": [Recipe(None, "woodbits", "chopped woodbits")],
+    "Signalist": [Recipe(None, "signalbits", "gathered signalbits")],
+    "Cartographer": [Recipe("signalbits", "mapbit", "produced a mapbit")],
+    "Dreamweaver": [Recipe("signalbits", "bitnapse", "wove a bitnapse")],
+    "Crawler": [Recipe(None, "bugs", "collected bugs")],
+    "Codehealer": [Recipe("bugs", "bugpatch", "produced a bugpatch")],
+}
+
+# Items a merchant is willing to buy from other characters.
+MERCHANT_BUYABLES = {
+    "substrate", "joules", "woodbits", "mealbits", "signalbits", "bugs",
+    "tool", "plankbits", "buildingbits",
+}
+
+
 @dataclass
 class Character:
     name: str
@@ -175,9 +230,11 @@ class Character:
     attributes: Dict[str, int] = field(default_factory=dict)
     credits: int = 10
     inventory: Dict[str, int] = field(default_factory=dict)  # 3 slots allowed
-    relationships: Dict[str, int] = field(default_factory=dict)
+    relationships: Dict[int, int] = field(default_factory=dict)  # by character id
     needs_resource: Optional[str] = None
     done: bool = False
+    id: int = -1  # assigned by World.spawn; see character_slot()
+    pruned_epoch: int = 0  # World.retire_epoch when relationships were last pruned
 
     def __post_init__(self):
         # Randomly assign attributes in range 5-15 (approx average 10)
@@ -227,89 +284,23 @@ class Character:
         prof = self.profession
         inv = self.inventory
 
-        if prof == "Miner":
-            inv["substrate"] = inv.get("substrate", 0) + 1
-            print(f"{self.name} mined substrate")
-        elif prof == "Craftsman":
-            if inv.get("substrate"):
-                inv["substrate"] -= 1
-                inv["tool"] = inv.get("tool", 0) + 1
-                print(f"{self.name} crafted a tool")
-            else:
-                self.needs_resource = "substrate"
-        elif prof == "Constructor":
-            if inv.get("tool"):
-                inv["tool"] -= 1
-                inv["buildingbits"] = inv.get("buildingbits", 0) + 1
-                print(f"{self.name} built buildingbits")
-            elif inv.get("plankbits"):
-                inv["plankbits"] -= 1
-                inv["buildingbits"] = inv.get("buildingbits", 0) + 1
-                print(f"{self.name} built buildingbits")
-            else:
-                self.needs_resource = "tool"
-        elif prof == "Digital Landscaper":
-            if inv.get("buildingbits"):
-                inv["buildingbits"] -= 1
-                print(f"{self.name} landscaped a new home")
-            else:
-                self.needs_resource = "buildingbits"
-        elif prof == "Farmer":
-            inv["mealbits"] = inv.get("mealbits", 0) + 1
-            print(f"{self.name} harvested mealbits")
-        elif prof == "Cook":
-            if inv.get("mealbits"):
-                inv["mealbits"] -= 1
-                inv["bead"] = inv.get("bead", 0) + 1
-                print(f"{self.name} cooked a bead")
-            else:
-                self.needs_resource = "mealbits"
-        elif prof == "Gatherer":
-            inv["joules"] = inv.get("joules", 0) + 1
-            print(f"{self.name} gathered joules")
-        elif prof == "Refiner":
-            if inv.get("substrate"):
-                inv["substrate"] -= 1
-                self.credits += 1
-                print(f"{self.name} refined substrate into a credit")
-            elif inv.get("woodbits"):
-                inv["woodbits"] -= 1
-                inv["plankbits"] = inv.get("plankbits", 0) + 1
-                print(f"{self.name} refined plankbits")
-            else:
-                self.needs_resource = "substrate"
-        elif prof == "Lumberjack":
-            inv["woodbits"] = inv.get("woodbits", 0) + 1
-            print(f"{self.name} chopped woodbits")
-        elif prof == "Signalist":
-            inv["signalbits"] = inv.get("signalbits", 0) + 1
-            print(f"{self.name} gathered signalbits")
-        elif prof == "Cartographer":
-            if inv.get("signalbits"):
-                inv["signalbits"] -= 1
-                inv["mapbit"] = inv.get("mapbit", 0) + 1
-                print(f"{self.name} produced a mapbit")
-            else:
-                self.needs_resource = "signalbits"
-        elif prof == "Dreamweaver":
-            if inv.get("signalbits"):
-                inv["signalbits"] -= 1
-                inv["bitnapse"] = inv.get("bitnapse", 0) + 1
-                print(f"{self.name} wove a bitnapse")
-            else:
-                self.needs_resource = "signalbits"
-        elif prof == "Crawler":
-            inv["bugs"] = inv.get("bugs", 0) + 1
-            print(f"{self.name} collected bugs")
-        elif prof == "Codehealer":
-            if inv.get("bugs"):
-                inv["bugs"] -= 1
-                inv["bugpatch"] = inv.get("bugpatch", 0) + 1
-                print(f"{self.name} produced a bugpatch")
-            else:
-                self.needs_resource = "bugs"
-        elif prof == "Merchant":
+        if prof == "Merchant":
             world.process_merchant(self)
+        elif prof in PROFESSION_RECIPES:
+            recipes = PROFESSION_RECIPES[prof]
+            for recipe in recipes:
+                if recipe.consumes is not None:
+                    if not inv.get(recipe.consumes):
+                        continue
+                    inv[recipe.consumes] -= 1
+                if recipe.produces is not None:
+                    inv[recipe.produces] = inv.get(recipe.produces, 0) + 1
+                self.credits += recipe.credits
+                print(f"{self.name} {recipe.message}")
+                break
+            else:
+                # Only the primary input is ever requested from merchants
+                self.needs_resource = recipes[0].consumes
         else:
             # catch-all for any other profession
             self.credits += 1
@@ -323,26 +314,171 @@ class Character:
         self.done = True
 
 
+class LatencyTracker:
+    """Rolling window of durations (seconds) with percentile lookup."""
+
+    def __init__(self, window: int = 1000):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentiles(self, points: Tuple[int, ...] = (50, 95, 99)) -> Dict[str, float]:
+        """Return nearest-rank percentiles in milliseconds."""
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+        result = {}
+        for p in points:
+            rank = max(0, min(len(ordered) - 1, -(-p * len(ordered) // 100) - 1))
+            result[f"p{p}"] = ordered[rank] * 1000
+        result["max"] = ordered[-1] * 1000
+        return result
+
+
+# Character ids pack a storage slot with a spawn serial number, so a slot
+# handed out again after a retirement never matches the retired character.
+SLOT_BITS = 32
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+
+def character_slot(char_id: int) -> int:
+    """Return the storage slot encoded in a character id."""
+    return char_id & SLOT_MASK
+
+
 class World:
-    def __init__(self):
+    def __init__(
+        self,
+        profession_counts: Optional[Dict[str, int]] = None,
+        compact_every: int = 100,
+    ):
         self.characters: List[Character] = []
         self.chain: List[str] = []
         self.cycle = 0
-        self._init_characters()
-
-    def _init_characters(self):
-        """Create two characters for each profession."""
-        counter = 0
-        for profession in PROFESSIONS:
-            for _ in range(2):
-                name = f"toon{counter:07d}"
-                self.characters.append(Character(name=name, profession=profession))
-                counter += 1
+        # Character storage: one entry per slot, free slots kept in a heap so
+        # the lowest are reused first and the table stays dense.
+        self._slots: List[Optional[Character]] = []
+        self._spawned = 0
+        self._free_slots: List[int] = []
+        self._positions: Dict[int, int] = {}  # id -> index in self.characters
+        self._name_counter = 0
+        self.retire_epoch = 0  # bumped on every retirement
+        self.compact_every = compact_every  # cycles between compactions, 0 = never
+        self.social_graph = SocialGraph()
+        # Called with the world after every completed cycle.
+        self.cycle_hooks: List[Callable[["World"], None]] = []
+        # Duels queued during a cycle, fought together when it ends.
+        self.pending_duels: List[Tuple[Character, Character, Interaction]] = []
+        # Wall time per completed cycle and per ``advance`` call.
+        self.cycle_latency = LatencyTracker()
+        self.slice_latency = LatencyTracker()
+        self._slices: Optional[Generator[int, Optional[float], None]] = None
+        self._init_characters(profession_counts)
+
+    def _init_characters(self, profession_counts: Optional[Dict[str, int]] = None):
+        """Create characters per profession (two of each by default)."""
+        if profession_counts is None:
+            profession_counts = {profession: 2 for profession in PROFESSIONS}
+        for profession, count in profession_counts.items():
+            for _ in range(count):
+                self.spawn(profession)
+
+    def spawn(self, profession: str, name: Optional[str] = None) -> Character:
+        """Create a character at runtime, reusing a free id slot if any."""
+        if name is None:
+            name = f"toon{self._name_counter:07d}"
+            self._name_counter += 1
+        if self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+        else:
+            slot = len(self._slots)
+            self._slots.append(None)
+        char = Character(name=name, profession=profession)
+        char.id = (self._spawned << SLOT_BITS) | slot
+        self._spawned += 1
+        char.pruned_epoch = self.retire_epoch
+        self.social_graph.add_node(char.id)
+        self._slots[slot] = char
+        self._positions[char.id] = len(self.characters)
+        self.characters.append(char)
+        return char
+
+    def retire(self, char: Character) -> None:
+        """Remove a character; relationships naming it are pruned lazily."""
+        if not self.is_alive(char.id):
+            return
+        slot = character_slot(char.id)
+        self._slots[slot] = None
+        heapq.heappush(self._free_slots, slot)
+        # Swap-remove keeps retirement O(1).
+        index = self._positions.pop(char.id)
+        last = self.characters.pop()
+        if last is not char:
+            self.characters[index] = last
+            self._positions[last.id] = index
+        # Mid-cycle the character may still be in the acting order.
+        char.done = True
+        self.retire_epoch += 1
+        self.social_graph.remove_node(char.id)
+
+    def is_alive(self, char_id: int) -> bool:
+        """Return True if ``char_id`` belongs to a live character."""
+        slot = character_slot(char_id)
+        return (
+            slot < len(self._slots)
+            and self._slots[slot] is not None
+            and self._slots[slot].id == char_id
+        )
+
+    def get_character(self, char_id: int) -> Optional[Character]:
+        """Return the live character with ``char_id``, if any."""
+        if self.is_alive(char_id):
+            return self._slots[character_slot(char_id)]
+        return None
+
+    def _prune_relationships(self, char: Character) -> None:
+        """Drop relationships to retired characters if any retired since."""
+        if char.pruned_epoch == self.retire_epoch:
+            return
+        rel = char.relationships
+        stale = [other for other in rel if not self.is_alive(other)]
+        for other in stale:
+            del rel[other]
+        char.pruned_epoch = self.retire_epoch
+
+    def _adjust_relationship(self, a: Character, b: Character, change: int) -> None:
+        """Apply ``change`` to the relationship in both directions."""
+        self._prune_relationships(a)
+        self._prune_relationships(b)
+        a.relationships[b.id] = a.relationships.get(b.id, 0) + change
+        b.relationships[a.id] = b.relationships.get(a.id, 0) + change
+        self.social_graph.apply_change(a.id, b.id, change)
+
+    def compact(self) -> None:
+        """Release storage left behind by retired characters.
+
+        Stale relationships are dropped and every per-character dict is
+        rebuilt, since Python dicts never shrink on deletion. Free slots at
+        the end of the slot table are trimmed away.
+        """
+        for char in self.characters:
+            char.pruned_epoch = -1
+            self._prune_relationships(char)
+            char.relationships = dict(char.relationships)
+            char.inventory = dict(char.inventory)
+        while self._slots and self._slots[-1] is None:
+            self._slots.pop()
+        size = len(self._slots)
+        self._free_slots = [slot for slot in self._free_slots if slot < size]
+        heapq.heapify(self._free_slots)
+        self._positions = dict(self._positions)
+        self.social_graph.compact()
 
     def process_merchant(self, merchant: Character) -> None:
         """Simple buy/sell routine for a merchant."""
         # Merchant buys any excess primary resources for 1 credit
-        buyables = {"substrate", "joules", "woodbits", "mealbits", "signalbits", "bugs", "tool", "plankbits", "buildingbits"}
+        buyables = MERCHANT_BUYABLES
         for char in self.characters:
             if char is merchant:
                 continue
@@ -376,7 +512,7 @@ class World:
         sample = random.sample(population, k=min(10, len(population)))
         if not sample:
             return None
-        target = max(sample, key=lambda c: abs(initiator.relationships.get(c.name, 0)))
+        target = max(sample, key=lambda c: abs(initiator.relationships.get(c.id, 0)))
         return target
 
     def perform_interaction(self, initiator: Character) -> bool:
@@ -388,6 +524,13 @@ class World:
         if not interaction.initiator_check(initiator):
             return False
 
+        if interaction.duel:
+            self.pending_duels.append((initiator, target, interaction))
+            print(f"{initiator.name} -> {target.name}: {interaction.name} (duel)")
+            initiator.done = True
+            target.done = True
+            return True
+
         weights = [o.weight for o in interaction.outcomes]
         outcome = random.choices(interaction.outcomes, weights=weights)[0]
         attempts = 0
@@ -397,8 +540,7 @@ class World:
 
         initiator.mood = max(0, min(100, initiator.mood + outcome.initiator_mood))
         target.mood = max(0, min(100, target.mood + outcome.target_mood))
-        initiator.relationships[target.name] = initiator.relationships.get(target.name, 0) + outcome.relationship_change
-        target.relationships[initiator.name] = target.relationships.get(initiator.name, 0) + outcome.relationship_change
+        self._adjust_relationship(initiator, target, outcome.relationship_change)
         for attr, delta in outcome.attr_changes.items():
             current = target.attributes.get(attr, 10)
             target.attributes[attr] = max(1, min(20, current + delta))
@@ -411,7 +553,7 @@ class World:
                 f"mood {initiator.name}:{initiator.mood} {target.name}:{target.mood}"
             )
         if outcome.relationship_change:
-            rel = initiator.relationships.get(target.name, 0)
+            rel = initiator.relationships.get(target.id, 0)
             details.append(f"relationship now {rel}")
         if outcome.attr_changes:
             attr_str = ", ".join(
@@ -424,25 +566,134 @@ class World:
         target.done = True
         return True
 
-    def run_cycle(self):
-        """Run a single cycle where each character acts once."""
+    def _start_cycle(self) -> List[Character]:
+        """Advance the cycle counter and return this cycle's acting order."""
         self.cycle += 1
         order = self.characters[:]
         random.shuffle(order)
-        for char in order:
-            if char.done:
+        return order
+
+    def _act(self, char: Character) -> None:
+        """Let one character take its action for the current cycle."""
+        if char.done:
+            return
+        action = char.choose_action()
+        if action == "interactive":
+            if not self.perform_interaction(char):
+                char.perform_self_action()
+        elif action == "professional":
+            char.perform_professional_action(self.cycle, self.chain, self)
+        else:
+            char.perform_self_action()
+
+    def settle_duels(self) -> None:
+        """Fight every queued duel in one batch and apply the results."""
+        if not self.pending_duels:
+            return
+        pending = [
+            duel for duel in self.pending_duels
+            if self.is_alive(duel[0].id) and self.is_alive(duel[1].id)
+        ]
+        self.pending_duels = []
+        results = duels.resolve_duels([(a, b) for a, b, _ in pending])
+        for (challenger, defender, interaction), result in zip(pending, results):
+            if result.winner is None:
+                print(f"{challenger.name} and {defender.name} fought to a draw")
                 continue
-            action = char.choose_action()
-            if action == "interactive":
-                if not self.perform_interaction(char):
-                    char.perform_self_action()
-            elif action == "professional":
-                char.perform_professional_action(self.cycle, self.chain, self)
+            if result.winner == challenger.name:
+                winner, loser = challenger, defender
             else:
-                char.perform_self_action()
+                winner, loser = defender, challenger
+            winner.mood = min(100, winner.mood + DUEL_MOOD)
+            loser.mood = max(0, loser.mood - DUEL_MOOD)
+            # Grudge matches sour a relationship, accepted duels build respect.
+            change = -1 if interaction.name in NEGATIVE_INTERACTIONS else 1
+            self._adjust_relationship(challenger, defender, change)
+            print(
+                f"{winner.name} won the duel against {loser.name} "
+                f"({result.duration:.1f}s, {result.hits} swings)"
+            )
+
+    def _finish_cycle(self) -> None:
+        self.settle_duels()
         # reset done flags for next cycle
         for char in self.characters:
             char.done = False
+        if self.compact_every and self.cycle % self.compact_every == 0:
+            self.compact()
+        for hook in self.cycle_hooks:
+            hook(self)
+
+    def run_cycle(self):
+        """Run a single cycle where each character acts once.
+
+        If a sliced cycle is in progress it is finished instead.
+        """
+        if self._slices is not None:
+            for _ in self._slices:
+                pass
+            self._slices = None
+            return
+        started = time.perf_counter()
+        for char in self._start_cycle():
+            self._act(char)
+        self._finish_cycle()
+        self.cycle_latency.record(time.perf_counter() - started)
+
+    def iter_cycle(
+        self, budget: float = 0.002
+    ) -> Generator[int, Optional[float], None]:
+        """Run one cycle in slices of roughly ``budget`` seconds.
+
+        Each slice acts for at least one character, then yields how many
+        are still waiting. Sending a number sets the next slice's budget.
+        The acting order is fixed when the cycle starts, so every character
+        still acts at most once per cycle.
+        """
+        started = time.perf_counter()
+        order = self._start_cycle()
+        index = 0
+        while True:
+            deadline = time.perf_counter() + budget
+            while index < len(order):
+                self._act(order[index])
+                index += 1
+                if time.perf_counter() >= deadline:
+                    break
+            if index >= len(order):
+                break
+            sent = yield len(order) - index
+            if sent is not None:
+                budget = sent
+        self._finish_cycle()
+        self.cycle_latency.record(time.perf_counter() - started)
+
+    def advance(self, budget: float = 0.002) -> int:
+        """Spend about ``budget`` seconds on the simulation and return.
+
+        A partially run cycle is resumed where it left off; when a cycle
+        completes with budget to spare the next one is started. Returns
+        the number of cycles completed during this call.
+        """
+        started = time.perf_counter()
+        deadline = started + budget
+        completed = 0
+        while True:
+            remaining = max(0.0, deadline - time.perf_counter())
+            try:
+                if self._slices is None:
+                    self._slices = self.iter_cycle(remaining)
+                    next(self._slices)
+                else:
+                    self._slices.send(remaining)
+            except StopIteration:
+                self._slices = None
+                completed += 1
+                if time.perf_counter() < deadline:
+                    continue
+            break
+        self.slice_latency.record(time.perf_counter() - started)
+        return completed
 
     def run(self, cycles: int = 10):
         for _ in range(cycles):
@@ -0,0 +1,272 @@
+"""Win-rate matrix of every pyRL toon against every NPC.
+
+Each (toon, NPC, policy) cell runs ``trials`` headless fights through
+``pyRL_uta0628c.simulate_fight`` and reports the player's win rate, the
+mean time-to-kill of the fights it won, its DPS and the damage it took,
+each with a 95% confidence interval. Cells are spread over a process pool
+and every cell seeds ``random`` from the run seed and its own key, so
+results do not depend on the number of workers or on scheduling order.
+Without ``--seed`` the run seed is drawn fresh and printed, so a run can
+still be repeated.
+
+Run ``python matchups.py --trials 1000 --csv matchups.csv`` for the full
+grid; the terminal shows one win-rate table per policy.
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pyRL_uta0628c as rl
+
+# Named player policies: the keys ``ScriptedPolicy`` cycles through.
+POLICIES: Dict[str, Tuple[str, ...]] = {
+    "melee": ("a",),
+    "magic": ("s",),
+    "weapons": ("z", "x"),
+    "rotation": ("z", "x", "d", "c", "a", "s"),
+}
+
+Z_95 = 1.96
+
+
+@dataclass
+class Estimate:
+    """Sample mean with a 95% confidence interval."""
+    mean: float
+    low: float
+    high: float
+
+    def __str__(self) -> str:
+        return f"{self.mean:.1f} [{self.low:.1f}, {self.high:.1f}]"
+
+
+@dataclass
+class MatchupStats:
+    """Aggregated results of one (toon, NPC, policy) cell."""
+    toon: str
+    npc_id: int
+    npc: str
+    policy: str
+    trials: int
+    seed: int  # run seed; with the cell key it reproduces the cell
+    wins: int
+    timeouts: int
+    win_rate: Estimate  # percent
+    time_to_kill: Estimate  # seconds, fights the toon won
+    dps: Estimate  # player damage dealt per second
+    damage_taken: Estimate
+
+    def row(self) -> Dict[str, object]:
+        """Flatten into a CSV row; estimates become mean/low/high columns."""
+        row: Dict[str, object] = {}
+        for name, value in asdict(self).items():
+            if isinstance(value, dict):
+                for part, number in value.items():
+                    row[f"{name}_{part}"] = round(number, 3)
+            else:
+                row[name] = value
+        return row
+
+
+def wilson_interval(successes: int, trials: int, z: float = Z_95) -> Estimate:
+    """Win rate in percent with a Wilson score interval."""
+    if not trials:
+        return Estimate(0.0, 0.0, 0.0)
+    p = successes / trials
+    denom = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denom
+    spread = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denom
+    return Estimate(100 * p, 100 * max(0.0, centre - spread), 100 * min(1.0, centre + spread))
+
+
+def mean_interval(samples: Sequence[float], z: float = Z_95) -> Estimate:
+    """Sample mean with a normal-approximation interval."""
+    n = len(samples)
+    if not n:
+        return Estimate(float("nan"), float("nan"), float("nan"))
+    mean = sum(samples) / n
+    if n < 2:
+        return Estimate(mean, mean, mean)
+    variance = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    half = z * math.sqrt(variance / n)
+    return Estimate(mean, mean - half, mean + half)
+
+
+def fresh_seed() -> int:
+    """A run seed from OS entropy, for runs not given one."""
+    return random.SystemRandom().randrange(2 ** 32)
+
+
+def _load_tables() -> None:
+    if not rl.TOONS_DATA:
+        rl.load_item_and_action_tables()
+        rl.TOONS_DATA = rl.load_table("toons")
+        rl.NPCS_DATA = rl.load_table("npcs")
+
+
+def run_matchup(
+    toon: str,
+    npc_id: int,
+    policy: str,
+    trials: int,
+    seed: Optional[int] = None,
+    max_time: float = 600.0,
+) -> MatchupStats:
+    """Fight ``toon`` against NPC ``npc_id`` ``trials`` times."""
+    _load_tables()
+    if seed is None:
+        seed = fresh_seed()
+    random.seed(f"{seed}:{toon}:{npc_id}:{policy}")
+    keys = POLICIES[policy]
+    toon_data = rl.TOONS_DATA[toon]
+    npc_data = rl.NPCS_DATA[npc_id]
+    player_template = rl.Entity(toon, is_player=True)
+    player_template.load_char_data(toon_data)
+    opponent_template = rl.Entity("npc")
+    opponent_template.load_npc_data(npc_data)
+    wins = timeouts = 0
+    kill_times: List[float] = []
+    dps: List[float] = []
+    taken: List[float] = []
+    for _ in range(trials):
+        player = player_template.clone()
+        opponent = opponent_template.clone()
+        result = rl.simulate_fight(
+            player, opponent, rl.ScriptedPolicy(keys), max_time=max_time,
+        )
+        if result.player_won:
+            wins += 1
+            kill_times.append(result.duration)
+        elif result.timed_out:
+            timeouts += 1
+        if result.duration > 0:
+            dps.append(result.player_damage_dealt / result.duration)
+        taken.append(result.player_damage_taken)
+    return MatchupStats(
+        toon=toon,
+        npc_id=npc_id,
+        npc=npc_data.get("Name", str(npc_id)),
+        policy=policy,
+        trials=trials,
+        seed=seed,
+        wins=wins,
+        timeouts=timeouts,
+        win_rate=wilson_interval(wins, trials),
+        time_to_kill=mean_interval(kill_times),
+        dps=mean_interval(dps),
+        damage_taken=mean_interval(taken),
+    )
+
+
+def _run_cell(args: Tuple) -> MatchupStats:
+    return run_matchup(*args)
+
+
+def run_matrix(
+    toons: Optional[Sequence[str]] = None,
+    npc_ids: Optional[Sequence[int]] = None,
+    policies: Sequence[str] = ("melee",),
+    trials: int = 1000,
+    seed: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> List[MatchupStats]:
+    """Run every (toon, NPC, policy) cell, on a process pool unless ``workers`` is 1.
+
+    Without ``seed`` one fresh run seed is drawn for the whole matrix; every
+    returned cell carries it in ``seed``.
+    """
+    _load_tables()
+    if seed is None:
+        seed = fresh_seed()
+    toons = list(toons or rl.TOONS_DATA)
+    npc_ids = list(npc_ids or rl.NPCS_DATA)
+    for policy in policies:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}; choose from {', '.join(POLICIES)}")
+    cells = [
+        (toon, npc_id, policy, trials, seed)
+        for policy in policies for toon in toons for npc_id in npc_ids
+    ]
+    if workers == 1:
+        return [_run_cell(cell) for cell in cells]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_tables) as pool:
+        return list(pool.map(_run_cell, cells))
+
+
+def write_csv(results: Sequence[MatchupStats], path: str) -> None:
+    rows = [r.row() for r in results]
+    if not rows:
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def format_table(results: Sequence[MatchupStats], metric: str = "win_rate") -> str:
+    """One table per policy: NPCs down the side, toons across, ``metric`` means."""
+    lines: List[str] = []
+    policies = list(dict.fromkeys(r.policy for r in results))
+    for policy in policies:
+        cells = [r for r in results if r.policy == policy]
+        toons = list(dict.fromkeys(r.toon for r in cells))
+        npcs = list(dict.fromkeys((r.npc_id, r.npc) for r in cells))
+        value = {(r.toon, r.npc_id): getattr(r, metric).mean for r in cells}
+        width = max(6, max(len(t) for t in toons) + 1)
+        label = max(len(name) for _, name in npcs) + 1
+        lines.append(f"{metric} ({policy})")
+        lines.append(" " * label + "".join(f"{t[:width - 1]:>{width}}" for t in toons))
+        for npc_id, name in npcs:
+            lines.append(f"{name:<{label}}" + "".join(
+                f"{value[(t, npc_id)]:>{width}.1f}" for t in toons
+            ))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _parse_list(text: str, convert=str) -> Optional[List]:
+    return [convert(part) for part in text.split(",") if part.strip()] or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=1000)
+    parser.add_argument("--toons", default="", help="comma separated names")
+    parser.add_argument("--npcs", default="", help="comma separated npcIDs")
+    parser.add_argument("--policies", default="melee",
+                        help=f"comma separated, from: {', '.join(POLICIES)}")
+    parser.add_argument("--metric", default="win_rate",
+                        choices=["win_rate", "time_to_kill", "dps", "damage_taken"])
+    parser.add_argument("--csv", default=None, help="write every cell here")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None, help="default: a fresh one, printed")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else fresh_seed()
+
+    started = time.perf_counter()
+    try:
+        results = run_matrix(
+            _parse_list(args.toons),
+            _parse_list(args.npcs, int),
+            _parse_list(args.policies) or ["melee"],
+            args.trials,
+            seed,
+            args.workers,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+    elapsed = time.perf_counter() - started
+    print(format_table(results, args.metric))
+    if args.csv:
+        write_csv(results, args.csv)
+        print(f"wrote {len(results)} cells to {os.path.abspath(args.csv)}")
+    fights = sum(r.trials for r in results)
+    print(f"{fights} fights in {elapsed:.1f} s ({fights / elapsed:.0f}/s), seed {seed}")
@@ -0,0 +1,255 @@
+"""Memory accounting for a running main.World.
+
+``measure`` walks the world's data structures and attributes their bytes to
+subsystems (relationships, inventories, the block chain, interaction
+tables, ...), so growth can be pinned on a structure rather than on a
+line of code. When ``tracemalloc`` is tracing, the report also carries the
+traced total and, against a previous report, the allocation sites that
+grew the most.
+
+``MemoryMonitor`` takes a report every N cycles through
+``World.cycle_hooks``, keeps the deltas and can append each report to a
+JSON-lines file.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+import main
+
+# Containers walked into; anything else is counted as a leaf object.
+_CONTAINERS = (dict, list, tuple, set, frozenset)
+
+
+def sizeof(obj, seen: Optional[Set[int]] = None) -> int:
+    """Return the bytes held by ``obj`` and everything it reaches.
+
+    Objects already in ``seen`` are skipped, so sharing a ``seen`` set
+    across calls attributes shared objects to the first subsystem only.
+    Plain instances are followed through ``__dict__`` and ``__slots__``;
+    functions, classes and modules count as leaves.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+        elif isinstance(item, (str, bytes, int, float, bool, type(None))):
+            continue
+        elif callable(item) or isinstance(item, type(os)):
+            continue
+        else:
+            attrs = getattr(item, "__dict__", None)
+            if attrs is not None:
+                stack.append(attrs)
+            for slot in getattr(type(item), "__slots__", ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+
+@dataclass
+class MemoryReport:
+    """Bytes per World subsystem at one cycle."""
+    cycle: int
+    characters: int
+    subsystems: Dict[str, int]
+    relationship_entries: int
+    max_relationships: int  # largest single relationship dict
+    traced_bytes: Optional[int] = None
+    traced_peak: Optional[int] = None
+    top_growth: List[Tuple[str, int]] = field(default_factory=list)
+    snapshot: Optional[tracemalloc.Snapshot] = field(default=None, repr=False)
+
+    @property
+    def total(self) -> int:
+        return sum(self.subsystems.values())
+
+    def per_character(self, subsystem: str) -> float:
+        """Average bytes of ``subsystem`` per live character."""
+        if not self.characters:
+            return 0.0
+        return self.subsystems.get(subsystem, 0) / self.characters
+
+    def diff(self, earlier: "MemoryReport") -> Dict[str, int]:
+        """Return the byte change per subsystem since ``earlier``."""
+        names = set(self.subsystems) | set(earlier.subsystems)
+        return {
+            name: self.subsystems.get(name, 0) - earlier.subsystems.get(name, 0)
+            for name in sorted(names)
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "cycle": self.cycle,
+            "characters": self.characters,
+            "subsystems": self.subsystems,
+            "total": self.total,
+            "relationship_entries": self.relationship_entries,
+            "max_relationships": self.max_relationships,
+            "traced_bytes": self.traced_bytes,
+            "traced_peak": self.traced_peak,
+            "top_growth": self.top_growth,
+        }
+
+    def format(self, earlier: Optional["MemoryReport"] = None) -> str:
+        """Return a plain-text table, with deltas if ``earlier`` is given."""
+        delta = self.diff(earlier) if earlier else {}
+        lines = [f"cycle {self.cycle}: {self.characters} characters"]
+        for name, size in sorted(self.subsystems.items(), key=lambda kv: -kv[1]):
+            line = f"  {name:<16}{size / 1024:>10.1f} KiB"
+            if name in delta:
+                line += f"  ({delta[name] / 1024:+.1f})"
+            lines.append(line)
+        lines.append(f"  {'total':<16}{self.total / 1024:>10.1f} KiB")
+        lines.append(
+            f"  relationships: {self.relationship_entries} entries, "
+            f"largest {self.max_relationships}"
+        )
+        if self.traced_bytes is not None:
+            lines.append(
+                f"  tracemalloc: {self.traced_bytes / 1024:.1f} KiB "
+                f"(peak {self.traced_peak / 1024:.1f} KiB)"
+            )
+        for where, size in self.top_growth:
+            lines.append(f"    {size / 1024:+.1f} KiB  {where}")
+        return "\n".join(lines)
+
+
+def measure(
+    world: "main.World",
+    earlier: Optional[MemoryReport] = None,
+    top: int = 5,
+) -> MemoryReport:
+    """Account the memory held by ``world``, subsystem by subsystem.
+
+    Shared objects are counted once, in the first subsystem that reaches
+    them, in the order listed below.
+    """
+    seen: Set[int] = set()
+    chars = world.characters
+    subsystems = {
+        "relationships": sum(sizeof(c.relationships, seen) for c in chars),
+        "inventories": sum(sizeof(c.inventory, seen) for c in chars),
+        "attributes": sum(sizeof(c.attributes, seen) for c in chars),
+        # Whatever is left of each character: the instance and its scalars.
+        "characters": sizeof(chars, seen),
+        "chain": sizeof(world.chain, seen),
+        "social_graph": sizeof(world.social_graph, seen),
+        "interactions": sizeof(main.INTERACTIONS, seen),
+        "duels": sizeof(world.pending_duels, seen),
+        "slots": sum(
+            sizeof(part, seen)
+            for part in (world._slots, world._free_slots, world._positions)
+        ),
+        "latency": sizeof(world.cycle_latency, seen)
+        + sizeof(world.slice_latency, seen),
+    }
+
+    sizes = [len(c.relationships) for c in chars]
+    report = MemoryReport(
+        cycle=world.cycle,
+        characters=len(chars),
+        subsystems=subsystems,
+        relationship_entries=sum(sizes),
+        max_relationships=max(sizes, default=0),
+    )
+    if tracemalloc.is_tracing():
+        report.traced_bytes, report.traced_peak = tracemalloc.get_traced_memory()
+        report.snapshot = tracemalloc.take_snapshot()
+        if earlier is not None and earlier.snapshot is not None:
+            stats = report.snapshot.compare_to(earlier.snapshot, "lineno")
+            report.top_growth = [
+                (str(stat.traceback), stat.size_diff) for stat in stats[:top]
+            ]
+    return report
+
+
+class MemoryMonitor:
+    """Take a ``MemoryReport`` every ``every`` cycles of a World."""
+
+    def __init__(
+        self,
+        world: "main.World",
+        every: int = 100,
+        dump_path: Optional[str] = None,
+        trace: bool = False,
+        keep: int = 100,
+    ):
+        self.world = world
+        self.every = every
+        self.dump_path = dump_path
+        self.keep = keep  # reports retained in memory
+        self.reports: List[MemoryReport] = []
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        world.cycle_hooks.append(self._on_cycle)
+
+    def detach(self) -> None:
+        if self._on_cycle in self.world.cycle_hooks:
+            self.world.cycle_hooks.remove(self._on_cycle)
+
+    @property
+    def latest(self) -> Optional[MemoryReport]:
+        return self.reports[-1] if self.reports else None
+
+    def _on_cycle(self, world: "main.World") -> None:
+        if self.every and world.cycle % self.every == 0:
+            self.take()
+
+    def take(self) -> MemoryReport:
+        """Measure now, record the report and dump it if configured."""
+        earlier = self.latest
+        report = measure(self.world, earlier)
+        if earlier is not None:
+            # Only the newest snapshot is needed for the next comparison.
+            earlier.snapshot = None
+        self.reports.append(report)
+        del self.reports[:-self.keep]
+        if self.dump_path:
+            record = report.to_dict()
+            if earlier is not None:
+                record["delta"] = report.diff(earlier)
+            with open(self.dump_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=500)
+    parser.add_argument("--every", type=int, default=100)
+    parser.add_argument("--per-profession", type=int, default=2)
+    parser.add_argument("--dump", default=None, help="append JSON lines here")
+    parser.add_argument("--trace", action="store_true",
+                        help="also take tracemalloc snapshots")
+    args = parser.parse_args()
+
+    world = main.World({p: args.per_profession for p in main.PROFESSIONS})
+    monitor = MemoryMonitor(world, args.every, args.dump, args.trace)
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(args.cycles):
+            world.run_cycle()
+    previous = None
+    for report in monitor.reports:
+        print(report.format(previous))
+        previous = report
+    print(f"\n{args.cycles} cycles in {time.perf_counter() - started:.2f} s")
@@ -0,0 +1,512 @@
+"""Search-based action choice for pyRL NPCs.
+
+NPCs normally cycle through the ``act1`` to ``act9`` columns of
+``pyRL_npcs.csv``. ``SearchPolicy`` is an ``opponent_policy`` for
+``CombatEngine`` that instead picks, each time the NPC's attack bar fills,
+the action from that repertoire with the best depth-limited expectimax
+value. The search runs on ``CombatState``, a flat slotted snapshot of the
+fight (HP, attack timers and active effects), which copies with a few list
+copies, and takes hit outcomes from ``damage_model``. Search deepens one NPC
+turn at a time until the per-decision time budget (5 ms by default) runs
+out or the lookahead reaches the end of the fight. The clock is checked
+at every simulated attack, and a depth is not started when the last one
+predicts it cannot finish. If not even one turn fits, the NPC keeps to its
+scripted sequence, so a decision never costs much more than the budget.
+
+The state follows the rules for what effects do: HP over time, HP when an
+effect ends, the NPC's own AtkSp (the only stat the rules change on an
+NPC) and the ``MAX_ACTIVE_EFFECTS`` cap. The player is assumed to keep
+using its queued action for its mean damage. Item cooldowns are left out
+on purpose: they only gate the player's slot 7 and 8 items, and a model
+that already ignores the player switching actions gains nothing from
+tracking when one of them comes back. The NPC's next hit resolves to
+at most three outcomes (a dodge, a low and a high damage bucket); hits
+further ahead use their mean.
+
+``python npc_ai.py --trials 200`` compares player win rates against
+scripted and searching NPCs.
+"""
+
+import argparse
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import damage_model
+import matchups
+import pyRL_uta0628c as rl
+
+PLAYER, NPC = 0, 1
+DEFAULT_BUDGET = 0.005  # seconds per decision
+MAX_DEPTH = 12  # NPC turns looked ahead at most
+WIN_VALUE = 2.0  # beyond any HP-difference score
+# Stats apply_effect turns into an effect; every other column is ignored.
+EFFECT_STATS = set(rl.ATTRIBUTES) | {"AtkPw", "MgcPw", "AtkSp", "Block", "Dodge", "Armor", "MgcRs", "Crits"}
+MODEL_CACHE_SIZE = 4096
+
+# (hp_per_second, hp_on_end, atk_sp)
+EffectSpec = Tuple[float, float, float]
+Outcome = Tuple[float, float, bool]  # (probability, damage to the target, whether it landed)
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ActionModel:
+    """What one use of an action does, as far as the search is concerned."""
+    action_id: int
+    outcomes: Tuple[Outcome, ...]
+    mean: float
+    mean_outcome: Tuple[Outcome, ...]  # the mean as a single outcome
+    self_effect: Optional[EffectSpec]
+    self_instant_hp: float  # instant heal (+) or self-damage (-)
+    target_effect: Optional[EffectSpec]
+    duration: float
+
+    @property
+    def plain(self) -> bool:
+        """True when only the hit matters: no HP change besides it and no AtkSp change."""
+        effects = [e for e in (self.self_effect, self.target_effect) if e is not None]
+        return (not self.self_instant_hp and not any(e[0] or e[1] for e in effects)
+                and not (self.self_effect and self.self_effect[2]))
+
+
+def _buckets(dist: "damage_model.DamageDistribution") -> Tuple[Outcome, ...]:
+    """Collapse a damage distribution into a dodge and two damage buckets."""
+    outcomes = []
+    if dist.dodge_chance > 0:
+        outcomes.append((dist.dodge_chance, 0.0, False))
+    landed = 1.0 - dist.dodge_chance
+    if landed <= 0:
+        return tuple(outcomes)
+    # Hits only: the dodge mass sits on 0 damage.
+    hits = dict(dist.probabilities)
+    hits[0] = hits.get(0, 0.0) - dist.dodge_chance
+    half = landed / 2
+    low = high = low_mass = high_mass = 0.0
+    for damage in sorted(hits):
+        p = max(0.0, hits[damage])
+        below = min(p, max(0.0, half - low_mass))
+        low_mass += below
+        low += damage * below
+        high_mass += p - below
+        high += damage * (p - below)
+    for mass, total in ((low_mass, low), (high_mass, high)):
+        if mass > 0:
+            outcomes.append((mass, total / mass, True))
+    return tuple(outcomes)
+
+
+def _effect_spec(action, columns, instant_allowed: bool) -> Tuple[Optional[EffectSpec], float]:
+    """Return ``(effect, instant_hp)`` as ``apply_effect`` builds them.
+
+    ``columns`` pairs each buff/debuff target stat with its sign; the effect
+    is None when ``apply_effect`` would not add one.
+    """
+    rate = on_end = atk_sp = instant = 0.0
+    has_stat = False
+    for stat, sign in columns:
+        if stat == "HP":
+            if action.timing == "tick":
+                rate = sign * (action.base_val / action.duration if action.duration > 0 else action.base_val)
+            elif action.timing == "end":
+                on_end = sign * action.base_val
+            elif instant_allowed:
+                instant += sign * action.base_val
+        elif stat in EFFECT_STATS:
+            has_stat = True
+            if stat == "AtkSp":
+                atk_sp = sign * action.base_val
+    effect = (rate, on_end, atk_sp) if has_stat or rate or on_end else None
+    return effect, instant
+
+
+def action_model(attacker, target, action_id: int, include_outcomes: bool = True) -> ActionModel:
+    action = rl.ALL_ACTIONS[action_id]
+    self_effect, self_instant = _effect_spec(
+        action, [(action.self_buff_target_stat, 1), (action.self_debuff_target_stat, -1)], True,
+    )
+    target_effect, _ = _effect_spec(action, [(action.enemy_debuff_target_stat, -1)], False)
+    if action.dmg_stat_source or action.enemy_debuff_target_stat:
+        dist = damage_model.damage_distribution(attacker, target, action)
+        outcomes = _buckets(dist) if include_outcomes else ()
+        mean, landed = dist.mean, dist.dodge_chance < 0.5
+    else:
+        # No roll: nothing can be dodged.
+        outcomes, mean, landed = ((1.0, 0.0, True),), 0.0, True
+    return ActionModel(
+        action_id=action_id,
+        outcomes=outcomes,
+        mean=mean,
+        mean_outcome=((1.0, mean, landed),),
+        self_effect=self_effect,
+        self_instant_hp=self_instant,
+        target_effect=target_effect,
+        duration=float(action.duration),
+    )
+
+
+def _npc_fill_time(atk_sp: float) -> float:
+    # Entity.update_stats_and_effects for NPCs.
+    atk_sp = max(1, atk_sp)
+    return max(rl.REFRESH_RATE, 1.2 + (5.0 - 1.2) * (1 - atk_sp / 100.0))
+
+
+class CombatState:
+    """Flat copy of the parts of a fight the search simulates.
+
+    Index 0 of every pair is the player, index 1 the NPC. Times are seconds
+    from the decision being searched. Effects are
+    ``(expires_at, side, hp_per_second, hp_on_end, atk_sp)`` tuples.
+    """
+    __slots__ = ("time", "hp", "max_hp", "next_attack", "fill", "npc_atk_sp", "effects")
+
+    def __init__(self, hp, max_hp, next_attack, fill, npc_atk_sp, effects):
+        self.time = 0.0
+        self.hp = hp
+        self.max_hp = max_hp
+        self.next_attack = next_attack
+        self.fill = fill
+        self.npc_atk_sp = npc_atk_sp  # before effects
+        self.effects = effects
+
+    @classmethod
+    def from_engine(cls, engine: "rl.CombatEngine") -> "CombatState":
+        """Snapshot taken when the NPC's attack bar has just filled."""
+        player, npc = engine.player, engine.opponent
+        effects = []
+        for side, entity in ((PLAYER, player), (NPC, npc)):
+            for effect in entity.active_effects:
+                on_end = effect.hp_on_end if effect.timing == "end" else 0.0
+                effects.append((entity.effect_time_left(effect), side, effect.hp_per_second,
+                                on_end, effect.stat_mods.get("AtkSp", 0)))
+        return cls(
+            hp=[float(player.current_hp), float(npc.current_hp)],
+            max_hp=(float(player.max_hp), float(npc.max_hp)),
+            next_attack=[(100.0 - player.attack_bar_progress) * player.attack_fill_time / 100.0, 0.0],
+            fill=[player.attack_fill_time, npc.attack_fill_time],
+            npc_atk_sp=(npc.npc_data_source or {}).get("AtkSp", 20),
+            effects=effects,
+        )
+
+    def copy(self) -> "CombatState":
+        other = CombatState.__new__(CombatState)
+        other.time = self.time
+        other.hp = self.hp[:]
+        other.max_hp = self.max_hp  # never changes
+        other.next_attack = self.next_attack[:]
+        other.fill = self.fill[:]
+        other.npc_atk_sp = self.npc_atk_sp
+        other.effects = self.effects[:]  # tuples are shared
+        return other
+
+    @property
+    def over(self) -> bool:
+        return self.hp[PLAYER] <= 0 or self.hp[NPC] <= 0
+
+    def _change_hp(self, side: int, amount: float) -> None:
+        self.hp[side] = min(self.max_hp[side], max(0.0, self.hp[side] + amount))
+
+    def _refresh_npc_fill(self) -> None:
+        # A bar part way through keeps its progress and fills at the new rate.
+        old = self.fill[NPC]
+        new = _npc_fill_time(self.npc_atk_sp + sum(e[4] for e in self.effects if e[1] == NPC))
+        if new != old:
+            self.fill[NPC] = new
+            remaining = max(0.0, self.next_attack[NPC] - self.time)
+            self.next_attack[NPC] = self.time + remaining * new / old
+
+    def run_effects(self, until: float) -> None:
+        """Apply HP-over-time and effect expiries up to ``until``."""
+        if not self.effects:
+            self.time = max(self.time, until)
+            return
+        while True:
+            due = min((e for e in self.effects if e[0] <= until), default=None)
+            end = due[0] if due is not None else until
+            elapsed = end - self.time
+            if elapsed > 0:
+                for side in (PLAYER, NPC):
+                    rate = sum(e[2] for e in self.effects if e[1] == side)
+                    if rate and self.hp[side] > 0:
+                        self._change_hp(side, rate * elapsed)
+                self.time = end
+            if due is None:
+                return
+            self.effects.remove(due)
+            if due[3]:
+                self._change_hp(due[1], due[3])
+            if due[1] == NPC and due[4]:
+                self._refresh_npc_fill()
+
+    def _add_effect(self, side: int, effect: EffectSpec, duration: float) -> None:
+        self.effects.append((self.time + duration, side) + effect)
+        if side == NPC and effect[2]:
+            self._refresh_npc_fill()
+
+    def _effect_count(self, side: int) -> int:
+        return sum(1 for e in self.effects if e[1] == side)
+
+    def act(self, side: int, model: ActionModel, damage: float, landed: bool) -> None:
+        """Resolve one use of ``model`` by ``side`` with the given outcome."""
+        target = 1 - side
+        if (model.self_effect is not None or model.self_instant_hp) and \
+                self._effect_count(side) < rl.MAX_ACTIVE_EFFECTS:
+            if model.self_instant_hp:
+                self._change_hp(side, model.self_instant_hp)
+            if model.self_effect is not None:
+                self._add_effect(side, model.self_effect, model.duration)
+        if not landed:
+            return
+        self._change_hp(target, -damage)
+        if model.target_effect is not None and self._effect_count(target) < rl.MAX_ACTIVE_EFFECTS:
+            self._add_effect(target, model.target_effect, model.duration)
+
+
+def _stats_key(entity) -> Tuple:
+    # Everything damage_distribution reads from an attacker or a target.
+    return (entity.atk_pw, entity.mgc_pw, entity.crits_val, entity.attack_fill_time,
+            entity.dodge_val, entity.block_val, entity.armor_val, entity.mgc_rs_val)
+
+
+class SearchPolicy:
+    """``CombatEngine`` opponent policy that picks NPC actions by expectimax.
+
+    ``decision_times`` keeps how long recent decisions took and ``depths``
+    how many NPC turns each one looked ahead (0: no search was needed, or
+    none fitted the budget).
+    """
+
+    def __init__(self, budget: float = DEFAULT_BUDGET, max_depth: int = MAX_DEPTH, keep: int = 1000):
+        self.budget = budget
+        self.max_depth = max_depth
+        self.decision_times = deque(maxlen=keep)
+        self.depths = deque(maxlen=keep)
+        self._deadline = 0.0
+        self._cut = False  # whether the last pass stopped anywhere short of the fight's end
+        self._models: List[ActionModel] = []
+        self._player_model: Optional[ActionModel] = None
+        self._model_cache: Dict[Tuple, ActionModel] = {}
+        self._default_model: Optional[ActionModel] = None
+        self._horizon = 0.0
+
+    def __call__(self, engine: "rl.CombatEngine") -> Optional[int]:
+        started = time.perf_counter()
+        self._deadline = started + self.budget
+        npc = engine.opponent
+        scripted = npc.npc_data_source.get(f"act{(npc.action_sequence_index % 9) + 1}")
+        choice, depth = self._search(engine, scripted)
+        self.decision_times.append(time.perf_counter() - started)
+        self.depths.append(depth)
+        return choice
+
+    def _model(self, attacker, target, action_id: int, include_outcomes: bool = True) -> ActionModel:
+        # Stats only change with effects, so the same few models come back all fight.
+        key = (action_id, include_outcomes, _stats_key(attacker), _stats_key(target))
+        model = self._model_cache.get(key)
+        if model is None:
+            if len(self._model_cache) >= MODEL_CACHE_SIZE:
+                self._model_cache.clear()
+            model = self._model_cache[key] = action_model(attacker, target, action_id, include_outcomes)
+        return model
+
+    def _search(self, engine: "rl.CombatEngine", scripted: Optional[int]) -> Tuple[Optional[int], int]:
+        player, npc = engine.player, engine.opponent
+        repertoire = sorted({
+            npc.npc_data_source.get(f"act{i}") for i in range(1, 10)
+        } & set(rl.ALL_ACTIONS))
+        if not repertoire:
+            return scripted, 0
+        models = _candidates([self._model(npc, player, action_id) for action_id in repertoire])
+        if len(models) == 1:
+            return models[0].action_id, 0
+        player_action = player.get_action_for_key(player.queued_action_key)
+        self._player_model = (
+            self._model(player, npc, player_action, include_outcomes=False)
+            if player_action in rl.ALL_ACTIONS else None
+        )
+        root = CombatState.from_engine(engine)
+        self._models = models
+        self._default_model = max(models, key=lambda m: m.mean)
+
+        best, best_depth = scripted, 0
+        for depth in range(1, self.max_depth + 1):
+            self._cut = False
+            self._horizon = (depth + 1) * root.fill[NPC]
+            started = time.perf_counter()
+            try:
+                values = {m.action_id: self._expected(root, m, depth, m.outcomes) for m in models}
+            except _OutOfTime:
+                break
+            finished = time.perf_counter()
+            top = max(values.values())
+            # Ties keep the scripted action, so the NPC stays in character.
+            if values.get(scripted) == top:
+                best = scripted
+            else:
+                best = min(a for a, v in values.items() if v == top)
+            best_depth = depth
+            if not self._cut:
+                break  # every line already ends the fight
+            # The next pass branches over every action once more; when it cannot
+            # fit, stop now rather than start it and throw it away.
+            if finished + (finished - started) * len(models) > self._deadline:
+                break
+        return best, best_depth
+
+    def _check_time(self) -> None:
+        if time.perf_counter() > self._deadline:
+            raise _OutOfTime
+
+    def _expected(self, state: CombatState, model: ActionModel, depth: int, outcomes) -> float:
+        self._check_time()
+        total = 0.0
+        for probability, damage, landed in outcomes:
+            after = state.copy()
+            after.act(NPC, model, damage, landed)
+            after.next_attack[NPC] = after.time + after.fill[NPC]
+            self._until_npc_turn(after)
+            total += probability * self._value(after, depth - 1)
+        return total
+
+    def _value(self, state: CombatState, depth: int) -> float:
+        if state.over:
+            return _evaluate(state)
+        if depth == 0:
+            self._cut = True
+            self._rollout(state)
+            return _evaluate(state)
+        return max(self._expected(state, m, depth, m.mean_outcome) for m in self._models)
+
+    def _rollout(self, state: CombatState) -> None:
+        # Lines end at different times (an AtkSp buff brings the next turn closer),
+        # so every leaf is played on to one common horizon before it is scored,
+        # with the NPC using its hardest hitting action.
+        model = self._default_model
+        while not state.over and state.time < self._horizon:
+            self._check_time()
+            state.act(NPC, model, *model.mean_outcome[0][1:])
+            state.next_attack[NPC] = state.time + state.fill[NPC]
+            self._until_npc_turn(state, self._horizon)
+
+    def _until_npc_turn(self, state: CombatState, limit: float = math.inf) -> None:
+        # Plays the player's attacks, at their mean damage, until the NPC's bar
+        # fills or until limit.
+        player_model = self._player_model
+        while not state.over:
+            self._check_time()
+            if min(state.next_attack) > limit:
+                state.run_effects(limit)
+                return
+            if state.next_attack[PLAYER] <= state.next_attack[NPC]:
+                state.run_effects(state.next_attack[PLAYER])
+                if state.over:
+                    return
+                if player_model is not None:
+                    state.act(PLAYER, player_model, player_model.mean, True)
+                state.next_attack[PLAYER] += state.fill[PLAYER]
+            else:
+                state.run_effects(state.next_attack[NPC])
+                return
+
+    def summary(self) -> str:
+        if not self.decision_times:
+            return "no decisions"
+        ordered = sorted(self.decision_times)
+        p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+        depths = list(self.depths)
+        return (f"{len(ordered)} decisions: p50 {ordered[len(ordered) // 2] * 1000:.2f} ms, "
+                f"p99 {p99 * 1000:.2f} ms, max {ordered[-1] * 1000:.2f} ms, "
+                f"mean depth {sum(depths) / len(depths):.1f}")
+
+
+def _candidates(models: List[ActionModel]) -> List[ActionModel]:
+    """Keep one plain action, the hardest hitting, and every other action."""
+    plain = [m for m in models if m.plain]
+    others = [m for m in models if not m.plain]
+    if plain:
+        others.append(max(plain, key=lambda m: (m.mean, -m.action_id)))
+    return others
+
+
+def _evaluate(state: CombatState) -> float:
+    """NPC's view of a state: winning outright beats any HP lead.
+
+    A lost line still prefers leaving the player with less HP: the model's
+    player always hits for its mean, but the real one may not.
+    """
+    npc_left = state.hp[NPC] / state.max_hp[NPC]
+    player_left = state.hp[PLAYER] / state.max_hp[PLAYER]
+    if state.hp[PLAYER] <= 0:
+        return WIN_VALUE + npc_left
+    if state.hp[NPC] <= 0:
+        return -WIN_VALUE - player_left
+    return npc_left - player_left
+
+
+def compare(
+    toons: Sequence[str],
+    npc_ids: Sequence[int],
+    trials: int,
+    policy: str = "melee",
+    budget: float = DEFAULT_BUDGET,
+    seed: Optional[int] = None,
+) -> Tuple[List[Tuple[str, str, float, float]], SearchPolicy]:
+    """Player win rates (percent) against each NPC, scripted and searching.
+
+    Both NPC policies of a cell replay the same random stream; without a
+    ``seed`` the run draws a fresh one.
+    """
+    if seed is None:
+        seed = matchups.fresh_seed()
+    search = SearchPolicy(budget)
+    rows = []
+    for toon in toons:
+        player_template = rl.Entity(toon, is_player=True)
+        player_template.load_char_data(rl.TOONS_DATA[toon])
+        for npc_id in npc_ids:
+            npc_template = rl.Entity("npc")
+            npc_template.load_npc_data(rl.NPCS_DATA[npc_id])
+            rates = []
+            for opponent_policy in (None, search):
+                random.seed(f"{seed}:{toon}:{npc_id}")
+                wins = 0
+                for _ in range(trials):
+                    result = rl.simulate_fight(
+                        player_template.clone(), npc_template.clone(),
+                        rl.ScriptedPolicy(matchups.POLICIES[policy]),
+                        opponent_policy=opponent_policy,
+                    )
+                    wins += result.player_won
+                rates.append(100.0 * wins / trials if trials else math.nan)
+            rows.append((toon, rl.NPCS_DATA[npc_id].get("Name", str(npc_id)), rates[0], rates[1]))
+    return rows, search
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--toons", default="", help="comma separated names")
+    parser.add_argument("--npcs", default="", help="comma separated npcIDs")
+    parser.add_argument("--policy", default="melee", choices=list(matchups.POLICIES))
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET * 1000)
+    parser.add_argument("--seed", type=int, default=None, help="default: a fresh one, printed")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else matchups.fresh_seed()
+
+    matchups._load_tables()
+    rows, search = compare(
+        matchups._parse_list(args.toons) or list(rl.TOONS_DATA),
+        matchups._parse_list(args.npcs, int) or list(rl.NPCS_DATA),
+        args.trials, args.policy, args.budget_ms / 1000.0, seed,
+    )
+    print(f"{'toon':<12}{'npc':<16}{'vs script':>10}{'vs search':>10}")
+    for toon, npc, scripted, searched in rows:
+        print(f"{toon:<12}{npc:<16}{scripted:>9.1f}%{searched:>9.1f}%")
+    print(search.summary())
+    print(f"seed {seed}")
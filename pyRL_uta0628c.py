@@ -1,11 +1,20 @@
 #edits to saving into leaderboard to include more
 
+import bisect
 import csv
 import os
 import sys
 import time
 import random
-import copy
+import sqlite3
+import hashlib
+import heapq
+import json
+import marshal
+import operator
+import selectors
+import struct
+from collections import deque
 
 # For non-blocking input on POSIX systems
 if os.name == 'posix':
@@ -23,6 +32,14 @@ COLOR_RESET = '\033[0m'
 
 # --- Configuration Constants (formerly config.py) ---
 REFRESH_RATE = 0.1  # seconds per game tick
+EVENT_EPSILON = 1e-9  # overshoot used by the event-driven engine, in seconds
+HUD_FRAME_INTERVAL = 0.1  # seconds between HUD redraws, independent of REFRESH_RATE
+SIM_INTERVAL = REFRESH_RATE  # longest real-time gap between combat steps; events are never late
+KEY_POLL_INTERVAL = 0.005  # keyboard polling period where stdin can't be waited on (Windows)
+FRAME_PROFILING = bool(os.environ.get("PYRL_PROFILE"))  # per-phase frame timers in combat_loop
+FRAME_OVERLAY = True  # while profiling, add a frame-time line to the HUD
+DEADLINE_SLACK = 0.005  # lateness past REFRESH_RATE between steps that counts as a missed deadline
+FRAME_HISTOGRAM_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 100) # bucket upper edges
 ATTRIBUTES = [
     "STA", "STR", "AGI", "DEX", "HIT", "BAL", "WGT", "HEI",
     "INT", "WIL", "FOR", "FOC", "PSY",
@@ -39,11 +56,39 @@ ACTION_KEYS_PLAYER = {
     'd': "Neck Action (Slot 7)", 'c': "Ring Action (Slot 8)"
 }
 MAX_ACTIVE_EFFECTS = 2
+# Per effect type (the name of the action that applies it) cap on simultaneous
+# stacks; types not listed are only bound by MAX_ACTIVE_EFFECTS.
+EFFECT_STACK_LIMITS = {}
 MAX_COMBAT_LOG_ENTRIES = 10
 
 DEFAULT_MELEE_ACTION_ID = 1 # Punch
 DEFAULT_MAGIC_ACTION_ID = 2 # Curse
 
+# Player derived stats as weighted sums of current attributes, plus a constant.
+# Rows of this table are the stat formulas; read column-wise (ATTRIBUTE_STAT_COEFFS)
+# they say which stats an attribute change touches.
+DERIVED_STAT_COEFFS = {
+    "max_hp":     {"STA": 5, "STR": 2, "WIL": 2, "FOR": 1, "FOC": 1, "BLS": 1},
+    "atk_pw":     {"STR": 2, "AGI": 1, "DEX": 1, "BAL": 1},
+    "atk_sp":     {"AGI": 2, "DEX": 1, "WIL": 1, "FOC": 1},
+    "mgc_pw":     {"INT": 2, "MAN": 1, "ARC": 1, "WIL": 1},
+    "block_val":  {"STR": 1, "FOR": 1, "INT": 1, "BAL": 1, "WIL": 1},
+    "dodge_val":  {"FOC": 1, "AGI": 1, "DEX": 1, "BAL": 1, "PSY": 1},
+    "armor_val":  {"STR": 1, "FOR": 1, "STA": 1, "AGI": 1, "BLS": 1},
+    "mgc_rs_val": {"PSY": 1, "BLS": 1, "WIL": 1, "MAN": 1, "FOR": 1},
+    "crits_val":  {"HIT": 3, "ARC": 1, "FOC": 1},
+}
+DERIVED_STAT_BASE = {"max_hp": 50}
+DERIVED_STAT_FLOOR = {"atk_sp": 1, "atk_pw": 0, "mgc_pw": 0, "block_val": 0, "dodge_val": 0,
+                      "armor_val": 0, "mgc_rs_val": 0, "crits_val": 0} # max_hp has none
+DERIVED_STATS = list(DERIVED_STAT_COEFFS)
+ATTRIBUTE_STAT_COEFFS = {}
+for _stat, _coeffs in DERIVED_STAT_COEFFS.items():
+    for _attr, _coeff in _coeffs.items():
+        ATTRIBUTE_STAT_COEFFS.setdefault(_attr, []).append((_stat, _coeff))
+del _stat, _coeffs, _attr, _coeff
+UNCLAMPED_ATTRIBUTES = {"WGT", "HEI"} # every other attribute is floored at 1
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 CSV_FILES = {
@@ -52,10 +97,12 @@ CSV_FILES = {
     "npcs": os.path.join(BASE_DIR, "pyRL_npcs.csv"),
     "items": os.path.join(BASE_DIR, "pyRL_items.csv"),
     "saved": os.path.join(BASE_DIR, "pyRL_saved.csv"),
-    "leaderboard": os.path.join(BASE_DIR, "pyRL_leaderboard.csv")
+    "leaderboard": os.path.join(BASE_DIR, "pyRL_leaderboard.csv"),
+    "saves_db": os.path.join(BASE_DIR, "pyRL_saves.db"),
+    "leaderboard_index": os.path.join(BASE_DIR, "pyRL_leaderboard.db"),
+    "frames": os.path.join(BASE_DIR, "pyRL_frames.csv"),
 }
 
-
 # --- Utility Functions (formerly utils.py) ---
 _old_settings_tty = None # For Unix-like systems
 
@@ -84,46 +131,50 @@ def get_keypress():
         return None
     return None
 
-def load_csv_data(filename, key_column=None):
-    data = []
+def _infer_cell(v_str):
+    # Type guessing for columns without a declared schema.
+    if v_str.isdigit():
+        return int(v_str)
+    if v_str.replace('.', '', 1).isdigit() and v_str.count('.') < 2:
+        return float(v_str)
+    return v_str
+
+def _signed_int(v_str):
+    # Item bonuses are sometimes written as "+-1".
+    return int(v_str.replace('+-', '-'))
+
+def _convert_row(row, schema):
+    processed_row = {}
+    for k, v_str in row.items():
+        v = v_str
+        if isinstance(v_str, str):
+            if v_str == '' or v_str == '-': # Handle empty or placeholder for None
+                v = None
+            else:
+                convert = schema.get(k) if schema else None
+                try:
+                    v = convert(v_str) if convert else _infer_cell(v_str)
+                except ValueError:
+                    raise ValueError(f"bad value {v_str!r} in column {k}") from None
+        processed_row[k] = v
+    return processed_row
+
+def load_csv_data(filename, key_column=None, schema=None):
+    # Reads a CSV into a list of dicts, or a dict keyed on key_column. Cells are
+    # converted with schema (column -> converter) where given, guessed otherwise.
+    # A row with a cell its converter rejects is reported and skipped.
     try:
+        rows = []
         with open(filename, 'r', newline='', encoding='utf-8') as f:
             reader = csv.DictReader(f)
-            if key_column:
-                keyed_data = {}
-                for row in reader:
-                    processed_row = {}
-                    for k, v_str in row.items():
-                        v = v_str # Keep as string initially
-                        if isinstance(v_str, str):
-                            if v_str.isdigit():
-                                v = int(v_str)
-                            elif v_str.replace('.', '', 1).isdigit() and v_str.count('.') < 2:
-                                 v = float(v_str)
-                            elif v_str == '' or v_str == '-': # Handle empty or placeholder for None
-                                v = None
-                            # else, keep as string
-                        processed_row[k] = v
-                    
-                    key_value = processed_row.get(key_column)
-                    if key_value is not None: # Ensure key exists
-                        keyed_data[key_value] = processed_row
-                return keyed_data
-            else: # Return list of dicts
-                for row in reader:
-                    processed_row = {}
-                    for k, v_str in row.items():
-                        v = v_str
-                        if isinstance(v_str, str):
-                            if v_str.isdigit():
-                                v = int(v_str)
-                            elif v_str.replace('.', '', 1).isdigit() and v_str.count('.') < 2:
-                                 v = float(v_str)
-                            elif v_str == '' or v_str == '-':
-                                v = None
-                        processed_row[k] = v
-                    data.append(processed_row)
-                return data
+            for row in reader:
+                try:
+                    rows.append(_convert_row(row, schema))
+                except ValueError as e:
+                    print(f"Warning: {filename} line {reader.line_num}: {e}; row skipped.")
+        if key_column:
+            return {row[key_column]: row for row in rows if row.get(key_column) is not None}
+        return rows
     except FileNotFoundError:
         print(f"Warning: File {filename} not found.")
         # Create empty CSV files if they are essential and missing (like saved/leaderboard)
@@ -141,6 +192,100 @@ def load_csv_data(filename, key_column=None):
         print(f"Error loading {filename}: {e}")
         return {} if key_column else []
 
+# Declared column types of the static content tables; columns not listed here
+# (and the saved/leaderboard files) fall back to guessing. Empty cells and "-"
+# always load as None.
+CSV_SCHEMAS = {
+    "toons": dict(
+        {"Name": str},
+        **{attr: int for attr in ATTRIBUTES},
+        **{f"Slot{i}": int for i in range(1, 9)},
+    ),
+    "actions": {
+        "actionID": int, "Name": str, "DMG": str, "BaseDMG": int,
+        "selfBUFF": str, "selfDEBUFF": str, "DEBUFF": str,
+        "Duration": int, "Timing": str,
+    },
+    "npcs": dict(
+        {"npcID": int, "Name": str, "Level": int, "HP": int, "AtkPw": int,
+         "AtkSp": int, "MgcPw": int, "Block": int, "Dodge": int, "Armor": int,
+         "MgcRs": int, "Crits": int, "XPYield": int,
+         "TextStart": str, "TextDeath": str, "TextWin": str, "Description": str},
+        **{f"Item{i}ID": int for i in range(1, 6)},
+        **{f"act{i}": int for i in range(1, 10)},
+    ),
+    "items": {
+        "ItemID": int, "Slot": int, "Name": str, "Bonus1id": str,
+        "Bonus1add": _signed_int, "Bonus2id": str, "Bonus2add": _signed_int,
+        "ActionID": int, "Action": str, "SkillCheck": str,
+        "SklChkAmount": int, "SklChkOpr": str, "Type": str, "Cooldown": int,
+    },
+}
+TABLE_KEYS = {"toons": "Name", "actions": "actionID", "npcs": "npcID", "items": "ItemID"}
+
+# Parsed tables, reused while the CSVs are unchanged. Bump CACHE_VERSION
+# whenever CSV_SCHEMAS or the row format changes.
+CACHE_FILE = os.path.join(BASE_DIR, "pyRL_data.cache")
+CACHE_VERSION = 1
+
+def _file_stamp(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+def _file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+_table_cache = None # CACHE_FILE contents, read once per process
+
+def _read_table_cache():
+    global _table_cache
+    if _table_cache is None:
+        try:
+            with open(CACHE_FILE, 'rb') as f:
+                _table_cache = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            _table_cache = {}
+        if not isinstance(_table_cache, dict) or _table_cache.get("version") != CACHE_VERSION:
+            _table_cache = {}
+    return _table_cache
+
+def _write_table_cache(cache):
+    # Best effort: a read-only install just parses the CSVs every time.
+    tmp_path = CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(marshal.dumps(cache))
+        os.replace(tmp_path, CACHE_FILE)
+    except (OSError, ValueError):
+        pass
+
+def load_table(name):
+    # Loads one of the static content tables through the compiled cache. A table
+    # is reparsed only when its CSV changed size or mtime and its hash differs.
+    filename = CSV_FILES[name]
+    key_column = TABLE_KEYS[name]
+    try:
+        stamp = _file_stamp(filename)
+    except OSError:
+        return load_csv_data(filename, key_column, CSV_SCHEMAS[name])
+
+    cache = _read_table_cache()
+    entry = cache.get(name)
+    if entry and tuple(entry["stamp"]) == stamp:
+        return entry["rows"]
+    digest = _file_hash(filename)
+    if not entry or entry["hash"] != digest:
+        rows = load_csv_data(filename, key_column, CSV_SCHEMAS[name])
+        if not rows:
+            return rows
+        entry = {"hash": digest, "rows": rows}
+    entry["stamp"] = stamp
+    cache["version"] = CACHE_VERSION
+    cache[name] = entry
+    _write_table_cache(cache)
+    return entry["rows"]
+
 def clear_screen():
     if os.name == 'nt':
         os.system('cls')
@@ -174,6 +319,14 @@ def display_options(options, title="Choose an option:"):
 
 # --- Data Models (formerly data_models.py) ---
 class Item:
+    # Shared, read-only template: one per ItemID in ALL_ITEMS. Entities equip an
+    # ItemState that points here instead of a copy of the whole item.
+    __slots__ = (
+        "id", "slot", "name", "bonus1_id", "bonus1_add", "bonus2_id", "bonus2_add",
+        "action_id", "skill_check_attr", "skill_check_amount", "skill_check_opr",
+        "cooldown_time", "_frozen",
+    )
+
     def __init__(self, data):  # data is a dict from CSV
         self.id = data.get('ItemID')
         self.slot = data.get('Slot')
@@ -200,7 +353,37 @@ class Item:
 
         cd = data.get('Cooldown', 0) or 0
         self.cooldown_time = int(cd)
-        self.current_cooldown = 0  # instance‐specific
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"Item templates are read-only (tried to set {name})")
+        object.__setattr__(self, name, value)
+
+    # Templates are shared, never duplicated.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def instance(self):
+        return ItemState(self)
+
+
+class ItemState:
+    # An equipped or dropped item; every attribute is read from the shared
+    # template. Cooldowns are kept per item id in Entity.item_cooldowns.
+    __slots__ = ("template",)
+
+    def __init__(self, template):
+        self.template = template
+
+# Read-only forwarding properties for every template field.
+for _field in Item.__slots__:
+    if not _field.startswith("_"):
+        setattr(ItemState, _field, property(operator.attrgetter(f"template.{_field}")))
+del _field
 
 
 class Action:
@@ -222,6 +405,55 @@ ALL_ITEMS = {}
 ALL_ACTIONS = {}
 
 # --- Entity Class (formerly entity.py) ---
+class Effect:
+    # One applied buff or debuff. Its expiry is scheduled on the owning entity's
+    # effect clock; HP-over-time effects feed the entity's summed hp_rate.
+    __slots__ = (
+        "name", "effect_type", "stat_mods", "hp_per_second", "hp_on_end",
+        "duration", "expires_at", "is_buff", "timing", "source_action_id",
+    )
+
+    def __init__(self, name, duration=0, stat_mods=None, hp_per_second=0, hp_on_end=0,
+                 is_buff=False, timing=None, source_action_id=None, effect_type=None):
+        self.name = name
+        self.effect_type = effect_type if effect_type is not None else name
+        self.stat_mods = stat_mods or {}
+        self.hp_per_second = hp_per_second
+        self.hp_on_end = hp_on_end
+        self.duration = duration
+        self.expires_at = 0.0
+        self.is_buff = is_buff
+        self.timing = timing
+        self.source_action_id = source_action_id
+
+
+def _floor_attribute(attr, value):
+    if attr in UNCLAMPED_ATTRIBUTES or value >= 1:
+        return value
+    return 1
+
+def _item_attribute_deltas(item_obj, sign):
+    deltas = {}
+    for attr, amount in ((item_obj.bonus1_id, item_obj.bonus1_add), (item_obj.bonus2_id, item_obj.bonus2_add)):
+        if attr and attr in ATTRIBUTES:
+            deltas[attr] = deltas.get(attr, 0) + sign * amount
+    return deltas
+
+def _effect_attribute_deltas(effect, sign):
+    return {stat: sign * val for stat, val in effect.stat_mods.items() if stat in ATTRIBUTES}
+
+def derive_player_stats(attribute_rows):
+    # Batch path: raw derived stats for many entities in one matrix product.
+    # Each row lists current attributes in ATTRIBUTES order; each result row holds
+    # the DERIVED_STATS sums before floors are applied.
+    matrix = [[DERIVED_STAT_COEFFS[stat].get(attr, 0) for attr in ATTRIBUTES] for stat in DERIVED_STATS]
+    base = [DERIVED_STAT_BASE.get(stat, 0) for stat in DERIVED_STATS]
+    return [
+        [b + sum(c * a for c, a in zip(coeffs, row)) for b, coeffs in zip(base, matrix)]
+        for row in attribute_rows
+    ]
+
+
 class Entity:
     def __init__(self, name, is_player=False):
         self.name = name
@@ -230,6 +462,8 @@ class Entity:
         self.equipped_items = {slot: None for slot in range(1, 9)}
         
         self.current_attributes = self.base_attributes.copy()
+        self._raw_attributes = self.base_attributes.copy() # before the floor of 1
+        self._raw_derived = None # DERIVED_STAT_COEFFS sums, set by the first full recalculation
 
         self.max_hp = 0
         self.current_hp = 0
@@ -248,7 +482,13 @@ class Entity:
         self.queued_action_key = 'a' if is_player else None
         self.selected_action_id = None
 
-        self.active_effects = []
+        self.active_effects = [] # Effect records, oldest first
+        self.effect_clock = 0.0 # seconds of effect time this entity has lived through
+        self._effect_heap = [] # (expires_at, sequence, effect)
+        self._effect_sequence = 0
+        self._effect_stacks = {} # effect_type -> active count
+        self._hp_tick_effects = {} # effects with hp_per_second, insertion ordered
+        self.hp_rate = 0.0 # summed hp_per_second of active effects
         self.total_damage_dealt_session = 0
         self.total_damage_taken_session = 0
         self.combat_start_time = 0
@@ -281,12 +521,11 @@ class Entity:
                 if char_data_dict.get('XP') is not None else 0
             )
 
-        # Equip each slot by deep-copying the Item instance
+        # Equip each slot with a state record over the shared Item template
         for i in range(1, 9):
             item_id_val = char_data_dict.get(f'Slot{i}')
             if item_id_val is not None and item_id_val in ALL_ITEMS:
-                # Clone the original Item so all its data comes along
-                self.equipped_items[i] = copy.deepcopy(ALL_ITEMS[item_id_val])
+                self.equipped_items[i] = ALL_ITEMS[item_id_val].instance()
 
         # Recalculate derived stats (with gear bonuses) and HP
         self.update_stats_and_effects()
@@ -318,55 +557,35 @@ class Entity:
 
 
     def _recalculate_current_attributes(self):
-        self.current_attributes = self.base_attributes.copy()
+        # Raw totals keep the unfloored sums so later deltas stay exact.
+        raw = self.base_attributes.copy()
         for slot, item_obj in self.equipped_items.items():
             if item_obj:
-                if item_obj.bonus1_id and item_obj.bonus1_id in ATTRIBUTES:
-                    self.current_attributes[item_obj.bonus1_id] = \
-                        self.current_attributes.get(item_obj.bonus1_id, 0) + item_obj.bonus1_add
-                if item_obj.bonus2_id and item_obj.bonus2_id in ATTRIBUTES:
-                    self.current_attributes[item_obj.bonus2_id] = \
-                        self.current_attributes.get(item_obj.bonus2_id, 0) + item_obj.bonus2_add
+                for attr, delta in _item_attribute_deltas(item_obj, 1).items():
+                    raw[attr] = raw.get(attr, 0) + delta
         
         for effect in self.active_effects:
-            if "stat_mods" in effect.get("mods", {}):
-                for stat, val in effect["mods"]["stat_mods"].items():
-                    if stat in ATTRIBUTES:
-                        self.current_attributes[stat] = self.current_attributes.get(stat, 0) + val
+            for attr, delta in _effect_attribute_deltas(effect, 1).items():
+                raw[attr] = raw.get(attr, 0) + delta
         
-        for attr in ATTRIBUTES:
-            if attr not in ["WGT", "HEI"] and self.current_attributes.get(attr,0) < 1 :
-                 self.current_attributes[attr] = 1
+        self._raw_attributes = raw
+        self.current_attributes = {attr: _floor_attribute(attr, value) for attr, value in raw.items()}
 
 
     def _calculate_derived_stats_player(self):
         attrs = self.current_attributes
-        prev_max_hp = self.max_hp
+        self._raw_derived = {
+            stat: DERIVED_STAT_BASE.get(stat, 0) + sum(coeff * attrs.get(attr, 0) for attr, coeff in coeffs.items())
+            for stat, coeffs in DERIVED_STAT_COEFFS.items()
+        }
+        self._publish_derived_stats(DERIVED_STATS)
 
-        self.max_hp = (50 +
-                       (5 * attrs.get("STA", 0)) + (2 * attrs.get("STR", 0)) +
-                       (2 * attrs.get("WIL", 0)) + attrs.get("FOR", 0) +
-                       attrs.get("FOC", 0) + attrs.get("BLS", 0))
-        
-        self.atk_pw = (attrs.get("STR",0) * 2 + attrs.get("AGI",0) + 
-                       attrs.get("DEX",0) + attrs.get("BAL",0))
-        self.atk_sp = max(1, (attrs.get("AGI",0) * 2 + attrs.get("DEX",0) + 
-                              attrs.get("WIL",0) + attrs.get("FOC",0)))
-        self.mgc_pw = (attrs.get("INT",0) * 2 + attrs.get("MAN",0) + 
-                       attrs.get("ARC",0) + attrs.get("WIL",0))
-        self.block_val = (attrs.get("STR",0) + attrs.get("FOR",0) + attrs.get("INT",0) + 
-                          attrs.get("BAL",0) + attrs.get("WIL",0))
-        self.dodge_val = (attrs.get("FOC",0) + attrs.get("AGI",0) + attrs.get("DEX",0) + 
-                          attrs.get("BAL",0) + attrs.get("PSY",0))
-        self.armor_val = (attrs.get("STR",0) + attrs.get("FOR",0) + attrs.get("STA",0) + 
-                          attrs.get("AGI",0) + attrs.get("BLS",0))
-        self.mgc_rs_val = (attrs.get("PSY",0) + attrs.get("BLS",0) + attrs.get("WIL",0) + 
-                           attrs.get("MAN",0) + attrs.get("FOR",0))
-        self.crits_val = (attrs.get("HIT",0) * 3 + attrs.get("ARC",0) + attrs.get("FOC",0))
-
-        for stat_name in ['atk_pw', 'mgc_pw', 'block_val', 'dodge_val', 'armor_val', 'mgc_rs_val', 'crits_val']:
-            setattr(self, stat_name, max(0, getattr(self, stat_name)))
-        self.atk_sp = max(1, self.atk_sp)
+    def _publish_derived_stats(self, stats):
+        prev_max_hp = self.max_hp
+        for stat in stats:
+            value = self._raw_derived[stat]
+            floor = DERIVED_STAT_FLOOR.get(stat)
+            setattr(self, stat, value if floor is None else max(floor, value))
 
         self.attack_fill_time = 1.2 + (5.0 - 1.2) * (1 - self.atk_sp / 100.0)
         self.attack_fill_time = max(REFRESH_RATE, self.attack_fill_time)
@@ -376,6 +595,52 @@ class Entity:
             self.current_hp += hp_diff if hp_diff > 0 else 0 # only add if max_hp increased
         self.current_hp = min(self.current_hp, self.max_hp)
 
+    def shift_attributes(self, deltas):
+        # Incremental update for a player: deltas maps attribute -> change of its raw
+        # total. Only stats that read a changed attribute are recomputed.
+        if not self.is_player or self._raw_derived is None:
+            self.update_stats_and_effects()
+            return
+        raw, current, derived = self._raw_attributes, self.current_attributes, self._raw_derived
+        changed = set()
+        for attr, delta in deltas.items():
+            if not delta or attr not in current:
+                continue
+            raw[attr] += delta
+            value = _floor_attribute(attr, raw[attr])
+            diff = value - current[attr]
+            if diff:
+                current[attr] = value
+                for stat, coeff in ATTRIBUTE_STAT_COEFFS.get(attr, ()):
+                    derived[stat] += coeff * diff
+                    changed.add(stat)
+        if changed:
+            self._publish_derived_stats(changed)
+
+    def _effect_changed(self, effect, sign):
+        # sign is +1 when effect was just added, -1 when it was just removed.
+        if self.is_player:
+            self.shift_attributes(_effect_attribute_deltas(effect, sign))
+        else:
+            self.update_stats_and_effects()
+
+    def clone(self):
+        # Independent copy of everything combat mutates; items and source data are shared.
+        other = Entity.__new__(Entity)
+        other.__dict__.update(self.__dict__)
+        other.equipped_items = dict(self.equipped_items)
+        other.current_attributes = dict(self.current_attributes)
+        other._raw_attributes = dict(self._raw_attributes)
+        if self._raw_derived is not None:
+            other._raw_derived = dict(self._raw_derived)
+        # Effect records are never mutated once applied, so they can be shared.
+        other.active_effects = list(self.active_effects)
+        other._effect_heap = list(self._effect_heap)
+        other._effect_stacks = dict(self._effect_stacks)
+        other._hp_tick_effects = dict(self._hp_tick_effects)
+        other.item_cooldowns = dict(self.item_cooldowns)
+        return other
+
 
     def update_stats_and_effects(self):
         if self.is_player:
@@ -385,8 +650,7 @@ class Entity:
             original_atk_sp = self.npc_data_source.get('AtkSp', 20) if self.npc_data_source else 20
             current_modified_atk_sp = original_atk_sp
             for effect in self.active_effects:
-                if "stat_mods" in effect.get("mods", {}):
-                    current_modified_atk_sp += effect["mods"]["stat_mods"].get("AtkSp", 0) # Example: Only AtkSp for now
+                current_modified_atk_sp += effect.stat_mods.get("AtkSp", 0) # Example: Only AtkSp for now
             self.atk_sp = max(1, current_modified_atk_sp)
             self.attack_fill_time = 1.2 + (5.0 - 1.2) * (1 - self.atk_sp / 100.0)
             self.attack_fill_time = max(REFRESH_RATE, self.attack_fill_time)
@@ -418,26 +682,36 @@ class Entity:
         return False
 
     def equip_item(self, new_item_obj, slot_to_equip):
+        old_item_obj = self.equipped_items.get(slot_to_equip)
         self.equipped_items[slot_to_equip] = new_item_obj
         if new_item_obj and new_item_obj.slot in [7,8] and new_item_obj.cooldown_time > 0:
             self.item_cooldowns[new_item_obj.id] = 0 # Initialize/reset cooldown tracking
-        self.update_stats_and_effects()
+        deltas = _item_attribute_deltas(new_item_obj, 1) if new_item_obj else {}
+        if old_item_obj:
+            for attr, delta in _item_attribute_deltas(old_item_obj, -1).items():
+                deltas[attr] = deltas.get(attr, 0) + delta
+        self.shift_attributes(deltas)
 
     def apply_effect(self, action_obj, source_entity_is_self): # True if source is applying to self
         applies_to_self = (action_obj.self_buff_target_stat or action_obj.self_debuff_target_stat) and source_entity_is_self
         applies_as_enemy_debuff = action_obj.enemy_debuff_target_stat and not source_entity_is_self
 
+        # Returns the log events for what happened, as (code, args) pairs.
         if not (applies_to_self or applies_as_enemy_debuff):
-            return "" 
+            return []
 
         if len(self.active_effects) >= MAX_ACTIVE_EFFECTS:
-            return f"{self.name} resisted {action_obj.name} (max effects)."
+            return [(LOG_RESISTED, (self.name, action_obj.name, "max effects"))]
+        stack_limit = EFFECT_STACK_LIMITS.get(action_obj.name)
+        if stack_limit is not None and self._effect_stacks.get(action_obj.name, 0) >= stack_limit:
+            return [(LOG_RESISTED, (self.name, action_obj.name, "max stacks"))]
 
         effect_name = action_obj.name
         effect_duration = action_obj.duration
         effect_mods = {"stat_mods": {}, "hp_change_tick": 0, "hp_change_on_end": 0}
         is_buff = False
-        log_msg_part = ""
+        events = []
+        hp_changed = False
 
         if source_entity_is_self:
             if action_obj.self_buff_target_stat:
@@ -449,11 +723,11 @@ class Entity:
                         heal_amount = min(action_obj.base_val, self.max_hp - self.current_hp)
                         self.current_hp += heal_amount
                         if heal_amount > 0:
-                            inst_heal_color = COLOR_GREEN if self.is_player else COLOR_RED
-                            log_msg_part += f"{self.name} heals {inst_heal_color}{heal_amount:.0f}{COLOR_RESET} HP. "
+                            events.append((LOG_HEAL, (self.name, heal_amount, self.is_player)))
+                            hp_changed = True
                 elif action_obj.self_buff_target_stat in ATTRIBUTES + ["AtkPw", "MgcPw", "AtkSp", "Block", "Dodge", "Armor", "MgcRs", "Crits"]: 
                     effect_mods["stat_mods"][action_obj.self_buff_target_stat] = action_obj.base_val
-                    log_msg_part += f"{self.name}'s {action_obj.self_buff_target_stat} increases. "
+                    events.append((LOG_STAT_UP, (self.name, action_obj.self_buff_target_stat)))
             
             if action_obj.self_debuff_target_stat:
                 is_buff = False 
@@ -464,11 +738,11 @@ class Entity:
                         damage_amount = min(action_obj.base_val, self.current_hp)
                         self.current_hp -= damage_amount
                         if damage_amount > 0:
-                            inst_dmg_color = COLOR_RED if self.is_player else COLOR_GREEN
-                            log_msg_part += f"{self.name} takes {inst_dmg_color}{damage_amount:.0f}{COLOR_RESET} self-damage. "
+                            events.append((LOG_SELF_DAMAGE, (self.name, damage_amount, not self.is_player)))
+                            hp_changed = True
                 elif action_obj.self_debuff_target_stat in ATTRIBUTES + ["AtkPw", "MgcPw", "AtkSp", "Block", "Dodge", "Armor", "MgcRs", "Crits"]:
                     effect_mods["stat_mods"][action_obj.self_debuff_target_stat] = -action_obj.base_val
-                    log_msg_part += f"{self.name}'s {action_obj.self_debuff_target_stat} decreases. "
+                    events.append((LOG_STAT_DOWN, (self.name, action_obj.self_debuff_target_stat)))
 
         if not source_entity_is_self and action_obj.enemy_debuff_target_stat:
             is_buff = False
@@ -477,75 +751,105 @@ class Entity:
                 elif action_obj.timing == 'end': effect_mods["hp_change_on_end"] = -action_obj.base_val
             elif action_obj.enemy_debuff_target_stat in ATTRIBUTES + ["AtkPw", "MgcPw", "AtkSp", "Block", "Dodge", "Armor", "MgcRs", "Crits"]:
                  effect_mods["stat_mods"][action_obj.enemy_debuff_target_stat] = -action_obj.base_val
-                 log_msg_part += f"{self.name}'s {action_obj.enemy_debuff_target_stat} decreases. "
+                 events.append((LOG_STAT_DOWN, (self.name, action_obj.enemy_debuff_target_stat)))
 
         if effect_mods["stat_mods"] or effect_mods["hp_change_tick"] != 0 or effect_mods["hp_change_on_end"] != 0:
-            self.active_effects.append({
-                "name": effect_name, "mods": effect_mods, "duration_left": effect_duration,
-                "is_buff": is_buff, "timing": action_obj.timing, "source_action_id": action_obj.id
-            })
-            self.update_stats_and_effects()
-            # Add "effect applied" message only if there wasn't already an instant HP change message
-            if not ("heals" in log_msg_part or "takes" in log_msg_part and ("HP" in log_msg_part or "self-damage" in log_msg_part)):
-                 return f"{log_msg_part}{action_obj.name} effect applied to {self.name}."
-            return log_msg_part.strip() # Return only the HP change message if it happened
-        elif log_msg_part:
-            return log_msg_part.strip()
-        return ""
+            self.add_effect(Effect(
+                effect_name, effect_duration, stat_mods=effect_mods["stat_mods"],
+                hp_per_second=effect_mods["hp_change_tick"], hp_on_end=effect_mods["hp_change_on_end"],
+                is_buff=is_buff, timing=action_obj.timing, source_action_id=action_obj.id,
+            ))
+            # Add "effect applied" only if there wasn't already an instant HP change
+            if not hp_changed:
+                events.append((LOG_EFFECT_APPLIED, (action_obj.name, self.name)))
+        return events
+
+
+    def add_effect(self, effect):
+        effect.expires_at = self.effect_clock + effect.duration
+        self._effect_sequence += 1
+        heapq.heappush(self._effect_heap, (effect.expires_at, self._effect_sequence, effect))
+        self.active_effects.append(effect)
+        self._effect_stacks[effect.effect_type] = self._effect_stacks.get(effect.effect_type, 0) + 1
+        if effect.hp_per_second:
+            self._hp_tick_effects[effect] = None
+            self.hp_rate += effect.hp_per_second
+        self._effect_changed(effect, 1)
+
+    def _remove_effect(self, effect):
+        self.active_effects.remove(effect)
+        self._effect_stacks[effect.effect_type] -= 1
+        if not self._effect_stacks[effect.effect_type]:
+            del self._effect_stacks[effect.effect_type]
+        if effect.hp_per_second:
+            del self._hp_tick_effects[effect]
+            # Re-sum instead of subtracting so float residue can't keep a rate alive.
+            self.hp_rate = sum(e.hp_per_second for e in self._hp_tick_effects)
+        self._effect_changed(effect, -1)
+
+    def clear_effects(self):
+        self.active_effects = []
+        self._effect_heap = []
+        self._effect_stacks = {}
+        self._hp_tick_effects = {}
+        self.hp_rate = 0.0
 
+    def effect_time_left(self, effect):
+        return max(0.0, effect.expires_at - self.effect_clock)
+
+    def time_to_next_expiry(self):
+        if not self._effect_heap:
+            return None
+        return max(0.0, self._effect_heap[0][0] - self.effect_clock)
+
+    def _hp_tick_source(self):
+        if len(self._hp_tick_effects) == 1:
+            return next(iter(self._hp_tick_effects)).name
+        return f"{len(self._hp_tick_effects)} effects"
 
     def update_active_effects(self, refresh_interval):
+        # Costs O(1) plus O(log n) per effect that expires: HP-over-time effects are
+        # applied through their summed rate and expiries come off a min-heap.
+        # Returns log events as (code, args) pairs.
         log_updates = []
-        removed_effect_this_tick = False
-        for i in range(len(self.active_effects) - 1, -1, -1):
-            effect = self.active_effects[i]
-            effect["duration_left"] -= refresh_interval
-
-            if effect["mods"].get("hp_change_tick", 0) != 0:
-                hp_change_per_second = effect["mods"]["hp_change_tick"]
-                hp_change_this_tick = hp_change_per_second * refresh_interval
-                
-                actual_hp_change = 0
-                if hp_change_this_tick > 0: 
-                    actual_hp_change = min(hp_change_this_tick, self.max_hp - self.current_hp)
-                    self.current_hp += actual_hp_change
-                    if actual_hp_change > 0.01 : 
-                        heal_color = COLOR_GREEN if self.is_player else COLOR_RED
-                        log_updates.append(f"{self.name} heals {heal_color}{actual_hp_change:.1f}{COLOR_RESET} HP from {effect['name']}.")
-                else: 
-                    actual_hp_change = min(abs(hp_change_this_tick), self.current_hp)
-                    self.current_hp -= actual_hp_change
-                    if actual_hp_change > 0: self.total_damage_taken_session += actual_hp_change 
-                    if actual_hp_change > 0.01 : 
-                        dmg_color = COLOR_RED if self.is_player else COLOR_GREEN
-                        log_updates.append(f"{self.name} takes {dmg_color}{actual_hp_change:.1f}{COLOR_RESET} damage from {effect['name']}.")
+        self.effect_clock += refresh_interval
+
+        if self.hp_rate:
+            hp_change_this_tick = self.hp_rate * refresh_interval
+            if hp_change_this_tick > 0: 
+                actual_hp_change = min(hp_change_this_tick, self.max_hp - self.current_hp)
+                self.current_hp += actual_hp_change
+                if actual_hp_change > 0.01 : 
+                    log_updates.append((LOG_TICK_HEAL, (self.name, actual_hp_change, self._hp_tick_source(), self.is_player)))
+            else: 
+                actual_hp_change = min(abs(hp_change_this_tick), self.current_hp)
+                self.current_hp -= actual_hp_change
+                if actual_hp_change > 0: self.total_damage_taken_session += actual_hp_change 
+                if actual_hp_change > 0.01 : 
+                    log_updates.append((LOG_TICK_DAMAGE, (self.name, actual_hp_change, self._hp_tick_source(), not self.is_player)))
+            self.current_hp = max(0, min(self.max_hp, self.current_hp))
+
+        heap = self._effect_heap
+        while heap and heap[0][0] <= self.effect_clock + EVENT_EPSILON:
+            effect = heapq.heappop(heap)[2]
+            if effect.timing == 'end' and effect.hp_on_end != 0:
+                hp_change = effect.hp_on_end
+                if hp_change > 0:
+                     heal_amount = min(hp_change, self.max_hp - self.current_hp)
+                     self.current_hp += heal_amount
+                     if heal_amount > 0:
+                         log_updates.append((LOG_END_HEAL, (self.name, heal_amount, effect.name, self.is_player)))
+                else:
+                     damage_amount = min(abs(hp_change), self.current_hp)
+                     self.current_hp -= damage_amount
+                     if damage_amount > 0: self.total_damage_taken_session += damage_amount
+                     if damage_amount > 0:
+                         log_updates.append((LOG_END_DAMAGE, (self.name, damage_amount, effect.name, not self.is_player)))
                 self.current_hp = max(0, min(self.max_hp, self.current_hp))
 
-
-            if effect["duration_left"] <= 0:
-                if effect["timing"] == 'end' and effect["mods"].get("hp_change_on_end", 0) != 0:
-                    hp_change = effect["mods"]["hp_change_on_end"]
-                    if hp_change > 0:
-                         heal_amount = min(hp_change, self.max_hp - self.current_hp)
-                         self.current_hp += heal_amount
-                         if heal_amount > 0:
-                             heal_color_end = COLOR_GREEN if self.is_player else COLOR_RED
-                             log_updates.append(f"{self.name} heals {heal_color_end}{heal_amount:.0f}{COLOR_RESET} HP as {effect['name']} ends.")
-                    else:
-                         damage_amount = min(abs(hp_change), self.current_hp)
-                         self.current_hp -= damage_amount
-                         if damage_amount > 0: self.total_damage_taken_session += damage_amount
-                         if damage_amount > 0:
-                             dmg_color_end = COLOR_RED if self.is_player else COLOR_GREEN
-                             log_updates.append(f"{self.name} takes {dmg_color_end}{damage_amount:.0f}{COLOR_RESET} damage as {effect['name']} ends.")
-                    self.current_hp = max(0, min(self.max_hp, self.current_hp))
-
-                log_updates.append(f"{effect['name']} wore off from {self.name}.")
-                self.active_effects.pop(i)
-                removed_effect_this_tick = True
+            log_updates.append((LOG_WORE_OFF, (effect.name, self.name)))
+            self._remove_effect(effect)
         
-        if removed_effect_this_tick:
-            self.update_stats_and_effects()
         return log_updates
 
     def tick_item_cooldowns(self, refresh_interval):
@@ -559,27 +863,222 @@ class Entity:
 TOONS_DATA = {}
 NPCS_DATA = {}
 SAVED_CHARS_DATA = [] 
-COMBAT_LOG = []
 source_was_default_and_we_want_to_save = True # Default, will be updated
 
+# --- Combat Log ---
+# Log entries are (time, code, args) tuples. Nothing is formatted when an entry
+# is logged: LOG_FORMATS turns one into text when the HUD or the end-of-fight
+# summary shows it. Entities return events as (code, args) pairs.
+(LOG_TEXT, LOG_COMBAT_START, LOG_QUEUE, LOG_FORFEIT, LOG_FIZZLE, LOG_CONFUSED,
+ LOG_UNKNOWN_ACTION, LOG_USES, LOG_DODGE, LOG_HIT, LOG_NO_DAMAGE, LOG_COOLDOWN,
+ LOG_RESISTED, LOG_HEAL, LOG_SELF_DAMAGE, LOG_STAT_UP, LOG_STAT_DOWN,
+ LOG_EFFECT_APPLIED, LOG_TICK_HEAL, LOG_TICK_DAMAGE, LOG_END_HEAL, LOG_END_DAMAGE,
+ LOG_WORE_OFF) = range(23)
+
+# code -> (template, index of the arg that picks the amount's color or None).
+# A true color arg prints green, a false one red and None leaves it uncolored.
+LOG_FORMATS = {
+    LOG_TEXT: ("{0}", None),
+    LOG_COMBAT_START: ("Combat starts: {0} vs {1}!", None),
+    LOG_QUEUE: ("Player queues {0} ({1}).", None),
+    LOG_FORFEIT: ("Player forfeits.", None),
+    LOG_FIZZLE: ("Player's action ({0}) fizzles (unavailable/cooldown).", None),
+    LOG_CONFUSED: ("{0} confused (invalid action ID: {1} from {2}).", None),
+    LOG_UNKNOWN_ACTION: ("{0} tries to use unknown action ID {1}!", None),
+    LOG_USES: ("{0} uses {1} on {2}!", None),
+    LOG_DODGE: ("{0} dodges {1}!", None),
+    # attacker, action, target, crit, raw damage, mitigation %, damage, attacker is player
+    LOG_HIT: ("{0} uses {1} on {2}!{crit} ({4}/{5:.1f}%/{color}{6}{reset})", 7),
+    LOG_NO_DAMAGE: ("{0} uses {1} on {2}!{crit} but deals no damage.", None),
+    LOG_COOLDOWN: ("{0} is now on cooldown ({1}s).", None),
+    LOG_RESISTED: ("{0} resisted {1} ({2}).", None),
+    LOG_HEAL: ("{0} heals {color}{1:.0f}{reset} HP.", 2),
+    LOG_SELF_DAMAGE: ("{0} takes {color}{1:.0f}{reset} self-damage.", 2),
+    LOG_STAT_UP: ("{0}'s {1} increases.", None),
+    LOG_STAT_DOWN: ("{0}'s {1} decreases.", None),
+    LOG_EFFECT_APPLIED: ("{0} effect applied to {1}.", None),
+    LOG_TICK_HEAL: ("{0} heals {color}{1:.1f}{reset} HP from {2}.", 3),
+    LOG_TICK_DAMAGE: ("{0} takes {color}{1:.1f}{reset} damage from {2}.", 3),
+    LOG_END_HEAL: ("{0} heals {color}{1:.0f}{reset} HP as {2} ends.", 3),
+    LOG_END_DAMAGE: ("{0} takes {color}{1:.0f}{reset} damage as {2} ends.", 3),
+    LOG_WORE_OFF: ("{0} wore off from {1}.", None),
+}
+
+def format_log_entry(entry, colored=True):
+    # colored=False leaves out the ANSI colour codes, e.g. for network clients.
+    timestamp, code, args = entry
+    template, color_arg = LOG_FORMATS[code]
+    color = reset = ""
+    if colored and color_arg is not None and args[color_arg] is not None:
+        color = COLOR_GREEN if args[color_arg] else COLOR_RED
+        reset = COLOR_RESET
+    # Only LOG_HIT and LOG_NO_DAMAGE use {crit}; their fourth arg is the crit flag.
+    crit = " (Critical Hit!)" if code in (LOG_HIT, LOG_NO_DAMAGE) and args[3] else ""
+    clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+    return f"[{clock}] " + template.format(*args, color=color, reset=reset, crit=crit)
+
+
+# Capture files: a header, then one record per entry. A record is the code
+# (uint8), the time (float64) and the arg count (uint8), then each arg as a
+# tag byte and its value. Strings are stored once: the first use emits a
+# LOG_STRING_DEF record with the UTF-8 text and later uses refer to its index.
+CAPTURE_MAGIC = b"pyRLlog1"
+LOG_STRING_DEF = 255
+_RECORD = struct.Struct("<BdB")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_STRING_REF = struct.Struct("<I")
+_STRING_LEN = struct.Struct("<H")
+
+
+class CombatLog:
+    # Keeps the last `capacity` entries in a ring; older ones fall off for free.
+    def __init__(self, capacity=MAX_COMBAT_LOG_ENTRIES):
+        self.entries = deque(maxlen=capacity)
+        self.capture_file = None
+        self._capture_strings = {}
+
+    def add(self, code, *args):
+        entry = (time.time(), code, args)
+        self.entries.append(entry)
+        if self.capture_file is not None:
+            self._write_record(entry)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def lines(self, n=None):
+        entries = list(self.entries)
+        if n is not None:
+            entries = entries[-n:]
+        return [format_log_entry(entry) for entry in entries]
+
+    # Capture
+
+    def start_capture(self, path):
+        # Streams every entry from now on to path, appending to an earlier capture.
+        self.stop_capture()
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        if not new_file:
+            # Strings defined earlier in the file are already indexed by readers.
+            self._capture_strings = {text: i for i, text in enumerate(_capture_string_table(path))}
+        self.capture_file = open(path, 'ab')
+        if new_file:
+            self.capture_file.write(CAPTURE_MAGIC)
+
+    def stop_capture(self):
+        if self.capture_file is not None:
+            self.capture_file.close()
+            self.capture_file = None
+            self._capture_strings = {}
+
+    def _string_ref(self, text, out):
+        index = self._capture_strings.get(text)
+        if index is None:
+            index = self._capture_strings[text] = len(self._capture_strings)
+            data = text.encode('utf-8')
+            out += _RECORD.pack(LOG_STRING_DEF, 0.0, 0) + _STRING_LEN.pack(len(data)) + data
+        return index
+
+    def _write_record(self, entry):
+        timestamp, code, args = entry
+        out = bytearray()
+        payload = bytearray()
+        for arg in args:
+            if isinstance(arg, (bool, int)):
+                payload += b'i' + _INT.pack(arg)
+            elif isinstance(arg, float):
+                payload += b'f' + _FLOAT.pack(arg)
+            elif arg is None:
+                payload += b'n'
+            else:
+                payload += b's' + _STRING_REF.pack(self._string_ref(str(arg), out))
+        out += _RECORD.pack(code, timestamp, len(args)) + payload
+        self.capture_file.write(out)
+
+
+def _read_capture_records(path):
+    # Yields (time, code, args) for every record, string definitions included.
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not a combat log capture")
+    strings = []
+    pos = len(CAPTURE_MAGIC)
+    while pos < len(data):
+        code, timestamp, count = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if code == LOG_STRING_DEF:
+            (length,) = _STRING_LEN.unpack_from(data, pos)
+            pos += _STRING_LEN.size
+            strings.append(data[pos:pos + length].decode('utf-8'))
+            pos += length
+            yield timestamp, code, (strings[-1],)
+            continue
+        args = []
+        for _ in range(count):
+            tag = data[pos:pos + 1]
+            pos += 1
+            if tag == b'i':
+                args.append(_INT.unpack_from(data, pos)[0])
+                pos += _INT.size
+            elif tag == b'f':
+                args.append(_FLOAT.unpack_from(data, pos)[0])
+                pos += _FLOAT.size
+            elif tag == b'n':
+                args.append(None)
+            else:
+                args.append(strings[_STRING_REF.unpack_from(data, pos)[0]])
+                pos += _STRING_REF.size
+        yield timestamp, code, tuple(args)
+
+def _capture_string_table(path):
+    return [args[0] for _, code, args in _read_capture_records(path) if code == LOG_STRING_DEF]
+
+def read_combat_capture(path):
+    # The captured entries in order, in the same form as CombatLog entries.
+    return [record for record in _read_capture_records(path) if record[1] != LOG_STRING_DEF]
+
+
+COMBAT_LOG = CombatLog()
+
+def use_combat_log(log):
+    # Points the combat functions at another log, e.g. one per concurrent fight;
+    # returns the log that was in use.
+    global COMBAT_LOG
+    previous, COMBAT_LOG = COMBAT_LOG, log
+    return previous
+
 # --- Game Logic Functions (formerly game.py) ---
 def add_to_combat_log(message):
     if message:
-        COMBAT_LOG.append(f"[{time.strftime('%H:%M:%S')}] {message}")
-        if len(COMBAT_LOG) > MAX_COMBAT_LOG_ENTRIES:
-            COMBAT_LOG.pop(0)
+        COMBAT_LOG.add(LOG_TEXT, message)
 
-def initialize_game_data():
-    global TOONS_DATA, NPCS_DATA, SAVED_CHARS_DATA, ALL_ITEMS, ALL_ACTIONS
-    
-    raw_items = load_csv_data(CSV_FILES["items"], key_column='ItemID')
+def log_events(events):
+    for code, args in events:
+        COMBAT_LOG.add(code, *args)
+
+def load_item_and_action_tables():
+    # Fills ALL_ITEMS and ALL_ACTIONS only; headless tools need nothing else.
+    raw_items = load_table("items")
     for item_id, item_data in raw_items.items():
         ALL_ITEMS[item_id] = Item(item_data)
 
-    raw_actions = load_csv_data(CSV_FILES["actions"], key_column='actionID')
+    raw_actions = load_table("actions")
     for action_id, action_data in raw_actions.items():
         ALL_ACTIONS[action_id] = Action(action_data)
 
+def initialize_game_data():
+    global TOONS_DATA, NPCS_DATA, SAVED_CHARS_DATA, ALL_ITEMS, ALL_ACTIONS
+    
+    load_item_and_action_tables()
+
     essential_data_loaded_successfully = True
     error_messages = []
 
@@ -590,12 +1089,12 @@ def initialize_game_data():
         error_messages.append("FATAL ERROR: Essential action data (pyRL_actions.csv) not found or is empty.")
         essential_data_loaded_successfully = False
 
-    TOONS_DATA = load_csv_data(CSV_FILES["toons"], key_column='Name')
+    TOONS_DATA = load_table("toons")
     if not TOONS_DATA:
         error_messages.append("FATAL ERROR: Essential character template data (pyRL_toons.csv) not found or is empty.")
         essential_data_loaded_successfully = False
 
-    NPCS_DATA = load_csv_data(CSV_FILES["npcs"], key_column='npcID') 
+    NPCS_DATA = load_table("npcs")
     if not NPCS_DATA:
         error_messages.append("FATAL ERROR: Essential NPC data (pyRL_npcs.csv) not found or is empty.")
         essential_data_loaded_successfully = False
@@ -611,11 +1110,19 @@ def initialize_game_data():
             _restore_tty_settings_non_blocking()
         sys.exit(1) 
         
-    raw_saved_chars = load_csv_data(CSV_FILES["saved"]) 
-    SAVED_CHARS_DATA = [char_row for char_row in raw_saved_chars if char_row]
+    SAVED_CHARS_DATA = load_saved_characters()
+
+
+def load_saved_characters():
+    try:
+        return get_save_store().all()
+    except sqlite3.Error as e:
+        print(f"Error loading saved characters: {e}")
+        return []
 
 
 def select_character():
+    global SAVED_CHARS_DATA
     clear_screen()
     print("Choose character source:")
     if os.name == 'posix': _restore_tty_settings_non_blocking()
@@ -642,6 +1149,7 @@ def select_character():
         selected_char_data = TOONS_DATA[char_names[chosen_idx]]
         player_name_for_entity = char_names[chosen_idx]
     else: 
+        SAVED_CHARS_DATA = load_saved_characters()
         if not SAVED_CHARS_DATA:
             print("No saved characters found!")
             return None, False
@@ -704,10 +1212,56 @@ def select_opponent():
     npc.load_npc_data(npc_data_to_load)
     return npc
 
-def display_hud(player, opponent):
-    sys.stdout.write('\033[H')
-    sys.stdout.flush()
-    
+class ScreenRenderer:
+    # Double-buffered HUD output: keeps the last frame and rewrites only the
+    # changed tail of each changed line, all in a single write per frame.
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.previous = []
+        self.frames = 0
+        self.bytes_written = 0
+
+    def invalidate(self):
+        # Forget the last frame, e.g. after the screen was cleared.
+        self.previous = []
+
+    @staticmethod
+    def _unchanged_columns(old, new):
+        # Length of the common prefix, stopping at the first escape sequence
+        # so the cursor column always matches the string index.
+        limit = min(len(old), len(new))
+        col = 0
+        while col < limit and old[col] == new[col] and new[col] != '\033':
+            col += 1
+        return col
+
+    def render(self, lines):
+        out = []
+        previous = self.previous
+        for row, line in enumerate(lines):
+            old = previous[row] if row < len(previous) else None
+            if line == old:
+                continue
+            col = self._unchanged_columns(old, line) if old is not None else 0
+            out.append(f"\033[{row + 1};{col + 1}H{line[col:]}\033[K")
+        for row in range(len(lines), len(previous)):
+            out.append(f"\033[{row + 1};1H\033[K")
+        self.previous = list(lines)
+        self.frames += 1
+        if out:
+            data = "".join(out)
+            self.stream.write(data)
+            self.stream.flush()
+            self.bytes_written += len(data.encode('utf-8'))
+        return len(out)
+
+    def move_below(self):
+        # Park the cursor under the frame so normal printing can continue.
+        self.stream.write(f"\033[{len(self.previous) + 1};1H")
+        self.stream.flush()
+
+
+def compose_hud(player, opponent):
     p_bar_fill = int(player.attack_bar_progress / 100 * 20)
     p_bar = f"[{'■' * p_bar_fill}{' ' * (20 - p_bar_fill)}] {player.attack_bar_progress:.0f}%"
     p_action_id = player.get_action_for_key(player.queued_action_key)
@@ -717,15 +1271,17 @@ def display_hud(player, opponent):
     elif p_action_id: 
         p_action_name = f"Unknown Action ({p_action_id})"
 
-    print(f"[{player.name}] HP: {player.current_hp:.0f}/{player.max_hp:.0f}   ATK BAR: {p_bar}")
-    print(f"Queued: {ACTION_KEYS_PLAYER.get(player.queued_action_key, 'Unknown')} ({p_action_name})")
+    lines = []
+    lines.append(f"[{player.name}] HP: {player.current_hp:.0f}/{player.max_hp:.0f}   ATK BAR: {p_bar}")
+    lines.append(f"Queued: {ACTION_KEYS_PLAYER.get(player.queued_action_key, 'Unknown')} ({p_action_name})")
     elapsed_time = (time.time() - player.combat_start_time) if player.combat_start_time > 0 else 0
     dps = (player.total_damage_dealt_session / elapsed_time) if elapsed_time > 0.1 else 0 
-    print(f"DPS: {dps:.1f}")
-    print(f"Stats: AtkP:{player.atk_pw} AtkS:{player.atk_sp} MgcP:{player.mgc_pw} Blk:{player.block_val} Dg:{player.dodge_val} Arm:{player.armor_val} MRs:{player.mgc_rs_val} Crt:{player.crits_val}")
+    lines.append(f"DPS: {dps:.1f}")
+    lines.append(f"Stats: AtkP:{player.atk_pw} AtkS:{player.atk_sp} MgcP:{player.mgc_pw} Blk:{player.block_val} Dg:{player.dodge_val} Arm:{player.armor_val} MRs:{player.mgc_rs_val} Crt:{player.crits_val}")
     
-    p_effects_str = ", ".join([f"{e['name']}({e['duration_left']:.0f}s{' B' if e['is_buff'] else ' D'})" for e in player.active_effects]) or "None"
-    print(f"Effects: {p_effects_str}\n")
+    p_effects_str = ", ".join([f"{e.name}({player.effect_time_left(e):.0f}s{' B' if e.is_buff else ' D'})" for e in player.active_effects]) or "None"
+    lines.append(f"Effects: {p_effects_str}")
+    lines.append("")
 
     o_bar_fill = int(opponent.attack_bar_progress / 100 * 20)
     o_bar = f"[{'■' * o_bar_fill}{' ' * (20 - o_bar_fill)}] {opponent.attack_bar_progress:.0f}%"
@@ -736,74 +1292,89 @@ def display_hud(player, opponent):
     elif o_action_id:
         o_action_name = f"Unknown Action ({o_action_id})"
     
-    print(f"[{opponent.name}] HP: {opponent.current_hp:.0f}/{opponent.max_hp:.0f}   ATK BAR: {o_bar}")
-    print(f"Queued: {o_action_name}")
-    print(f"Stats: AtkP:{opponent.atk_pw} AtkS:{opponent.atk_sp} MgcP:{opponent.mgc_pw} Blk:{opponent.block_val} Dg:{opponent.dodge_val} Arm:{opponent.armor_val} MRs:{opponent.mgc_rs_val} Crt:{opponent.crits_val}")
+    lines.append(f"[{opponent.name}] HP: {opponent.current_hp:.0f}/{opponent.max_hp:.0f}   ATK BAR: {o_bar}")
+    lines.append(f"Queued: {o_action_name}")
+    lines.append(f"Stats: AtkP:{opponent.atk_pw} AtkS:{opponent.atk_sp} MgcP:{opponent.mgc_pw} Blk:{opponent.block_val} Dg:{opponent.dodge_val} Arm:{opponent.armor_val} MRs:{opponent.mgc_rs_val} Crt:{opponent.crits_val}")
     
-    o_effects_str = ", ".join([f"{e['name']}({e['duration_left']:.0f}s{' B' if e['is_buff'] else ' D'})" for e in opponent.active_effects]) or "None"
-    print(f"Effects: {o_effects_str}\n")
-
-    print("--- Combat Log ---")
-    for entry in COMBAT_LOG[-MAX_COMBAT_LOG_ENTRIES:]:
-        print(entry)
-    print("------------------")
-    print(f"Controls: ({'/'.join(ACTION_KEYS_PLAYER.keys())}) to queue, (q) to quit combat")
+    o_effects_str = ", ".join([f"{e.name}({opponent.effect_time_left(e):.0f}s{' B' if e.is_buff else ' D'})" for e in opponent.active_effects]) or "None"
+    lines.append(f"Effects: {o_effects_str}")
+    lines.append("")
+
+    lines.append("--- Combat Log ---")
+    lines.extend(COMBAT_LOG.lines(MAX_COMBAT_LOG_ENTRIES))
+    lines.append("------------------")
+    lines.append(f"Controls: ({'/'.join(ACTION_KEYS_PLAYER.keys())}) to queue, (q) to quit combat")
+    return lines
+
+
+def display_hud(player, opponent, renderer=None, overlay=None):
+    # Without a renderer the whole frame is drawn, still in one write. overlay is
+    # an extra line for the bottom of the HUD.
+    if renderer is None:
+        renderer = ScreenRenderer()
+    lines = compose_hud(player, opponent)
+    if overlay is not None:
+        lines.append(overlay)
+    renderer.render(lines)
+    return renderer
+
+
+def roll_attack(attacker, target, action, rng=random):
+    # Rolls dodge, crit and mitigation for one use of action without touching HP or the log.
+    # Returns (dodged, is_crit, damage_before_mitigation, mitigation_fraction, final_damage).
+    dodge_chance = target.dodge_val / 10.0
+    if rng.random() * 100 < dodge_chance:
+        return True, False, 0, 0.0, 0
+
+    base_damage = 0
+    is_magic_attack = False
+    if action.dmg_stat_source == "AtkPw":
+        base_damage = action.base_val + (attacker.atk_pw * 0.2)
+    elif action.dmg_stat_source == "MgcPw":
+        base_damage = action.base_val + (attacker.mgc_pw * 0.2)
+        is_magic_attack = True
+
+    is_crit = False
+    if base_damage > 0:
+        crit_chance = attacker.crits_val / 3.0
+        if rng.random() * 100 < crit_chance:
+            is_crit = True
+
+    damage_before_mitigation = base_damage * (2.0 if is_crit else 1.0)
+    final_damage = damage_before_mitigation
+    mitigation = 0.0
+
+    if damage_before_mitigation > 0:
+        if is_magic_attack:
+            mitigation = rng.uniform(0.01, target.mgc_rs_val / 100.0) if target.mgc_rs_val > 1 else 0
+        else:
+            block_mit_val = rng.uniform(0.01, target.block_val / 100.0) if target.block_val > 1 else 0
+            armor_reduction_factor = target.armor_val / (target.armor_val + 200.0) if target.armor_val > 0 else 0
+            mitigation = block_mit_val + armor_reduction_factor
+        mitigation = max(0, min(0.95, mitigation))
+        final_damage *= (1 - mitigation)
+
+    final_damage = max(0, int(round(final_damage)))
+    return False, is_crit, damage_before_mitigation, mitigation, final_damage
 
 
 def resolve_attack(attacker, target, action_id):
     action = ALL_ACTIONS.get(action_id)
     if not action:
-        add_to_combat_log(f"{attacker.name} tries to use unknown action ID {action_id}!")
+        COMBAT_LOG.add(LOG_UNKNOWN_ACTION, attacker.name, action_id)
         return
 
-    effect_log_attacker = attacker.apply_effect(action, source_entity_is_self=True)
-    if effect_log_attacker: add_to_combat_log(effect_log_attacker)
+    log_events(attacker.apply_effect(action, source_entity_is_self=True))
     
     if action.dmg_stat_source or action.enemy_debuff_target_stat:
-        dodge_chance = target.dodge_val / 10.0
-        if random.random() * 100 < dodge_chance:
-            add_to_combat_log(f"{attacker.name} uses {action.name} on {target.name}!")
-            add_to_combat_log(f"{target.name} dodges {action.name}!")
+        dodged, is_crit, damage_before_mitigation, mitigation_percent_calc, final_damage_after_mitigation = \
+            roll_attack(attacker, target, action)
+        if dodged:
+            COMBAT_LOG.add(LOG_USES, attacker.name, action.name, target.name)
+            COMBAT_LOG.add(LOG_DODGE, target.name, action.name)
             return
 
         if action.dmg_stat_source:
-            base_damage = 0
-            is_magic_attack = False
-            if action.dmg_stat_source == "AtkPw":
-                base_damage = action.base_val + (attacker.atk_pw * 0.2) 
-            elif action.dmg_stat_source == "MgcPw":
-                base_damage = action.base_val + (attacker.mgc_pw * 0.2)
-                is_magic_attack = True
-            
-            crit_multiplier = 1.0
-            crit_message_part = "" 
-            if base_damage > 0: 
-                crit_chance = attacker.crits_val / 3.0
-                if random.random() * 100 < crit_chance:
-                    crit_multiplier = 2.0
-                    crit_message_part = " (Critical Hit!)" 
-            
-            damage_before_mitigation = base_damage * crit_multiplier
-            
-            final_damage_after_mitigation = damage_before_mitigation 
-            mitigation_percent_for_log = 0.0
-
-            if damage_before_mitigation > 0: 
-                mitigation_percent_calc = 0.0
-                if is_magic_attack:
-                    mitigation_percent_calc = random.uniform(0.01, target.mgc_rs_val / 100.0) if target.mgc_rs_val > 1 else 0
-                else: 
-                    block_mit_val = random.uniform(0.01, target.block_val / 100.0) if target.block_val > 1 else 0
-                    armor_reduction_factor = target.armor_val / (target.armor_val + 200.0) if target.armor_val > 0 else 0
-                    mitigation_percent_calc = block_mit_val + armor_reduction_factor
-
-                mitigation_percent_calc = max(0, min(0.95, mitigation_percent_calc)) 
-                mitigation_percent_for_log = mitigation_percent_calc * 100 
-                
-                final_damage_after_mitigation *= (1 - mitigation_percent_calc)
-            
-            final_damage_after_mitigation = max(0, int(round(final_damage_after_mitigation)))
-            
             actual_damage_dealt = 0
             if final_damage_after_mitigation > 0:
                 actual_damage_dealt = min(final_damage_after_mitigation, target.current_hp) 
@@ -813,27 +1384,18 @@ def resolve_attack(attacker, target, action_id):
                     target.total_damage_taken_session += actual_damage_dealt
                 elif attacker.is_player: # Player (attacker) dealt damage to NPC target
                     pass # This is covered by total_damage_dealt_session for player
-                
-                damage_color_str = ""
-                if actual_damage_dealt > 0:
-                    if attacker.is_player: # Player dealt damage
-                        damage_color_str = COLOR_GREEN
-                    else: # Opponent dealt damage (player is target)
-                        damage_color_str = COLOR_RED
-                
-                raw_damage_val_log = int(round(damage_before_mitigation))
-                log_message = (f"{attacker.name} uses {action.name} on {target.name}!{crit_message_part} "
-                               f"({raw_damage_val_log}/{mitigation_percent_for_log:.1f}%/"
-                               f"{damage_color_str}{actual_damage_dealt}{COLOR_RESET if damage_color_str else ''})")
-                add_to_combat_log(log_message)
+
+                # Player damage shows green, damage to the player red.
+                COMBAT_LOG.add(LOG_HIT, attacker.name, action.name, target.name, is_crit,
+                               int(round(damage_before_mitigation)), mitigation_percent_calc * 100,
+                               actual_damage_dealt, attacker.is_player if actual_damage_dealt > 0 else None)
             else: 
-                add_to_combat_log(f"{attacker.name} uses {action.name} on {target.name}!{crit_message_part} but deals no damage.")
+                COMBAT_LOG.add(LOG_NO_DAMAGE, attacker.name, action.name, target.name, is_crit)
         
         else: 
-            add_to_combat_log(f"{attacker.name} uses {action.name} on {target.name}!")
+            COMBAT_LOG.add(LOG_USES, attacker.name, action.name, target.name)
 
-        effect_log_target = target.apply_effect(action, source_entity_is_self=False)
-        if effect_log_target: add_to_combat_log(effect_log_target)
+        log_events(target.apply_effect(action, source_entity_is_self=False))
 
     if attacker.is_player:
         used_item_slot_key = None
@@ -847,7 +1409,7 @@ def resolve_attack(attacker, target, action_id):
             if item_in_slot and item_in_slot.action_id == action_id and item_in_slot.cooldown_time > 0:
                  if item_in_slot.slot in [7, 8] or action.id == item_in_slot.action_id : 
                     attacker.item_cooldowns[item_in_slot.id] = item_in_slot.cooldown_time
-                    add_to_combat_log(f"{item_in_slot.name} is now on cooldown ({item_in_slot.cooldown_time}s).")
+                    COMBAT_LOG.add(LOG_COOLDOWN, item_in_slot.name, item_in_slot.cooldown_time)
                     
 
 def handle_loot_drop(player, defeated_npc):
@@ -867,7 +1429,7 @@ def handle_loot_drop(player, defeated_npc):
         return
 
     blueprint    = ALL_ITEMS[chosen_id]
-    dropped_item = copy.deepcopy(blueprint)
+    dropped_item = blueprint.instance()
     slot_name      = SLOT_NAMES.get(dropped_item.slot, "Unknown")
     add_to_combat_log(f"{defeated_npc.name} dropped: {dropped_item.name} (Slot: {slot_name})!")
 
@@ -905,20 +1467,6 @@ def handle_loot_drop(player, defeated_npc):
 
 
 def save_player_character(player):
-    global SAVED_CHARS_DATA
-
-    is_new_character_entry = False
-    if player.save_id is None:
-        max_id = 0
-        if SAVED_CHARS_DATA:
-            for char_d in SAVED_CHARS_DATA:
-                sid = char_d.get('SaveID')
-                if isinstance(sid, (int, str)) and str(sid).isdigit():
-                    max_id = max(max_id, int(sid))
-        player.save_id = max_id + 1
-        is_new_character_entry = True
-        print(f"Assigning new SaveID {player.save_id} to {player.name}.")
-
     current_player_data_to_save = {'SaveID': player.save_id, 'Name': player.name}
     for attr in ATTRIBUTES:
         current_player_data_to_save[attr] = player.base_attributes.get(attr, 0)
@@ -927,34 +1475,13 @@ def save_player_character(player):
         current_player_data_to_save[f'Slot{i}'] = item.id if item else None
     current_player_data_to_save['XP'] = player.xp
 
-    new_full_saves_list = []
-    character_was_updated_in_list = False
-    
-    if not is_new_character_entry: 
-        for char_d in SAVED_CHARS_DATA:
-            if str(char_d.get('SaveID')) == str(player.save_id):
-                new_full_saves_list.append(current_player_data_to_save) 
-                character_was_updated_in_list = True
-            else:
-                new_full_saves_list.append(char_d) 
-    else: 
-        new_full_saves_list = list(SAVED_CHARS_DATA) 
-
-    if is_new_character_entry:
-        new_full_saves_list.append(current_player_data_to_save)
-    elif not character_was_updated_in_list: 
-        new_full_saves_list.append(current_player_data_to_save)
-        
-    SAVED_CHARS_DATA = new_full_saves_list
-
-    fieldnames = ['SaveID', 'Name'] + ATTRIBUTES + [f'Slot{i}' for i in range(1,9)] + ['XP']
     try:
-        with open(CSV_FILES["saved"], 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            writer.writerows(SAVED_CHARS_DATA) 
+        save_id = get_save_store().upsert(current_player_data_to_save)
+        if player.save_id is None:
+            player.save_id = save_id
+            print(f"Assigning new SaveID {player.save_id} to {player.name}.")
         add_to_combat_log(f"Character {player.name} saved (ID: {player.save_id}).")
-    except Exception as e:
+    except sqlite3.Error as e:
         add_to_combat_log(f"Error saving character: {e}")
         print(f"Error saving character: {e}")
 
@@ -981,99 +1508,470 @@ def record_to_leaderboard(player, won_fight, fight_duration, opponent_name):
     for attr in ATTRIBUTES:
         entry[attr] = player.current_attributes.get(attr, 0)
 
-    fieldnames = (
-        ['timestamp', 'toon_name', 'opponent_name', 'fight_duration_seconds',
-         'level', 'kills', 'damage_done', 'damage_received']
-        + [f'item{i}' for i in range(1, 9)]
-        + ATTRIBUTES
-    )
-
     try:
-        file_exists = os.path.isfile(CSV_FILES["leaderboard"])
-        with open(CSV_FILES["leaderboard"], 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-            if not file_exists or os.path.getsize(CSV_FILES["leaderboard"]) == 0:
-                writer.writeheader()
-            writer.writerow(entry)
+        get_leaderboard().record(entry)
         add_to_combat_log(f"{player.name} recorded to leaderboard.")
-    except Exception as e:
+    except (OSError, sqlite3.Error) as e:
         add_to_combat_log(f"Error recording to leaderboard: {e}")
         print(f"Error recording to leaderboard: {e}")
 
     if not won_fight and player.save_id is not None:
-        global SAVED_CHARS_DATA
-        SAVED_CHARS_DATA = [
-            char_d for char_d in SAVED_CHARS_DATA
-            if str(char_d.get('SaveID')) != str(player.save_id)
-        ]
-
-        save_fieldnames = (
-            ['SaveID', 'Name'] + ATTRIBUTES + [f'Slot{i}' for i in range(1, 9)] + ['XP']
-        )
-        if SAVED_CHARS_DATA: 
-            if SAVED_CHARS_DATA: 
-                 save_fieldnames = list(SAVED_CHARS_DATA[0].keys())
-        elif not os.path.exists(CSV_FILES["saved"]) or os.path.getsize(CSV_FILES["saved"]) == 0 :
-             pass 
-        else: 
-            pass
-
-
         try:
-            with open(CSV_FILES["saved"], 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=save_fieldnames, extrasaction='ignore')
-                writer.writeheader()
-                writer.writerows(SAVED_CHARS_DATA) 
+            get_save_store().delete(player.save_id)
             add_to_combat_log(f"Player {player.name} (SaveID: {player.save_id}) removed from saves after loss.")
-        except Exception as e:
+        except sqlite3.Error as e:
             add_to_combat_log(f"Error removing player {player.name} from saves: {e}")
 
 
-def combat_loop(player, opponent):
-    clear_screen()
-    COMBAT_LOG.clear()
-    add_to_combat_log(f"Combat starts: {player.name} vs {opponent.name}!")
-    if opponent.text_start: add_to_combat_log(opponent.text_start)
-
-    player.combat_start_time = time.time()
-    opponent.combat_start_time = time.time() 
-    player.total_damage_dealt_session = 0
-    player.total_damage_taken_session = 0
-    opponent.total_damage_dealt_session = 0 
-    opponent.total_damage_taken_session = 0 
-    
-    game_over = False
-    player_won = False
-    last_refresh_time = time.time()
-
-    while not game_over:
-        current_time = time.time()
-        delta_time = current_time - last_refresh_time
-        if delta_time <= 0: delta_time = REFRESH_RATE 
-        last_refresh_time = current_time
-
-        keypress = get_keypress()
-        if keypress:
-            if keypress in ACTION_KEYS_PLAYER:
-                player.queued_action_key = keypress
-                action_id_to_queue = player.get_action_for_key(keypress)
-                action_name_log = "Invalid/CD"
-                if action_id_to_queue and action_id_to_queue in ALL_ACTIONS:
-                    action_name_log = ALL_ACTIONS[action_id_to_queue].name
-                add_to_combat_log(f"Player queues {ACTION_KEYS_PLAYER[keypress]} ({action_name_log}).")
-            elif keypress == 'q':
-                add_to_combat_log("Player forfeits.")
-                game_over = True
-                player_won = False
-                break
-        
-        for msg in player.update_active_effects(delta_time): add_to_combat_log(msg)
+# --- Save Store ---
+# Saved characters live in SQLite keyed on SaveID, so saving or deleting one
+# character is an indexed write in its own transaction instead of a rewrite of
+# the whole roster. pyRL_saved.csv is imported once, when the store is created.
+
+SAVE_FIELDNAMES = ['SaveID', 'Name'] + ATTRIBUTES + [f'Slot{i}' for i in range(1, 9)] + ['XP']
+
+
+class SaveStore:
+    def __init__(self, path=None, import_csv=None):
+        self.path = path or CSV_FILES["saves_db"]
+        self.conn = sqlite3.connect(self.path)
+        # WAL keeps every commit atomic across crashes without a full fsync per write.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS saves "
+                "(save_id INTEGER PRIMARY KEY, name TEXT NOT NULL, data TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.import_csv(import_csv or CSV_FILES["saved"])
+
+    def import_csv(self, filename):
+        # One-time import of a legacy saves CSV; returns the number of rows imported.
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+            return 0
+        rows = load_csv_data(filename) if os.path.isfile(filename) else []
+        imported = 0
+        with self.conn:
+            for row in rows:
+                if row and row.get('Name') is not None:
+                    self._put(row)
+                    imported += 1
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', ?)", (filename,))
+        return imported
+
+    def _put(self, row):
+        save_id = row.get('SaveID')
+        if save_id is not None and not isinstance(save_id, int):
+            save_id = int(save_id) if str(save_id).isdigit() else None
+        if save_id is None:
+            # INTEGER PRIMARY KEY hands out max(SaveID) + 1.
+            save_id = self.conn.execute(
+                "INSERT INTO saves (name, data) VALUES (?, '')", (str(row.get('Name')),)).lastrowid
+        row = dict(row, SaveID=save_id)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO saves (save_id, name, data) VALUES (?, ?, ?)",
+            (save_id, str(row.get('Name')), json.dumps(row)))
+        return save_id
+
+    def upsert(self, row):
+        # Inserts or replaces one character; a row without SaveID gets a new one.
+        with self.conn:
+            return self._put(row)
+
+    def delete(self, save_id):
+        with self.conn:
+            return self.conn.execute("DELETE FROM saves WHERE save_id = ?", (save_id,)).rowcount > 0
+
+    def get(self, save_id):
+        found = self.conn.execute("SELECT data FROM saves WHERE save_id = ?", (save_id,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def all(self):
+        return [json.loads(data) for (data,) in self.conn.execute("SELECT data FROM saves ORDER BY save_id")]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM saves").fetchone()[0]
+
+    def export_csv(self, filename):
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=SAVE_FIELDNAMES, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.all())
+
+    def close(self):
+        self.conn.close()
+
+
+_save_store = None
+
+def get_save_store():
+    global _save_store
+    if _save_store is None:
+        _save_store = SaveStore()
+    return _save_store
+
+
+# --- Leaderboard ---
+# Fights are appended to CSV segments: pyRL_leaderboard.csv is the active one
+# and is renamed to pyRL_leaderboard.<n>.csv once it holds SEGMENT_ROWS fights.
+# A sidecar SQLite index keeps per-toon and per-(toon, opponent) aggregates,
+# updated with every fight, so rankings never re-read the segments.
+
+LEADERBOARD_FIELDNAMES = (
+    ['timestamp', 'toon_name', 'opponent_name', 'fight_duration_seconds',
+     'level', 'kills', 'damage_done', 'damage_received']
+    + [f'item{i}' for i in range(1, 9)]
+    + ATTRIBUTES
+)
+LEADERBOARD_SCHEMA = {"timestamp": str, "toon_name": str, "opponent_name": str}
+# Toon aggregates that top() can rank by; each has its own index.
+LEADERBOARD_METRICS = ("fights", "kills", "damage_done", "damage_received", "best_win_duration")
+
+
+class Leaderboard:
+    SEGMENT_ROWS = 100000
+
+    def __init__(self, segment_path=None, index_path=None, segment_rows=None):
+        self.segment_path = segment_path or CSV_FILES["leaderboard"]
+        self.index_path = index_path or CSV_FILES["leaderboard_index"]
+        self.segment_rows = segment_rows or self.SEGMENT_ROWS
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments "
+                "(segment_id INTEGER PRIMARY KEY, path TEXT NOT NULL, rows INTEGER NOT NULL, "
+                "first_timestamp TEXT, last_timestamp TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS toon_stats "
+                "(toon TEXT PRIMARY KEY, fights INTEGER NOT NULL, kills INTEGER NOT NULL, "
+                "damage_done REAL NOT NULL, damage_received REAL NOT NULL, "
+                "total_duration REAL NOT NULL, best_win_duration REAL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS matchup_stats "
+                "(toon TEXT NOT NULL, opponent TEXT NOT NULL, fights INTEGER NOT NULL, "
+                "kills INTEGER NOT NULL, damage_done REAL NOT NULL, damage_received REAL NOT NULL, "
+                "best_win_duration REAL, PRIMARY KEY (toon, opponent))")
+            for metric in LEADERBOARD_METRICS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS toon_by_{metric} ON toon_stats ({metric})")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS matchup_by_opponent "
+                "ON matchup_stats (opponent, best_win_duration)")
+            active = self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        if not active:
+            # First open: index whatever the CSV already holds.
+            self.rebuild()
+
+    def _active_segment(self):
+        return self.conn.execute(
+            "SELECT segment_id, rows FROM segments WHERE path = ?", (self.segment_path,)).fetchone()
+
+    def record(self, entry):
+        self.record_many([entry])
+
+    def record_many(self, entries):
+        # Appends fights to the active segment and folds them into the aggregates.
+        entries = list(entries)
+        while entries:
+            segment_id, rows = self._active_segment() or self._start_segment()
+            room = self.segment_rows - rows
+            if room <= 0:
+                self._rotate()
+                continue
+            batch, entries = entries[:room], entries[room:]
+            new_file = not os.path.isfile(self.segment_path) or os.path.getsize(self.segment_path) == 0
+            with open(self.segment_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=LEADERBOARD_FIELDNAMES, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(batch)
+            with self.conn:
+                self._aggregate(batch)
+                self.conn.execute(
+                    "UPDATE segments SET rows = rows + ?, last_timestamp = ?, "
+                    "first_timestamp = COALESCE(first_timestamp, ?) WHERE segment_id = ?",
+                    (len(batch), batch[-1].get('timestamp'), batch[0].get('timestamp'), segment_id))
+
+    def _aggregate(self, entries):
+        toon_rows = []
+        matchup_rows = []
+        for e in entries:
+            kills = int(e.get('kills') or 0)
+            duration = float(e.get('fight_duration_seconds') or 0)
+            done = float(e.get('damage_done') or 0)
+            received = float(e.get('damage_received') or 0)
+            best = duration if kills else None
+            toon_rows.append((e['toon_name'], kills, done, received, duration, best))
+            matchup_rows.append((e['toon_name'], e['opponent_name'], kills, done, received, best))
+        self.conn.executemany(
+            "INSERT INTO toon_stats VALUES (?, 1, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (toon) DO UPDATE SET fights = fights + 1, kills = kills + excluded.kills, "
+            "damage_done = damage_done + excluded.damage_done, "
+            "damage_received = damage_received + excluded.damage_received, "
+            "total_duration = total_duration + excluded.total_duration, "
+            "best_win_duration = COALESCE(MIN(best_win_duration, excluded.best_win_duration), "
+            "best_win_duration, excluded.best_win_duration)", toon_rows)
+        self.conn.executemany(
+            "INSERT INTO matchup_stats VALUES (?, ?, 1, ?, ?, ?, ?) "
+            "ON CONFLICT (toon, opponent) DO UPDATE SET fights = fights + 1, "
+            "kills = kills + excluded.kills, damage_done = damage_done + excluded.damage_done, "
+            "damage_received = damage_received + excluded.damage_received, "
+            "best_win_duration = COALESCE(MIN(best_win_duration, excluded.best_win_duration), "
+            "best_win_duration, excluded.best_win_duration)", matchup_rows)
+
+    def _start_segment(self):
+        with self.conn:
+            segment_id = self.conn.execute(
+                "INSERT INTO segments (path, rows) VALUES (?, 0)", (self.segment_path,)).lastrowid
+        return segment_id, 0
+
+    def _archived_segments(self):
+        # (number, path) of every archived segment on disk, oldest first.
+        root, ext = os.path.splitext(self.segment_path)
+        directory = os.path.dirname(self.segment_path) or "."
+        prefix = os.path.basename(root) + "."
+        return sorted(
+            (int(name[len(prefix):-len(ext)]), os.path.join(directory, name))
+            for name in os.listdir(directory)
+            if name.startswith(prefix) and name.endswith(ext) and name[len(prefix):-len(ext)].isdigit()
+        )
+
+    def _rotate(self):
+        segment_id, _ = self._active_segment()
+        # Never reuse a number already on disk, even one the index has lost track of.
+        archived_numbers = [number for number, _ in self._archived_segments()]
+        number = max([segment_id] + [n + 1 for n in archived_numbers])
+        root, ext = os.path.splitext(self.segment_path)
+        archived = f"{root}.{number:04d}{ext}"
+        os.replace(self.segment_path, archived)
+        with self.conn:
+            self.conn.execute("UPDATE segments SET path = ?, segment_id = ? WHERE segment_id = ?",
+                              (archived, number, segment_id))
+        self._start_segment()
+
+    def rebuild(self):
+        # Recomputes the index from the segments on disk, e.g. after a crash
+        # between a segment append and its index commit. Archives keep the
+        # number in their file name as segment_id, so the active segment is
+        # always numbered after them.
+        segments = self._archived_segments() + [(None, self.segment_path)]
+        with self.conn:
+            for table in ("segments", "toon_stats", "matchup_stats"):
+                self.conn.execute(f"DELETE FROM {table}")
+            for segment_id, path in segments:
+                rows = load_csv_data(path, schema=LEADERBOARD_SCHEMA) if os.path.isfile(path) else []
+                rows = [row for row in rows if row.get('toon_name') is not None]
+                self._aggregate(rows)
+                self.conn.execute(
+                    "INSERT INTO segments (segment_id, path, rows, first_timestamp, last_timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (segment_id, path, len(rows), rows[0].get('timestamp') if rows else None,
+                     rows[-1].get('timestamp') if rows else None))
+
+    # Queries
+
+    def top(self, metric="kills", n=10):
+        # Highest toons by metric; best_win_duration ranks the fastest wins first.
+        if metric not in LEADERBOARD_METRICS:
+            raise ValueError(f"Unknown leaderboard metric: {metric}")
+        order = "ASC" if metric == "best_win_duration" else "DESC"
+        return self.conn.execute(
+            f"SELECT toon, {metric} FROM toon_stats WHERE {metric} IS NOT NULL "
+            f"ORDER BY {metric} {order}, toon LIMIT ?", (n,)).fetchall()
+
+    def toon(self, name):
+        found = self.conn.execute(
+            "SELECT fights, kills, damage_done, damage_received, total_duration, best_win_duration "
+            "FROM toon_stats WHERE toon = ?", (name,)).fetchone()
+        if not found:
+            return None
+        fights, kills, done, received, duration, best = found
+        opponents = self.conn.execute(
+            "SELECT opponent, fights, kills, best_win_duration FROM matchup_stats "
+            "WHERE toon = ? ORDER BY opponent", (name,)).fetchall()
+        return {
+            'toon': name, 'fights': fights, 'kills': kills, 'losses': fights - kills,
+            'damage_done': done, 'damage_received': received,
+            'dps': done / duration if duration else 0.0, 'best_win_duration': best,
+            'opponents': {o: {'fights': f, 'kills': k, 'best_win_duration': b} for o, f, k, b in opponents},
+        }
+
+    def opponent(self, name, n=10):
+        # Fastest wins against one opponent, one entry per toon.
+        return self.conn.execute(
+            "SELECT toon, best_win_duration FROM matchup_stats "
+            "WHERE opponent = ? AND best_win_duration IS NOT NULL "
+            "ORDER BY best_win_duration, toon LIMIT ?", (name, n)).fetchall()
+
+    def total_fights(self):
+        return self.conn.execute("SELECT COALESCE(SUM(rows), 0) FROM segments").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+_leaderboard = None
+
+def get_leaderboard():
+    global _leaderboard
+    if _leaderboard is None:
+        _leaderboard = Leaderboard()
+    return _leaderboard
+
+
+# --- Headless Combat Engine ---
+# The combat rules advance on whatever clock the caller supplies: the
+# interactive game feeds it real frame times, batch tools feed it a fixed
+# virtual tick and run as fast as the CPU allows.
+
+class FixedKeyPolicy:
+    # Always queues the same action key.
+    def __init__(self, key='a'):
+        self.key = key
+
+    def __call__(self, engine):
+        if engine.player.queued_action_key != self.key:
+            return self.key
+        return None
+
+
+class ScriptedPolicy:
+    # Queues keys from a list, moving on each time the player attacks.
+    def __init__(self, keys, loop=True):
+        self.keys = list(keys)
+        self.loop = loop
+
+    def __call__(self, engine):
+        if not self.keys:
+            return None
+        index = engine.player_attacks
+        if self.loop:
+            index %= len(self.keys)
+        elif index >= len(self.keys):
+            return None
+        key = self.keys[index]
+        if engine.player.queued_action_key != key:
+            return key
+        return None
+
+
+class FightResult:
+    def __init__(self, engine):
+        player, opponent = engine.player, engine.opponent
+        self.player_name = player.name
+        self.opponent_name = opponent.name
+        self.player_won = engine.player_won
+        self.forfeited = engine.forfeited
+        self.timed_out = not engine.game_over
+        if self.timed_out:
+            self.winner = None
+        else:
+            self.winner = player.name if engine.player_won else opponent.name
+        self.duration = engine.elapsed
+        self.player_damage_dealt = player.total_damage_dealt_session
+        self.player_damage_taken = player.total_damage_taken_session
+        self.opponent_damage_dealt = opponent.total_damage_dealt_session
+        self.player_hp_left = player.current_hp
+        self.opponent_hp_left = opponent.current_hp
+        self.log_entries = list(COMBAT_LOG)
+
+    @property
+    def log(self):
+        return [format_log_entry(entry) for entry in self.log_entries]
+
+    def __repr__(self):
+        return (f"FightResult({self.player_name} vs {self.opponent_name}, winner={self.winner}, "
+                f"duration={self.duration:.1f}s, dealt={self.player_damage_dealt}, "
+                f"taken={self.player_damage_taken})")
+
+
+class CombatEngine:
+    def __init__(self, player, opponent, policy=None, opponent_policy=None):
+        self.player = player
+        self.opponent = opponent
+        self.policy = policy if policy is not None else FixedKeyPolicy(player.queued_action_key or 'a')
+        # Picks the opponent's action id when its bar fills; None (or a None
+        # result) keeps the act1..act9 sequence.
+        self.opponent_policy = opponent_policy
+        self.elapsed = 0.0
+        self.game_over = False
+        self.player_won = False
+        self.forfeited = False
+        self.player_attacks = 0
+
+    def start(self, start_time=0.0):
+        player, opponent = self.player, self.opponent
+        COMBAT_LOG.clear()
+        COMBAT_LOG.add(LOG_COMBAT_START, player.name, opponent.name)
+        if opponent.text_start: add_to_combat_log(opponent.text_start)
+
+        player.combat_start_time = start_time
+        opponent.combat_start_time = start_time
+        player.total_damage_dealt_session = 0
+        player.total_damage_taken_session = 0
+        opponent.total_damage_dealt_session = 0
+        opponent.total_damage_taken_session = 0
+        self.elapsed = 0.0
+
+    def _finish(self, player_won):
+        self.game_over = True
+        self.player_won = player_won
+        return True
+
+    def handle_key(self, keypress):
+        player = self.player
+        if keypress in ACTION_KEYS_PLAYER:
+            player.queued_action_key = keypress
+            action_id_to_queue = player.get_action_for_key(keypress)
+            action_name_log = "Invalid/CD"
+            if action_id_to_queue and action_id_to_queue in ALL_ACTIONS:
+                action_name_log = ALL_ACTIONS[action_id_to_queue].name
+            COMBAT_LOG.add(LOG_QUEUE, ACTION_KEYS_PLAYER[keypress], action_name_log)
+        elif keypress == 'q':
+            COMBAT_LOG.add(LOG_FORFEIT)
+            self.forfeited = True
+            return self._finish(False)
+        return False
+
+    def step(self, delta_time, timer=None):
+        # Advances the fight by delta_time seconds; returns True once it is over.
+        # timer(phase, seconds), when given, gets the time of the "effects" and
+        # "attacks" halves (FrameProfiler.add).
+        if self.game_over:
+            return True
+        self.elapsed += delta_time
+
+        keypress = self.policy(self)
+        if keypress and self.handle_key(keypress):
+            return True
+        if timer is None:
+            if self._tick_effects(delta_time):
+                return True
+            return self._tick_attacks(delta_time)
+        started = time.perf_counter()
+        over = self._tick_effects(delta_time)
+        timer("effects", time.perf_counter() - started)
+        if over:
+            return True
+        started = time.perf_counter()
+        over = self._tick_attacks(delta_time)
+        timer("attacks", time.perf_counter() - started)
+        return over
+
+    # The two halves of step.
+    def _tick_effects(self, delta_time):
+        player, opponent = self.player, self.opponent
+        log_events(player.update_active_effects(delta_time))
         player.tick_item_cooldowns(delta_time)
-        for msg in opponent.update_active_effects(delta_time): add_to_combat_log(msg)
+        log_events(opponent.update_active_effects(delta_time))
 
-        if player.current_hp <= 0: game_over = True; player_won = False; break
-        if opponent.current_hp <= 0: game_over = True; player_won = True; break
+        if player.current_hp <= 0: return self._finish(False)
+        if opponent.current_hp <= 0: return self._finish(True)
+        return False
 
+    def _tick_attacks(self, delta_time):
+        player, opponent = self.player, self.opponent
         player.attack_bar_progress += (100.0 / player.attack_fill_time) * delta_time
         opponent.attack_bar_progress += (100.0 / opponent.attack_fill_time) * delta_time
         
@@ -1085,35 +1983,314 @@ def combat_loop(player, opponent):
             if action_id and action_id in ALL_ACTIONS:
                 resolve_attack(player, opponent, action_id)
             else:
-                add_to_combat_log(f"Player's action ({player.queued_action_key}) fizzles (unavailable/cooldown).")
+                COMBAT_LOG.add(LOG_FIZZLE, player.queued_action_key)
             player.attack_bar_progress = 0
+            self.player_attacks += 1
 
-        if opponent.current_hp <= 0: game_over = True; player_won = True; break 
+        if opponent.current_hp <= 0: return self._finish(True)
 
         if opponent.attack_bar_progress >= 100:
             act_idx_str = f'act{(opponent.action_sequence_index % 9) + 1}'
             action_id = opponent.npc_data_source.get(act_idx_str) if opponent.npc_data_source else None
+            if self.opponent_policy is not None:
+                action_id = self.opponent_policy(self) or action_id
             if action_id and action_id in ALL_ACTIONS:
                 resolve_attack(opponent, player, action_id)
             else:
-                add_to_combat_log(f"{opponent.name} confused (invalid action ID: {action_id} from {act_idx_str}).")
+                COMBAT_LOG.add(LOG_CONFUSED, opponent.name, action_id, act_idx_str)
             opponent.attack_bar_progress = 0
             opponent.action_sequence_index += 1
 
+        if player.current_hp <= 0: return self._finish(False)
+        return False
+
+    def time_to_next_event(self):
+        # Exact delay until something can change: an attack bar filling, an effect
+        # expiring, a damage-over-time effect emptying an HP pool or a cooldown ending.
+        # HP-over-time effects are linear between events, so nothing in between matters.
+        delays = []
+        for entity in (self.player, self.opponent):
+            delays.append((100.0 - entity.attack_bar_progress) * entity.attack_fill_time / 100.0)
+            expiry = entity.time_to_next_expiry()
+            if expiry is not None:
+                delays.append(expiry)
+            if entity.hp_rate < 0 and entity.current_hp > 0:
+                delays.append(entity.current_hp / -entity.hp_rate)
+        for remaining in self.player.item_cooldowns.values():
+            if remaining > 0:
+                delays.append(remaining)
+        # Land just past the event so float error can't leave a bar at 99.9999%.
+        return max(0.0, min(delays)) + EVENT_EPSILON
+
+    def run(self, tick=None, max_time=600.0):
+        # Fast-forwards on a virtual clock; a fight still going at max_time is a timeout.
+        # With tick=None the engine jumps from event to event, otherwise it steps by tick.
+        self.start()
+        while not self.game_over:
+            delta = tick if tick is not None else self.time_to_next_event()
+            if self.elapsed + delta > max_time:
+                self.elapsed = max_time
+                break
+            self.step(delta)
+        return FightResult(self)
+
+
+def simulate_fight(player, opponent, policy=None, tick=None, max_time=600.0, opponent_policy=None):
+    return CombatEngine(player, opponent, policy, opponent_policy).run(tick, max_time)
+
+
+class RollingSamples:
+    # The last keep timings, in seconds, with nearest-rank percentiles.
+    def __init__(self, keep=1000):
+        self.samples = deque(maxlen=keep)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def clear(self):
+        self.samples.clear()
+
+    def percentile(self, p, ordered=None):
+        if not self.samples:
+            return 0.0
+        if ordered is None:
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+
+class InputLatency(RollingSamples):
+    # Keypress-to-queue latency of the interactive combat loop: the time from
+    # stdin waking the loop to the key's action being queued, in seconds.
+    def summary(self):
+        if not self.samples:
+            return "Input latency: no keys pressed."
+        mean = sum(self.samples) / len(self.samples)
+        return (f"Input latency over {len(self.samples)} keys: mean {mean * 1000:.2f} ms, "
+                f"p99 {self.percentile(99) * 1000:.2f} ms, max {max(self.samples) * 1000:.2f} ms")
+
+INPUT_LATENCY = InputLatency()
+
+
+class FrameProfiler:
+    # Per-phase timers for the interactive combat loop. A frame is one wakeup of
+    # CombatEventLoop: the wait in select() (and reading the keys), the key
+    # handling, the effects and attacks halves of CombatEngine.step and the HUD
+    # redraw. The busy part of each frame feeds a rolling window for the
+    # percentiles and histogram. A step landing more than DEADLINE_SLACK after
+    # REFRESH_RATE since the previous one counts as a missed deadline.
+    # combat_loop only builds one when FRAME_PROFILING is on; otherwise the loop
+    # takes none of these timings.
+    PHASES = ("wait", "input", "effects", "attacks", "hud")
+    CSV_FIELDS = ("frame", "time", *(f"{phase}_ms" for phase in PHASES),
+                  "busy_ms", "step_gap_ms", "missed")
+
+    def __init__(self, keep=1000, deadline=REFRESH_RATE, overlay=FRAME_OVERLAY):
+        self.busy = RollingSamples(keep)
+        self.phase_totals = RollingSamples(keep) # (wait, input, effects, attacks, hud) tuples
+        self.deadline = deadline
+        self.overlay = overlay
+        self.frames = [] # CSV rows of the current fight
+        self.missed = 0
+        self.current = dict.fromkeys(self.PHASES, 0.0)
+        self.started = None
+        self.step_gap = 0.0
+
+    def start(self, now):
+        self.busy.clear()
+        self.phase_totals.clear()
+        self.frames = []
+        self.missed = 0
+        self.started = now
+        self.current = dict.fromkeys(self.PHASES, 0.0)
+
+    def add(self, phase, seconds):
+        self.current[phase] += seconds
+
+    def note_step(self, delta_time):
+        # Called with the gap before each engine step; counts missed deadlines.
+        self.step_gap = delta_time
+        if delta_time > self.deadline + DEADLINE_SLACK:
+            self.missed += 1
+
+    def end_frame(self, now):
+        phases = self.current
+        busy = phases["input"] + phases["effects"] + phases["attacks"] + phases["hud"]
+        self.busy.record(busy)
+        self.phase_totals.record(tuple(phases[phase] for phase in self.PHASES))
+        missed = self.step_gap > self.deadline + DEADLINE_SLACK
+        self.frames.append((len(self.frames), round(now - self.started, 6),
+                            *(round(phases[phase] * 1000, 4) for phase in self.PHASES),
+                            round(busy * 1000, 4), round(self.step_gap * 1000, 4), int(missed)))
+        self.current = dict.fromkeys(self.PHASES, 0.0)
+        self.step_gap = 0.0
+
+    def histogram(self):
+        # Busy frame times in the window, counted per FRAME_HISTOGRAM_MS bucket;
+        # the last bucket holds everything slower.
+        counts = [0] * (len(FRAME_HISTOGRAM_MS) + 1)
+        for seconds in self.busy.samples:
+            counts[bisect.bisect_left(FRAME_HISTOGRAM_MS, seconds * 1000)] += 1
+        return counts
+
+    def overlay_line(self):
+        if not self.busy:
+            return "Frames: -"
+        ordered = sorted(self.busy.samples)
+        p50, p95, p99 = (self.busy.percentile(p, ordered) * 1000 for p in (50, 95, 99))
+        n = len(self.phase_totals)
+        means = [sum(frame[i] for frame in self.phase_totals.samples) / n * 1000
+                 for i in range(1, len(self.PHASES))]
+        return (f"Frames: p50 {p50:.2f} p95 {p95:.2f} p99 {p99:.2f} ms, missed {self.missed} | "
+                + " ".join(f"{phase} {mean:.2f}" for phase, mean in zip(self.PHASES[1:], means)))
+
+    def summary(self):
+        if not self.busy:
+            return "Frame times: no frames."
+        edges = [f"<{edge:g}" for edge in FRAME_HISTOGRAM_MS] + [f">={FRAME_HISTOGRAM_MS[-1]:g}"]
+        counts = ", ".join(f"{edge}: {count}" for edge, count in zip(edges, self.histogram()) if count)
+        return f"{self.overlay_line()}\nFrame-time histogram (ms) over {len(self.busy)} frames: {counts}"
+
+    def export(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.CSV_FIELDS)
+            writer.writerows(self.frames)
+
+
+class CombatEventLoop:
+    # Drives an interactive fight. Instead of polling every tick it sleeps in
+    # select() until a key arrives, the next combat event is due or a HUD frame
+    # is due, whichever comes first. Keys are handled as soon as they arrive.
+    def __init__(self, engine, renderer, frame_interval=HUD_FRAME_INTERVAL,
+                 sim_interval=SIM_INTERVAL, latency=INPUT_LATENCY, profiler=None):
+        self.engine = engine
+        self.renderer = renderer
+        self.frame_interval = frame_interval
+        self.sim_interval = sim_interval
+        self.latency = latency
+        self.profiler = profiler
+        self.last_step = None
+        self.selector = None
+        self.stdin_closed = False
+        if os.name == 'posix':
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(sys.stdin, selectors.EVENT_READ)
+
+    def _wait_for_keys(self, timeout):
+        # Returns the keys pressed within timeout seconds, or "".
+        if self.stdin_closed:
+            time.sleep(timeout)
+            return ""
+        if self.selector is not None:
+            if self.selector.select(timeout):
+                # Read straight from the fd: a buffered read could hold back
+                # keys that select() would then no longer report.
+                data = os.read(sys.stdin.fileno(), 64)
+                if not data:
+                    # EOF: select() would report stdin readable forever, so
+                    # stop watching it and just wait out the timeouts.
+                    self.selector.unregister(sys.stdin)
+                    self.stdin_closed = True
+                return data.decode('utf-8', errors='ignore').lower()
+            return ""
+        deadline = time.monotonic() + timeout
+        while True:
+            key = get_keypress()
+            remaining = deadline - time.monotonic()
+            if key or remaining <= 0:
+                return key or ""
+            time.sleep(min(KEY_POLL_INTERVAL, remaining))
+
+    def _advance(self, now):
+        # Brings the fight up to now; returns True once it is over.
+        delta = now - self.last_step
+        self.last_step = now
+        if delta > 0:
+            if self.profiler is not None:
+                self.profiler.note_step(delta)
+                return self.engine.step(delta, self.profiler.add)
+            return self.engine.step(delta)
+        return self.engine.game_over
+
+    def run(self):
+        engine = self.engine
+        prof = self.profiler
+        self.last_step = time.monotonic()
+        next_frame = self.last_step
+        if prof is not None:
+            prof.start(self.last_step)
+        try:
+            while True:
+                if time.monotonic() >= next_frame:
+                    if prof is None:
+                        display_hud(engine.player, engine.opponent, self.renderer)
+                    else:
+                        started = time.perf_counter()
+                        display_hud(engine.player, engine.opponent, self.renderer,
+                                    prof.overlay_line() if prof.overlay else None)
+                        prof.add("hud", time.perf_counter() - started)
+                    next_frame = time.monotonic() + self.frame_interval
+                next_step = self.last_step + min(self.sim_interval, engine.time_to_next_event())
+                timeout = max(0.0, min(next_step, next_frame) - time.monotonic())
+                if prof is None:
+                    keys = self._wait_for_keys(timeout)
+                else:
+                    started = time.perf_counter()
+                    keys = self._wait_for_keys(timeout)
+                    prof.add("wait", time.perf_counter() - started)
+                woke = time.monotonic()
+                if self._advance(woke):
+                    break
+                # Timed from here so the step's effects and attacks aren't counted twice.
+                handling = time.monotonic() if prof is not None and keys else 0.0
+                for key in keys:
+                    if engine.handle_key(key):
+                        break
+                    self.latency.record(time.monotonic() - woke)
+                if prof is not None:
+                    if keys:
+                        prof.add("input", time.monotonic() - handling)
+                    prof.end_frame(time.monotonic())
+                if engine.game_over:
+                    break
+                if keys:
+                    next_frame = woke # show the queued action right away
+        finally:
+            if self.selector is not None:
+                self.selector.close()
+        return engine
+
+
+def _no_input(engine):
+    # CombatEventLoop feeds keys to the engine itself.
+    return None
 
-        if player.current_hp <= 0: game_over = True; player_won = False; break
 
-        display_hud(player, opponent)
-        
-        elapsed_tick_time = time.time() - current_time
-        sleep_duration = REFRESH_RATE - elapsed_tick_time
-        if sleep_duration > 0:
-            time.sleep(sleep_duration)
+def combat_loop(player, opponent, opponent_policy=None):
+    clear_screen()
+    engine = CombatEngine(player, opponent, policy=_no_input, opponent_policy=opponent_policy)
+    renderer = ScreenRenderer()
+    engine.start(time.time())
+    profiler = FrameProfiler() if FRAME_PROFILING else None
+    CombatEventLoop(engine, renderer, profiler=profiler).run()
 
+    player_won = engine.player_won
     if os.name == 'posix': _restore_tty_settings_non_blocking() 
-    display_hud(player, opponent) 
+    display_hud(player, opponent, renderer)
+    renderer.move_below()
     print("\n--- COMBAT END ---")
-    for entry in COMBAT_LOG: print(entry)
+    for line in COMBAT_LOG.lines(): print(line)
+    print(INPUT_LATENCY.summary())
+    if profiler is not None:
+        print(profiler.summary())
+        try:
+            profiler.export(CSV_FILES["frames"])
+            print(f"Frame timings saved to {CSV_FILES['frames']}.")
+        except OSError as e:
+            print(f"Could not save frame timings: {e}")
 
     fight_duration = (time.time() - player.combat_start_time) if player.combat_start_time > 0 else 0
 
@@ -1162,7 +2339,7 @@ def main_game_loop():
             if next_action_idx == 0: 
                 current_player.current_hp = current_player.max_hp
                 current_player.attack_bar_progress = 0
-                current_player.active_effects.clear()
+                current_player.clear_effects()
                 for item_id_key in list(current_player.item_cooldowns.keys()): 
                     current_player.item_cooldowns[item_id_key] = 0
                 current_player.update_stats_and_effects()
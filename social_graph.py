@@ -0,0 +1,241 @@
+"""Incremental analytics over the relationship graph of a World.
+
+Every relationship change applied by ``World`` is fed to ``SocialGraph``,
+which keeps the following up to date so queries cost a lookup:
+
+ - degree: number of characters a node has a non-zero relationship with.
+ - strength: sum of a node's relationship scores (net standing).
+ - components: groups linked by positive relationships, kept in a
+   union-find. Unions happen immediately; an edge turning non-positive or
+   a node leaving only marks its component dirty, and dirty components are
+   split again the next time components are queried.
+ - communities: approximate faction labels from local label propagation
+   over positive edges, refreshed around every change.
+
+Nodes are character ids.
+"""
+
+import heapq
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+
+class SocialGraph:
+    """Undirected weighted relationship graph with incremental metrics."""
+
+    def __init__(self, propagation_limit: int = 32):
+        self.adjacency: Dict[int, Dict[int, int]] = {}
+        self.degree: Dict[int, int] = {}
+        self.strength: Dict[int, int] = {}
+        self.labels: Dict[int, int] = {}
+        # Union-find over positive edges.
+        self._parent: Dict[int, int] = {}
+        self._members: Dict[int, Set[int]] = {}  # root -> nodes
+        self._dirty: Set[int] = set()  # roots that may need splitting
+        # Label updates allowed per change beyond the two endpoints.
+        self.propagation_limit = propagation_limit
+
+    # --- updates -------------------------------------------------------
+
+    def add_node(self, node: int) -> None:
+        if node in self.adjacency:
+            return
+        if node in self._parent:
+            # Removed earlier but still awaiting repair in an old component.
+            self._repair()
+        self.adjacency[node] = {}
+        self.degree[node] = 0
+        self.strength[node] = 0
+        self.labels[node] = node
+        self._parent[node] = node
+        self._members[node] = {node}
+
+    def apply_change(self, a: int, b: int, change: int) -> None:
+        """Add ``change`` to the relationship between ``a`` and ``b``."""
+        if not change or a == b:
+            return
+        self.add_node(a)
+        self.add_node(b)
+        old = self.adjacency[a].get(b, 0)
+        new = old + change
+        self._set_weight(a, b, old, new)
+        if new > 0 and old <= 0:
+            self._union(a, b)
+        elif old > 0 and new <= 0:
+            self._dirty.add(self._find(a))
+        self._relabel_around(a, b)
+
+    def remove_node(self, node: int) -> None:
+        """Forget a node and every relationship it had."""
+        neighbours = self.adjacency.get(node)
+        if neighbours is None:
+            return
+        root = self._find(node)
+        # _set_weight empties neighbours, so keep who they were for relabelling.
+        others = list(neighbours)
+        for other, weight in list(neighbours.items()):
+            self._set_weight(node, other, weight, 0)
+        del self.adjacency[node]
+        del self.degree[node]
+        del self.strength[node]
+        del self.labels[node]
+        # The node stays in the union-find until its component is repaired.
+        self._dirty.add(root)
+        for other in others:
+            self._relabel(other)
+
+    def _set_weight(self, a: int, b: int, old: int, new: int) -> None:
+        for x, y in ((a, b), (b, a)):
+            if new:
+                self.adjacency[x][y] = new
+            else:
+                self.adjacency[x].pop(y, None)
+            self.strength[x] += new - old
+            if old == 0 and new != 0:
+                self.degree[x] += 1
+            elif old != 0 and new == 0:
+                self.degree[x] -= 1
+
+    def compact(self) -> None:
+        """Repair components and rebuild dicts that deletions left sparse."""
+        self._repair()
+        self.adjacency = {n: dict(adj) for n, adj in self.adjacency.items()}
+        self.degree = dict(self.degree)
+        self.strength = dict(self.strength)
+        self.labels = dict(self.labels)
+        self._parent = dict(self._parent)
+        self._members = dict(self._members)
+
+    # --- union-find ----------------------------------------------------
+
+    def _find(self, node: int) -> int:
+        parent = self._parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def _union(self, a: int, b: int) -> None:
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return
+        if len(self._members[ra]) < len(self._members[rb]):
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._members[ra] |= self._members.pop(rb)
+        if rb in self._dirty:
+            self._dirty.discard(rb)
+            self._dirty.add(ra)
+
+    def _repair(self) -> None:
+        """Split dirty components along their remaining positive edges."""
+        while self._dirty:
+            root = self._dirty.pop()
+            members = self._members.pop(root, None)
+            if members is None:
+                continue
+            live = [n for n in members if n in self.adjacency]
+            for n in members:
+                if n not in self.adjacency:
+                    del self._parent[n]
+            unseen = set(live)
+            for start in live:
+                if start not in unseen:
+                    continue
+                unseen.discard(start)
+                piece = {start}
+                queue: Deque[int] = deque([start])
+                while queue:
+                    node = queue.popleft()
+                    for other, weight in self.adjacency[node].items():
+                        if weight > 0 and other in unseen:
+                            unseen.discard(other)
+                            piece.add(other)
+                            queue.append(other)
+                for n in piece:
+                    self._parent[n] = start
+                self._members[start] = piece
+
+    # --- communities ---------------------------------------------------
+
+    def _best_label(self, node: int) -> int:
+        scores: Dict[int, int] = {}
+        for other, weight in self.adjacency[node].items():
+            if weight > 0:
+                label = self.labels[other]
+                scores[label] = scores.get(label, 0) + weight
+        if not scores:
+            return node
+        current = self.labels[node]
+        top = max(scores.values())
+        if scores.get(current) == top:
+            return current
+        return min(label for label, score in scores.items() if score == top)
+
+    def _relabel(self, node: int) -> bool:
+        label = self._best_label(node)
+        if label == self.labels[node]:
+            return False
+        self.labels[node] = label
+        return True
+
+    def _relabel_around(self, a: int, b: int) -> None:
+        """Propagate label changes outward from a changed edge, boundedly."""
+        queue: Deque[int] = deque([a, b])
+        budget = self.propagation_limit + 2
+        while queue and budget > 0:
+            node = queue.popleft()
+            budget -= 1
+            if node in self.adjacency and self._relabel(node):
+                queue.extend(
+                    other for other, weight in self.adjacency[node].items()
+                    if weight > 0
+                )
+
+    # --- queries -------------------------------------------------------
+
+    def weight(self, a: int, b: int) -> int:
+        return self.adjacency.get(a, {}).get(b, 0)
+
+    def component_of(self, node: int) -> Optional[int]:
+        """Return a representative id of ``node``'s positive component."""
+        if node not in self.adjacency:
+            return None
+        if self._dirty:
+            self._repair()
+        return self._find(node)
+
+    def component_size(self, node: int) -> int:
+        root = self.component_of(node)
+        return len(self._members[root]) if root is not None else 0
+
+    def components(self, min_size: int = 1) -> List[Set[int]]:
+        """Return positive components with at least ``min_size`` members."""
+        if self._dirty:
+            self._repair()
+        return [set(m) for m in self._members.values() if len(m) >= min_size]
+
+    def component_count(self) -> int:
+        if self._dirty:
+            self._repair()
+        return len(self._members)
+
+    def community_of(self, node: int) -> Optional[int]:
+        return self.labels.get(node)
+
+    def communities(self, min_size: int = 2) -> Dict[int, List[int]]:
+        """Group nodes by community label, dropping small groups."""
+        groups: Dict[int, List[int]] = {}
+        for node, label in self.labels.items():
+            groups.setdefault(label, []).append(node)
+        return {
+            label: nodes for label, nodes in groups.items()
+            if len(nodes) >= min_size
+        }
+
+    def hubs(self, k: int = 10, by: str = "strength") -> List[Tuple[int, int]]:
+        """Return the ``k`` highest ``(node, value)`` pairs by strength or degree."""
+        values = self.strength if by == "strength" else self.degree
+        return heapq.nlargest(k, values.items(), key=lambda item: item[1])
@@ -0,0 +1,628 @@
+"""Analytic throughput estimator for the profession supply chains in main.py.
+
+The estimator builds the production graph from ``PROFESSION_RECIPES`` and
+the merchant trade rules, then solves an expected-value (mean-field) model
+of the economy instead of sampling it:
+
+ - A small Markov chain over energy and charge gives the long-run share of
+   cycles in which a character performs professional work.
+ - Every character's inventory, credits and "needs resource" flag are
+   tracked as expectations and advanced one cycle at a time until the
+   per-cycle flows settle.
+
+Mood is assumed to stay above 50, which holds for the default economy.
+``cross_check`` runs the real ``World`` for a short window with printing
+suppressed and reports how far the model is from the measured rates.
+"""
+
+import argparse
+import os
+import random
+import time
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from main import (
+    INTERACTIONS, MERCHANT_BUYABLES, PROFESSION_RECIPES, PROFESSIONS, World,
+)
+
+CREDIT = "credit"  # pseudo item used for recipes that mint credits
+
+# Expected per-action drain with attributes drawn uniformly from 5..15.
+MEAN_ENERGY_DRAIN = 21 - 10
+MEAN_CHARGE_DRAIN = 25 - 10
+SELF_RESTORE = 10
+
+
+@dataclass
+class ActionMix:
+    """Long-run share of cycles spent on each kind of action."""
+    professional: float
+    self_care: float
+    interactive: float
+    targeted: float  # cycles lost to being another character's target
+
+
+@dataclass
+class ProfessionFlow:
+    """Steady-state work rates for one profession (per character)."""
+    profession: str
+    count: int
+    work_rate: float  # professional actions per cycle
+    productive_rate: float  # actions that actually produced something
+    starvation_rate: float  # share of professional actions without input
+
+    @property
+    def idle_rate(self) -> float:
+        """Share of cycles in which the character produced nothing."""
+        return 1.0 - self.productive_rate
+
+
+@dataclass
+class ItemFlow:
+    """Per-cycle movement of one item through the economy."""
+    item: str
+    produced: float = 0.0
+    consumed: float = 0.0
+    bought: float = 0.0  # merchants buying from other characters
+    sold: float = 0.0  # merchants selling to characters in need
+
+
+@dataclass
+class ThroughputEstimate:
+    """Flows, starvation and block output of a profession mix."""
+    professions: Dict[str, ProfessionFlow]
+    items: Dict[str, ItemFlow]
+    blocks_per_cycle: float
+    cycles: int  # cycles the rates were averaged over
+    mix: Optional[ActionMix] = None
+
+    def bottleneck(self) -> Optional[str]:
+        """Return the consuming profession that starves the most."""
+        consumers = [
+            p for p in self.professions.values()
+            if _primary_input(p.profession) is not None and p.work_rate > 0
+        ]
+        if not consumers:
+            return None
+        worst = max(consumers, key=lambda p: p.starvation_rate)
+        return worst.profession if worst.starvation_rate > 0 else None
+
+    def report(self) -> str:
+        """Return a plain-text table of the estimate."""
+        lines = [
+            f"{'profession':<20}{'n':>3}{'work/cyc':>10}{'made/cyc':>10}"
+            f"{'starved':>9}{'idle':>7}"
+        ]
+        for p in self.professions.values():
+            lines.append(
+                f"{p.profession:<20}{p.count:>3}{p.work_rate:>10.3f}"
+                f"{p.productive_rate:>10.3f}{p.starvation_rate:>8.0%}"
+                f"{p.idle_rate:>7.0%}"
+            )
+        lines.append("")
+        lines.append(
+            f"{'item':<14}{'made':>8}{'used':>8}{'bought':>8}{'sold':>8}"
+        )
+        for f in sorted(self.items.values(), key=lambda f: f.item):
+            lines.append(
+                f"{f.item:<14}{f.produced:>8.3f}{f.consumed:>8.3f}"
+                f"{f.bought:>8.3f}{f.sold:>8.3f}"
+            )
+        lines.append("")
+        lines.append(f"blocks per cycle: {self.blocks_per_cycle:.3f}")
+        bottleneck = self.bottleneck()
+        if bottleneck:
+            lines.append(f"bottleneck: {bottleneck}")
+        return "\n".join(lines)
+
+
+@dataclass
+class CrossCheck:
+    """Model estimate next to the rates measured from a simulated run."""
+    estimate: ThroughputEstimate
+    measured: ThroughputEstimate
+    runs: int
+    errors: Dict[str, float] = field(default_factory=dict)
+
+    def report(self) -> str:
+        lines = [
+            f"{'profession':<20}{'est work':>10}{'sim work':>10}"
+            f"{'est starve':>12}{'sim starve':>12}"
+        ]
+        for name, est in self.estimate.professions.items():
+            sim = self.measured.professions[name]
+            lines.append(
+                f"{name:<20}{est.work_rate:>10.3f}{sim.work_rate:>10.3f}"
+                f"{est.starvation_rate:>12.0%}{sim.starvation_rate:>12.0%}"
+            )
+        lines.append("")
+        lines.append(
+            f"blocks per cycle: estimate {self.estimate.blocks_per_cycle:.3f}"
+            f", simulated {self.measured.blocks_per_cycle:.3f}"
+        )
+        for metric, err in self.errors.items():
+            lines.append(f"{metric}: {err:.3f}")
+        return "\n".join(lines)
+
+
+def _primary_input(profession: str) -> Optional[str]:
+    recipes = PROFESSION_RECIPES.get(profession)
+    return recipes[0].consumes if recipes else None
+
+
+def default_mix() -> Dict[str, int]:
+    """Return the profession counts ``World`` uses by default."""
+    return {profession: 2 for profession in PROFESSIONS}
+
+
+def build_production_graph(
+    profession_counts: Dict[str, int]
+) -> Dict[str, Dict[str, List[str]]]:
+    """Map every item to the professions producing and consuming it.
+
+    Merchants are listed as consumers and producers of every item they
+    trade, and minted credits appear under the ``"credit"`` item.
+    """
+    graph: Dict[str, Dict[str, List[str]]] = {}
+
+    def node(item: str) -> Dict[str, List[str]]:
+        return graph.setdefault(item, {"producers": [], "consumers": []})
+
+    for profession, count in profession_counts.items():
+        if count <= 0:
+            continue
+        if profession == "Merchant":
+            for item in sorted(MERCHANT_BUYABLES):
+                node(item)["producers"].append(profession)
+                node(item)["consumers"].append(profession)
+            continue
+        recipes = PROFESSION_RECIPES.get(profession)
+        if recipes is None:
+            node(CREDIT)["producers"].append(profession)
+            continue
+        for recipe in recipes:
+            if recipe.consumes is not None:
+                node(recipe.consumes)["consumers"].append(profession)
+            if recipe.produces is not None:
+                node(recipe.produces)["producers"].append(profession)
+            if recipe.credits:
+                node(CREDIT)["producers"].append(profession)
+    return graph
+
+
+def interaction_success_rate() -> float:
+    """Chance that a random interaction passes its initiator check.
+
+    Extraversion and agreeableness are enumerated over the 5..15 range
+    characters are created with.
+    """
+    values = range(5, 16)
+    passed = 0
+    total = 0
+    for interaction in INTERACTIONS:
+        for extraversion in values:
+            for agreeableness in values:
+                stub = SimpleNamespace(attributes={
+                    "extraversion": extraversion,
+                    "agreeableness": agreeableness,
+                })
+                passed += bool(interaction.initiator_check(stub))
+                total += 1
+    return passed / total
+
+
+@lru_cache(maxsize=None)
+def action_mix(resolution: int = 5, iterations: int = 400) -> ActionMix:
+    """Solve the energy/charge Markov chain of ``Character.choose_action``.
+
+    Energy and charge are bucketed in steps of ``resolution``; fractional
+    drains are split between the two neighbouring buckets.
+    """
+    size = 100 // resolution + 1
+    low = 50 // resolution  # buckets below this are "< 50"
+    success = interaction_success_rate()
+
+    def moves(level: int, delta: float) -> List[Tuple[int, float]]:
+        target = min(100.0, max(0.0, level * resolution + delta)) / resolution
+        base = int(target)
+        frac = target - base
+        if frac == 0 or base + 1 >= size:
+            return [(min(base, size - 1), 1.0)]
+        return [(base, 1.0 - frac), (base + 1, frac)]
+
+    transitions: List[List[Tuple[int, float]]] = []
+    choice: List[Tuple[float, float, float]] = []
+    for e in range(size):
+        for c in range(size):
+            self_w = 10 + (30 if e < low else 0) + (30 if c < low else 0)
+            total = self_w + 20
+            p_prof = 10 / total
+            p_inter = 10 / total * success
+            p_self = 1.0 - p_prof - p_inter
+            choice.append((p_prof, p_self, p_inter))
+            row: Dict[int, float] = {}
+            for ne, pe in moves(e, -MEAN_ENERGY_DRAIN):
+                for nc, pc in moves(c, -MEAN_CHARGE_DRAIN):
+                    key = ne * size + nc
+                    row[key] = row.get(key, 0.0) + p_prof * pe * pc
+            for ne, pe in moves(e, SELF_RESTORE):
+                for nc, pc in moves(c, SELF_RESTORE):
+                    key = ne * size + nc
+                    row[key] = row.get(key, 0.0) + p_self * pe * pc
+            key = e * size + c
+            row[key] = row.get(key, 0.0) + p_inter
+            transitions.append(list(row.items()))
+
+    dist = [0.0] * (size * size)
+    dist[-1] = 1.0  # characters start at full energy and charge
+    for _ in range(iterations):
+        nxt = [0.0] * len(dist)
+        for state, mass in enumerate(dist):
+            if mass:
+                for target, p in transitions[state]:
+                    nxt[target] += mass * p
+        converged = max(abs(a - b) for a, b in zip(dist, nxt)) < 1e-9
+        dist = nxt
+        if converged:
+            break
+
+    prof = sum(m * choice[s][0] for s, m in enumerate(dist))
+    self_care = sum(m * choice[s][1] for s, m in enumerate(dist))
+    inter = sum(m * choice[s][2] for s, m in enumerate(dist))
+    # Each successful interaction also uses up a target's turn, so only
+    # 1 / (1 + inter) of the characters act on their own each cycle.
+    acting = 1.0 / (1.0 + inter)
+    return ActionMix(
+        professional=prof * acting,
+        self_care=self_care * acting,
+        interactive=inter * acting,
+        targeted=inter * acting,
+    )
+
+
+class _FluidEconomy:
+    """Expected-value state of every character, advanced cycle by cycle."""
+
+    def __init__(self, profession_counts: Dict[str, int], rate: float):
+        self.rate = rate
+        self.professions: List[str] = []
+        for profession, count in profession_counts.items():
+            self.professions.extend([profession] * count)
+        n = len(self.professions)
+        self.inventory: List[Dict[str, float]] = [{} for _ in range(n)]
+        self.credits: List[float] = [10.0] * n
+        self.needs: List[float] = [0.0] * n
+        self.merchants = [
+            i for i, p in enumerate(self.professions) if p == "Merchant"
+        ]
+        self.reset_totals()
+
+    def reset_totals(self) -> None:
+        self.items: Dict[str, ItemFlow] = {}
+        self.productive: Dict[str, float] = {}
+        self.starved: Dict[str, float] = {}
+        self.blocks = 0.0
+
+    def _flow(self, item: str) -> ItemFlow:
+        flow = self.items.get(item)
+        if flow is None:
+            flow = self.items[item] = ItemFlow(item)
+        return flow
+
+    def step(self) -> None:
+        r = self.rate
+        for m in self.merchants:
+            self._merchant(m, r)
+        for i, profession in enumerate(self.professions):
+            if profession != "Merchant":
+                self._work(i, profession, r)
+            # A block is minted on the next professional action once credits
+            # reach 10; spreading that over the expected credits keeps both
+            # the opening burst and the long-run rate (income / 10) right.
+            minted = r * min(1.0, max(0.0, self.credits[i]) / 10)
+            self.blocks += minted
+            self.credits[i] -= 10 * minted
+
+    def _merchant(self, m: int, r: float) -> None:
+        stock = self.inventory[m]
+        for i, inv in enumerate(self.inventory):
+            if i == m:
+                continue
+            budget = min(1.0, max(0.0, self.credits[m]))
+            remaining = 1.0
+            for item in list(inv):
+                if item not in MERCHANT_BUYABLES or inv[item] <= 0:
+                    continue
+                take = remaining * min(1.0, inv[item])
+                remaining -= take
+                qty = take * budget * r
+                inv[item] -= qty
+                stock[item] = stock.get(item, 0.0) + qty
+                self.credits[i] += qty
+                self.credits[m] -= qty
+                self._flow(item).bought += qty
+                if remaining <= 0:
+                    break
+        for i, profession in enumerate(self.professions):
+            need = _primary_input(profession)
+            if i == m or need is None or not self.needs[i]:
+                continue
+            have = min(1.0, max(0.0, stock.get(need, 0.0)))
+            qty = self.needs[i] * have * min(1.0, max(0.0, self.credits[i])) * r
+            if qty <= 0:
+                continue
+            stock[need] -= qty
+            inv = self.inventory[i]
+            inv[need] = inv.get(need, 0.0) + qty
+            self.credits[i] -= qty
+            self.credits[m] += qty
+            self.needs[i] -= qty
+            self._flow(need).sold += qty
+
+    def _work(self, i: int, profession: str, r: float) -> None:
+        inv = self.inventory[i]
+        recipes = PROFESSION_RECIPES.get(profession)
+        if recipes is None:
+            self.credits[i] += r
+            self.productive[profession] = self.productive.get(profession, 0.0) + r
+            self._flow(CREDIT).produced += r
+            return
+        remaining = 1.0  # chance no earlier recipe has fired
+        for recipe in recipes:
+            if recipe.consumes is None:
+                share = remaining
+            else:
+                share = remaining * min(1.0, max(0.0, inv.get(recipe.consumes, 0.0)))
+            remaining -= share
+            qty = share * r
+            if qty <= 0:
+                continue
+            if recipe.consumes is not None:
+                inv[recipe.consumes] -= qty
+                self._flow(recipe.consumes).consumed += qty
+            if recipe.produces is not None:
+                inv[recipe.produces] = inv.get(recipe.produces, 0.0) + qty
+                self._flow(recipe.produces).produced += qty
+            if recipe.credits:
+                self.credits[i] += recipe.credits * qty
+                self._flow(CREDIT).produced += recipe.credits * qty
+            self.productive[profession] = self.productive.get(profession, 0.0) + qty
+        starved = remaining * r
+        if starved > 0:
+            self.starved[profession] = self.starved.get(profession, 0.0) + starved
+            self.needs[i] += starved * (1.0 - self.needs[i])
+
+
+def _summarize(
+    profession_counts: Dict[str, int],
+    work_rate: Optional[float],
+    worked: Dict[str, float],
+    productive: Dict[str, float],
+    starved: Dict[str, float],
+    items: Dict[str, ItemFlow],
+    blocks: float,
+    cycles: int,
+    mix: Optional[ActionMix] = None,
+) -> ThroughputEstimate:
+    """Turn totals over ``cycles`` into per-character, per-cycle rates."""
+    professions = {}
+    for profession, count in profession_counts.items():
+        if count <= 0:
+            continue
+        made = productive.get(profession, 0.0) / (count * cycles)
+        lacking = starved.get(profession, 0.0) / (count * cycles)
+        if work_rate is None:
+            work = worked.get(profession, 0.0) / (count * cycles)
+        else:
+            work = work_rate
+        professions[profession] = ProfessionFlow(
+            profession=profession,
+            count=count,
+            work_rate=work,
+            productive_rate=made,
+            starvation_rate=lacking / work if work else 0.0,
+        )
+    for flow in items.values():
+        flow.produced /= cycles
+        flow.consumed /= cycles
+        flow.bought /= cycles
+        flow.sold /= cycles
+    return ThroughputEstimate(
+        professions=professions,
+        items=items,
+        blocks_per_cycle=blocks / cycles,
+        cycles=cycles,
+        mix=mix,
+    )
+
+
+def estimate(
+    profession_counts: Optional[Dict[str, int]] = None,
+    warmup: Optional[int] = None,
+    cycles: int = 100,
+    tolerance: float = 1e-3,
+    max_cycles: int = 5000,
+) -> ThroughputEstimate:
+    """Estimate steady-state flows for a profession mix.
+
+    With ``warmup`` unset the model runs until two consecutive windows of
+    ``cycles`` agree within ``tolerance``; otherwise it averages exactly
+    the window ``[warmup, warmup + cycles)`` so it can be compared with a
+    simulated run of the same length.
+    """
+    if profession_counts is None:
+        profession_counts = default_mix()
+    mix = action_mix()
+    economy = _FluidEconomy(profession_counts, mix.professional)
+
+    if warmup is not None:
+        for _ in range(warmup):
+            economy.step()
+        economy.reset_totals()
+        for _ in range(cycles):
+            economy.step()
+    else:
+        previous: Optional[Tuple[float, ...]] = None
+        elapsed = 0
+        while True:
+            economy.reset_totals()
+            for _ in range(cycles):
+                economy.step()
+            elapsed += cycles
+            signature = (economy.blocks,) + tuple(
+                economy.productive.get(p, 0.0) for p in profession_counts
+            )
+            if previous is not None and all(
+                abs(a - b) <= tolerance * cycles for a, b in zip(signature, previous)
+            ):
+                break
+            if elapsed >= max_cycles:
+                break
+            previous = signature
+
+    return _summarize(
+        profession_counts, mix.professional, {}, economy.productive,
+        economy.starved, economy.items, economy.blocks, cycles, mix,
+    )
+
+
+def _instrument(world: World, worked: Dict[str, float],
+                productive: Dict[str, float], starved: Dict[str, float],
+                items: Dict[str, ItemFlow]) -> None:
+    """Wrap each character's professional action to count its outcome."""
+
+    def wrap(char):
+        original = char.perform_professional_action
+
+        def counted(cycle, chain, world):
+            worked[char.profession] = worked.get(char.profession, 0.0) + 1
+            if char.profession == "Merchant":
+                return original(cycle, chain, world)
+            before = dict(char.inventory)
+            credits = char.credits
+            previous_need = char.needs_resource
+            char.needs_resource = None
+            original(cycle, chain, world)
+            if char.needs_resource is not None:
+                starved[char.profession] = starved.get(char.profession, 0.0) + 1
+                return
+            char.needs_resource = previous_need
+            productive[char.profession] = productive.get(char.profession, 0.0) + 1
+            for item in set(before) | set(char.inventory):
+                delta = char.inventory.get(item, 0) - before.get(item, 0)
+                if delta:
+                    flow = items.setdefault(item, ItemFlow(item))
+                    if delta > 0:
+                        flow.produced += delta
+                    else:
+                        flow.consumed -= delta
+            # Blocks may have spent credits; count the minted ones only.
+            minted = (char.credits - credits) % 10
+            if minted:
+                items.setdefault(CREDIT, ItemFlow(CREDIT)).produced += minted
+
+        char.perform_professional_action = counted
+
+    for char in world.characters:
+        wrap(char)
+
+
+def simulate(
+    profession_counts: Optional[Dict[str, int]] = None,
+    warmup: int = 100,
+    cycles: int = 200,
+    runs: int = 3,
+    seed: Optional[int] = None,
+) -> ThroughputEstimate:
+    """Measure the same rates as ``estimate`` from real ``World`` runs."""
+    if profession_counts is None:
+        profession_counts = default_mix()
+    if seed is not None:
+        random.seed(seed)
+    worked: Dict[str, float] = {}
+    productive: Dict[str, float] = {}
+    starved: Dict[str, float] = {}
+    items: Dict[str, ItemFlow] = {}
+    blocks = 0
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(runs):
+            world = World(profession_counts)
+            for _ in range(warmup):
+                world.run_cycle()
+            _instrument(world, worked, productive, starved, items)
+            start = len(world.chain)
+            for _ in range(cycles):
+                world.run_cycle()
+            blocks += len(world.chain) - start
+    return _summarize(
+        profession_counts, None, worked, productive, starved, items, blocks,
+        cycles * runs,
+    )
+
+
+def cross_check(
+    profession_counts: Optional[Dict[str, int]] = None,
+    warmup: int = 100,
+    cycles: int = 200,
+    runs: int = 3,
+    seed: Optional[int] = None,
+) -> CrossCheck:
+    """Compare the model with short simulated runs over the same window."""
+    est = estimate(profession_counts, warmup=warmup, cycles=cycles)
+    sim = simulate(profession_counts, warmup, cycles, runs, seed)
+    work_err = max(
+        abs(e.work_rate - sim.professions[name].work_rate)
+        for name, e in est.professions.items()
+    )
+    starve_err = max(
+        abs(e.starvation_rate - sim.professions[name].starvation_rate)
+        for name, e in est.professions.items()
+    )
+    return CrossCheck(
+        estimate=est,
+        measured=sim,
+        runs=runs,
+        errors={
+            "max work rate error": work_err,
+            "max starvation error": starve_err,
+            "blocks per cycle error": abs(
+                est.blocks_per_cycle - sim.blocks_per_cycle
+            ),
+        },
+    )
+
+
+def _parse_counts(text: str) -> Dict[str, int]:
+    counts = default_mix()
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, value = part.partition("=")
+        counts[name.strip()] = int(value)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--counts", default="",
+        help="comma separated overrides, e.g. 'Farmer=4,Cook=3'",
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="also compare against short simulated runs",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    counts = _parse_counts(args.counts)
+    started = time.perf_counter()
+    result = estimate(counts)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(result.report())
+    print(f"\nestimated in {elapsed:.1f} ms")
+    if args.check:
+        print()
+        print(cross_check(counts, seed=args.seed).report())
@@ -0,0 +1,14 @@
+import matchups
+import pyRL_uta0628c as rl
+
+
+def test_batch_derivation_matches_entity_for_every_toon():
+    matchups._load_tables()
+    toons = []
+    for data in rl.TOONS_DATA.values():
+        toon = rl.Entity(data["Name"], is_player=True)
+        toon.load_char_data(data)
+        toons.append(toon)
+    rows = rl.derive_player_stats([[t.current_attributes[a] for a in rl.ATTRIBUTES] for t in toons])
+    for toon, row in zip(toons, rows):
+        assert dict(zip(rl.DERIVED_STATS, row)) == toon._raw_derived
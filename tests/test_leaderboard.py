@@ -0,0 +1,32 @@
+import os
+
+import pyRL_uta0628c as rl
+
+
+def _entry(i):
+    return {'timestamp': f"2024-01-01 00:00:{i:02d}", 'toon_name': "Athena", 'opponent_name': "Goblin",
+            'fight_duration_seconds': 10.0, 'kills': 1, 'damage_done': 50, 'damage_received': 5}
+
+
+def _open(tmp_path):
+    return rl.Leaderboard(str(tmp_path / "lb.csv"), str(tmp_path / "lb.db"), segment_rows=3)
+
+
+def test_rotation_after_pruned_segment_and_rebuild_keeps_archives(tmp_path):
+    board = _open(tmp_path)
+    board.record_many(_entry(i) for i in range(7))
+    board.close()
+    os.remove(tmp_path / "lb.0001.csv")
+    os.remove(tmp_path / "lb.db")
+
+    board = _open(tmp_path)
+    assert board.total_fights() == 4
+    board.record_many(_entry(i) for i in range(7, 10))
+    assert board.total_fights() == 7
+    board.close()
+
+    os.remove(tmp_path / "lb.db")
+    board = _open(tmp_path)
+    assert board.total_fights() == 7
+    assert board.toon("Athena")['fights'] == 7
+    board.close()
@@ -0,0 +1,10 @@
+import pyRL_uta0628c as rl
+
+
+def test_bad_cell_in_declared_int_column_skips_only_its_row(tmp_path, capsys):
+    path = tmp_path / "npcs.csv"
+    path.write_text("npcID,Name,HP\n1,Goblin,100\n2,Orc,lots\n3,Troll,300\n", encoding="utf-8")
+    rows = rl.load_csv_data(str(path), "npcID", rl.CSV_SCHEMAS["npcs"])
+    assert sorted(rows) == [1, 3]
+    warning = capsys.readouterr().out
+    assert "line 3" in warning and "column HP" in warning
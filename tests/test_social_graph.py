@@ -0,0 +1,11 @@
+from social_graph import SocialGraph
+
+
+def test_remove_node_relabels_former_neighbours():
+    graph = SocialGraph()
+    graph.apply_change(5, 2, 5)
+    graph.apply_change(5, 3, 5)
+    graph.apply_change(2, 3, -1)
+    graph.remove_node(5)
+    assert sorted(sorted(c) for c in graph.components()) == [[2], [3]]
+    assert graph.communities(1) == {2: [2], 3: [3]}
@@ -0,0 +1,365 @@
+"""Headless round-robin and Swiss tournaments between pyRL characters.
+
+Entrants are the default toons of ``pyRL_toons.csv`` and the saved
+characters of the save store (``--synthetic N`` adds N jittered copies of
+the toons for load testing). Every pairing plays ``games`` fights on the
+virtual clock of ``CombatEngine``, the two entrants swapping sides each
+game. Both sides follow the same key policy; the side in the opponent seat
+gets it through ``SeatPolicy``, which also runs its item cooldowns, since
+the engine only does that for the player seat. A fight still going after
+``max_time`` is a draw.
+
+Round robin uses the circle method, so every entrant plays once per round.
+Swiss rounds pair entrants on equal match points, highest rated first,
+avoiding rematches where possible, with a bye (one match point) for the
+lowest-ranked entrant without one when the field is odd. Each game updates
+Elo ratings, all of a round's games against the ratings the round started
+with, so the order games finish in does not matter. After every round the
+standings CSV is rewritten.
+
+Pairings are spread over a process pool in chunks; every pairing seeds
+``random`` from the run seed and its own key, so results do not depend on
+the number of workers. Without ``--seed`` the run seed is drawn fresh and
+printed.
+
+Run ``python tournament.py --format swiss --synthetic 2000`` for a large
+field, or ``python tournament.py --format round-robin`` for the toons and
+saves alone.
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import matchups
+import pyRL_uta0628c as rl
+
+FORMATS = ("round-robin", "swiss")
+ELO_START = 1500.0
+ELO_K = 24.0
+DEFAULT_GAMES = 2
+DEFAULT_MAX_TIME = 300.0  # virtual seconds before a fight is a draw
+DEFAULT_STANDINGS = "pyRL_tournament.csv"
+CHUNKS_PER_WORKER = 4  # pool tasks per worker and round
+SYNTHETIC_JITTER = 0.25  # largest relative change of a synthetic entrant's attributes
+
+# (entrant a, entrant b, games a won, games b won, draws)
+PairingResult = Tuple[int, int, int, int, int]
+
+
+@dataclass(frozen=True)
+class Entrant:
+    name: str
+    source: str  # "toon", "saved" or "synthetic"
+    data: Dict[str, object]
+
+
+@dataclass
+class Standing:
+    entrant: int
+    name: str
+    source: str
+    rating: float = ELO_START
+    points: float = 0.0  # match points: 1 a pairing won, 0.5 tied, 1 a bye
+    wins: int = 0  # games
+    losses: int = 0
+    draws: int = 0
+    byes: int = 0
+    opponents: Set[int] = field(default_factory=set)
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.losses + self.draws
+
+    def row(self, rank: int) -> Dict[str, object]:
+        return {
+            "rank": rank, "name": self.name, "source": self.source,
+            "rating": round(self.rating, 1), "points": self.points, "games": self.games,
+            "wins": self.wins, "losses": self.losses, "draws": self.draws, "byes": self.byes,
+        }
+
+
+class SeatPolicy:
+    """``opponent_policy`` that plays a character in the opponent seat by keys.
+
+    Picks the action for the next key of ``keys`` each time the bar fills,
+    as ``ScriptedPolicy`` does for the player seat, and first runs the
+    seat's item cooldowns up to the engine clock.
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        self.keys = list(keys)
+        self.turns = 0
+        self.clock = 0.0
+
+    def __call__(self, engine: "rl.CombatEngine") -> Optional[int]:
+        seat = engine.opponent
+        seat.tick_item_cooldowns(engine.elapsed - self.clock)
+        self.clock = engine.elapsed
+        key = self.keys[self.turns % len(self.keys)]
+        self.turns += 1
+        # None (a weapon on cooldown) makes the attack miss its turn, as a
+        # fizzle does for the player seat.
+        return seat.get_action_for_key(key)
+
+
+def load_entrants(saved: bool = True, synthetic: int = 0, seed: Optional[int] = None) -> List[Entrant]:
+    matchups._load_tables()
+    entrants = [Entrant(name, "toon", dict(data)) for name, data in rl.TOONS_DATA.items()]
+    if saved:
+        for data in rl.load_saved_characters():
+            entrants.append(Entrant(f"{data.get('Name', 'Saved')} #{data.get('SaveID')}", "saved", data))
+    rng = random.Random(seed)
+    toons = list(rl.TOONS_DATA.values())
+    for i in range(synthetic):
+        data = dict(rng.choice(toons))
+        for attr in rl.ATTRIBUTES:
+            if data.get(attr):
+                data[attr] = max(1, round(data[attr] * (1 + rng.uniform(-SYNTHETIC_JITTER, SYNTHETIC_JITTER))))
+        data["Name"] = f"{data['Name']}~{i + 1}"
+        entrants.append(Entrant(data["Name"], "synthetic", data))
+    return entrants
+
+
+# Worker state: one character template per entrant, cloned for every fight.
+_TEMPLATES: List["rl.Entity"] = []
+
+
+def _init_worker(entrants: Sequence[Entrant]) -> None:
+    matchups._load_tables()
+    _TEMPLATES.clear()
+    for entrant in entrants:
+        template = rl.Entity(entrant.name, is_player=True)
+        template.load_char_data(entrant.data, is_saved_char=entrant.source == "saved")
+        _TEMPLATES.append(template)
+
+
+def play_game(a: int, b: int, keys: Sequence[str], max_time: float) -> Optional[bool]:
+    """Fight entrant ``a`` (player seat) against ``b``; True if a won, None on a draw."""
+    engine = rl.CombatEngine(_TEMPLATES[a].clone(), _TEMPLATES[b].clone(),
+                             rl.ScriptedPolicy(keys), SeatPolicy(keys))
+    result = engine.run(None, max_time)
+    return None if result.timed_out else result.player_won
+
+
+def _play_chunk(args: Tuple) -> List[PairingResult]:
+    seed, round_no, pairs, games, keys, max_time = args
+    results = []
+    for a, b in pairs:
+        random.seed(f"{seed}:{round_no}:{a}:{b}")
+        a_wins = b_wins = draws = 0
+        for game in range(games):
+            if game % 2:
+                won = play_game(b, a, keys, max_time)
+                won = None if won is None else not won
+            else:
+                won = play_game(a, b, keys, max_time)
+            if won is None:
+                draws += 1
+            elif won:
+                a_wins += 1
+            else:
+                b_wins += 1
+        results.append((a, b, a_wins, b_wins, draws))
+    return results
+
+
+def expected_score(rating: float, other: float) -> float:
+    return 1.0 / (1.0 + 10.0 ** ((other - rating) / 400.0))
+
+
+def apply_results(standings: List[Standing], results: Sequence[PairingResult], k: float = ELO_K) -> None:
+    """Score a round: match points, game tallies and Elo, against the round's starting ratings."""
+    deltas: Dict[int, float] = {}
+    for a, b, a_wins, b_wins, draws in results:
+        sa, sb = standings[a], standings[b]
+        games = a_wins + b_wins + draws
+        score = a_wins + 0.5 * draws
+        change = k * (score - games * expected_score(sa.rating, sb.rating))
+        deltas[a] = deltas.get(a, 0.0) + change
+        deltas[b] = deltas.get(b, 0.0) - change
+        if a_wins != b_wins:
+            (sa if a_wins > b_wins else sb).points += 1.0
+        else:
+            sa.points += 0.5
+            sb.points += 0.5
+        sa.wins += a_wins
+        sa.losses += b_wins
+        sb.wins += b_wins
+        sb.losses += a_wins
+        sa.draws += draws
+        sb.draws += draws
+        sa.opponents.add(b)
+        sb.opponents.add(a)
+    for entrant, change in deltas.items():
+        standings[entrant].rating += change
+
+
+def ranked(standings: Sequence[Standing]) -> List[Standing]:
+    return sorted(standings, key=lambda s: (-s.points, -s.rating, s.name))
+
+
+def round_robin_rounds(count: int) -> Iterator[List[Tuple[int, int]]]:
+    """Circle method: ``count - 1`` rounds (``count`` if odd), each entrant once per round."""
+    seats: List[Optional[int]] = list(range(count)) + ([None] if count % 2 else [])
+    half = len(seats) // 2
+    for _ in range(len(seats) - 1):
+        yield [
+            (a, b) for a, b in zip(seats[:half], reversed(seats[half:]))
+            if a is not None and b is not None
+        ]
+        seats = [seats[0], seats[-1]] + seats[1:-1]
+
+
+def swiss_pairs(standings: Sequence[Standing]) -> Tuple[List[Tuple[int, int]], Optional[int]]:
+    """Pair down the ranking, skipping rematches where possible; returns (pairs, bye)."""
+    order = ranked(standings)
+    bye = None
+    if len(order) % 2:
+        for i in range(len(order) - 1, -1, -1):
+            if not order[i].byes:
+                break
+        else:
+            i = len(order) - 1
+        bye = order.pop(i).entrant
+    pairs = []
+    while order:
+        top = order.pop(0)
+        j = next((j for j, other in enumerate(order) if other.entrant not in top.opponents), 0)
+        pairs.append((top.entrant, order.pop(j).entrant))
+    return pairs, bye
+
+
+def write_standings(standings: Sequence[Standing], path: str) -> None:
+    # Written aside and moved into place, so a reader never sees half a table.
+    rows = [s.row(rank) for rank, s in enumerate(ranked(standings), 1)]
+    if not rows:
+        return
+    temp = f"{path}.tmp"
+    with open(temp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp, path)
+
+
+def _chunks(pairs: List[Tuple[int, int]], count: int) -> List[List[Tuple[int, int]]]:
+    size = max(1, math.ceil(len(pairs) / count))
+    return [pairs[i:i + size] for i in range(0, len(pairs), size)]
+
+
+def run_tournament(
+    entrants: Sequence[Entrant],
+    fmt: str = "swiss",
+    rounds: Optional[int] = None,
+    games: int = DEFAULT_GAMES,
+    policy: str = "rotation",
+    max_time: float = DEFAULT_MAX_TIME,
+    seed: Optional[int] = None,
+    workers: Optional[int] = None,
+    standings_path: Optional[str] = DEFAULT_STANDINGS,
+    progress=None,
+) -> List[Standing]:
+    """Play the tournament and return the final standings, best first."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; choose from {', '.join(FORMATS)}")
+    if policy not in matchups.POLICIES:
+        raise ValueError(f"unknown policy {policy!r}; choose from {', '.join(matchups.POLICIES)}")
+    if len(entrants) < 2:
+        raise ValueError("a tournament needs at least two entrants")
+    keys = matchups.POLICIES[policy]
+    if seed is None:
+        seed = matchups.fresh_seed()
+    standings = [Standing(i, e.name, e.source) for i, e in enumerate(entrants)]
+    if fmt == "round-robin":
+        schedule = round_robin_rounds(len(entrants))
+        total = len(entrants) - 1 + len(entrants) % 2
+    else:
+        schedule = None
+        total = math.ceil(math.log2(len(entrants)))
+    if rounds is not None:
+        total = min(total, rounds) if fmt == "round-robin" else rounds
+    workers = workers or os.cpu_count() or 1
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(list(entrants),))
+    else:
+        _init_worker(entrants)
+    try:
+        for round_no in range(1, total + 1):
+            bye = None
+            if schedule is not None:
+                pairs = next(schedule)
+            else:
+                pairs, bye = swiss_pairs(standings)
+            tasks = [(seed, round_no, chunk, games, keys, max_time)
+                     for chunk in _chunks(pairs, workers * CHUNKS_PER_WORKER)]
+            if pool is None:
+                chunk_results = map(_play_chunk, tasks)
+            else:
+                chunk_results = pool.map(_play_chunk, tasks)
+            apply_results(standings, [r for chunk in chunk_results for r in chunk])
+            if bye is not None:
+                standings[bye].points += 1.0
+                standings[bye].byes += 1
+            if standings_path:
+                write_standings(standings, standings_path)
+            if progress is not None:
+                progress(round_no, total, standings)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return ranked(standings)
+
+
+def format_standings(standings: Sequence[Standing], top: int = 20) -> str:
+    width = max(8, max(len(s.name) for s in standings[:top]) + 1)
+    lines = [f"{'#':>4} {'name':<{width}}{'rating':>8}{'points':>8}   W-L-D"]
+    for rank, s in enumerate(standings[:top], 1):
+        lines.append(f"{rank:>4} {s.name:<{width}}{s.rating:>8.1f}{s.points:>8.1f}   "
+                     f"{s.wins}-{s.losses}-{s.draws}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--format", default="swiss", choices=FORMATS)
+    parser.add_argument("--rounds", type=int, default=None,
+                        help="swiss: default log2(entrants); round-robin: stop early")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="fights per pairing")
+    parser.add_argument("--policy", default="rotation", choices=list(matchups.POLICIES))
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME)
+    parser.add_argument("--no-saved", action="store_true", help="leave saved characters out")
+    parser.add_argument("--synthetic", type=int, default=0, help="add this many jittered toons")
+    parser.add_argument("--standings", default=DEFAULT_STANDINGS, help="CSV rewritten every round")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None, help="default: a fresh one, printed")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else matchups.fresh_seed()
+
+    entrants = load_entrants(not args.no_saved, args.synthetic, seed)
+    started = time.perf_counter()
+
+    def progress(round_no: int, total: int, standings: Sequence[Standing]) -> None:
+        print(f"round {round_no}/{total} done, {time.perf_counter() - started:.1f} s")
+
+    try:
+        final = run_tournament(entrants, args.format, args.rounds, args.games, args.policy,
+                               args.max_time, seed, args.workers, args.standings, progress)
+    except ValueError as e:
+        sys.exit(str(e))
+    elapsed = time.perf_counter() - started
+    print(format_standings(final, args.top))
+    fights = sum(s.games for s in final) // 2
+    print(f"{len(entrants)} entrants, {fights} fights in {elapsed:.1f} s ({fights / elapsed:.0f}/s), seed {seed}")
+    if args.standings:
+        print(f"standings in {os.path.abspath(args.standings)}")